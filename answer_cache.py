@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Semantic Answer Cache ---
+# Many /ask_ai questions are paraphrases of each other ("what does the Quran
+# say about patience" / "quran on patience and perseverance"), and each one used
+# to pay for a full LLM generation. Answers are cached with the question's
+# embedding and the verses retrieved for it. A new question reuses an answer
+# when its embedding is close enough to a cached question's AND its retrieved
+# verses overlap enough: two similar-sounding questions answered from
+# different verses are not treated as the same question.
+#
+# Entries live in memory (LRU + TTL, scored with one matrix-vector product)
+# and, optionally, in a SQLite file that survives restarts and is shared by all
+# workers: each worker pulls rows written by the others every 'sync_seconds'.
+
+
+def verse_overlap(a, b):
+    """Shared fraction of two retrieved verse sets (1.0 = the same verses)."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / max(len(a), len(b))
+
+
+class SemanticAnswerCache:
+    def __init__(self, max_entries=1000, ttl_seconds=7 * 86400, path=None, threshold=0.9, min_overlap=0.5,
+                 sync_seconds=30.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.sync_seconds = sync_seconds
+        self.hits = 0
+        self.misses = 0
+        self.rejected_overlap = 0  # a similar question was cached, but answered from other verses
+        self._entries = OrderedDict()  # id -> (namespace, created, query, verse_ids, answer, vector)
+        self._matrices = {}  # namespace -> (ids, unit vectors), rebuilt after changes
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_id = -1  # ids of entries that are not persisted
+        self._last_synced = 0
+        self._synced_at = 0.0
+        self._writes = 0
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            try:
+                with self._db() as db:
+                    db.execute("CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "namespace TEXT, created REAL, query TEXT, verses TEXT, answer TEXT, vector BLOB)")
+                self._sync()
+                print(f"✅ Answer cache loaded ({len(self._entries)} answers from '{path}').")
+            except sqlite3.Error as e:
+                print(f"⚠️ Answer cache file unusable ({e}); answers are cached in memory only.")
+                self.path = None
+
+    def _db(self):
+        # sqlite3 connections may not be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=1.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def _expired(self, created_at):
+        return self.ttl_seconds and time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, entry_id, entry):
+        # Caller holds the lock
+        if entry_id in self._entries:
+            return
+        self._entries[entry_id] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrices.clear()
+
+    def _sync(self):
+        """Pulls answers written since the last sync (by any worker) from the SQLite file."""
+        rows = self._db().execute(
+            "SELECT id, namespace, created, query, verses, answer, vector FROM answers "
+            "WHERE id > ? AND created >= ? ORDER BY id DESC LIMIT ?",
+            (self._last_synced, time.time() - self.ttl_seconds if self.ttl_seconds else 0, self.max_entries),
+        ).fetchall()
+        with self._lock:
+            for row_id, namespace, created, query, verses, answer, vector in reversed(rows):
+                vector = np.frombuffer(vector, dtype=np.float32)
+                self._remember(row_id, (namespace, created, query, frozenset(json.loads(verses)), answer, vector))
+                self._last_synced = max(self._last_synced, row_id)
+            self._synced_at = time.time()
+
+    def _matrix(self, namespace):
+        # Caller holds the lock
+        if namespace not in self._matrices:
+            ids = [i for i, entry in self._entries.items() if entry[0] == namespace]
+            vectors = [self._entries[i][5] for i in ids]
+            self._matrices[namespace] = (ids, np.vstack(vectors) if vectors else None)
+        return self._matrices[namespace]
+
+    def get(self, namespace, vector, verse_ids):
+        """
+        Cached answer for a question with embedding 'vector' whose retrieval
+        returned 'verse_ids', or None. 'namespace' separates embedding models.
+        """
+        if self.path and time.time() - self._synced_at > self.sync_seconds:
+            try:
+                self._sync()
+            except sqlite3.Error:
+                pass
+
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        verse_ids = frozenset(verse_ids)
+        with self._lock:
+            ids, matrix = self._matrix(namespace)
+            rejected = False
+            if matrix is not None:
+                scores = matrix @ vector
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    entry_id = ids[i]
+                    entry = self._entries.get(entry_id)
+                    if entry is None or self._expired(entry[1]):
+                        continue
+                    if verse_overlap(entry[3], verse_ids) < self.min_overlap:
+                        rejected = True
+                        continue
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry[4]
+            self.misses += 1
+            self.rejected_overlap += rejected
+        return None
+
+    def put(self, namespace, query, vector, verse_ids, answer):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = np.ascontiguousarray(vector / max(float(np.linalg.norm(vector)), 1e-12))
+        verse_ids = frozenset(verse_ids)
+        now = time.time()
+        entry_id = None
+
+        if self.path:
+            try:
+                with self._db() as db:
+                    entry_id = db.execute(
+                        "INSERT INTO answers (namespace, created, query, verses, answer, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                        (namespace, now, query, json.dumps(sorted(verse_ids)), answer, vector.tobytes()),
+                    ).lastrowid
+                    self._writes += 1
+                    if self._writes % 100 == 0:
+                        # Occasionally prune expired rows and keep the file bounded
+                        if self.ttl_seconds:
+                            db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+                        db.execute("DELETE FROM answers WHERE id NOT IN "
+                                   "(SELECT id FROM answers ORDER BY id DESC LIMIT ?)", (self.max_entries * 10,))
+            except sqlite3.Error as e:
+                print(f"⚠️ Answer cache write failed: {e}")
+
+        with self._lock:
+            if entry_id is None:
+                entry_id, self._next_id = self._next_id, self._next_id - 1
+            self._remember(entry_id, (namespace, now, query, verse_ids, answer, vector))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected_overlap": self.rejected_overlap,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -1,15 +1,36 @@
-from flask import Flask, render_template, request, jsonify
-from utils import load_verses
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for
+from concurrent.futures import ThreadPoolExecutor
+from answer_cache import SemanticAnswerCache
+from chat_sessions import ChatSessionStore
+from context_packer import ContextItem, ContextPacker, make_token_counter
+from corpus_store import INDEX_DIR, load_corpus
+from models import VerseTable
+from onnx_encoder import onnx_dir
+from llm_gateway import FakeProvider, GeminiProvider, LLMGateway
+from llm_stream import AsyncLLMRunner, sse_event
+from page_cache import PageCache
+from query_router import SemanticRouter, detect_language
+from reference_parser import ReferenceResolver
 from search_engine import (
     build_tfidf_index,
     search_verses,
-    semantic_search
+    build_bm25_index,
+    bm25_search,
+    build_arabic_index,
+    arabic_search,
+    build_phrase_index,
+    phrase_search,
+    is_phrase_query,
+    hybrid_search,
+    encode_query,
+    load_tafsir_index,
+    retrieve_tafsir,
+    query_cache,
+    query_encoder_stats,
+    SEMANTIC_MODEL_NAME
 )
 import os
-import json # Added to read metadata directly
-from google import genai
 import pickle
-from sentence_transformers import SentenceTransformer
 
 app = Flask(__name__)
 
@@ -18,82 +39,195 @@ app = Flask(__name__)
 # ==========================================
 # Consider using os.environ for security in production
 GEMINI_API_KEY = "YOUR API KEY WRITE HERE" 
-client = genai.Client(api_key=GEMINI_API_KEY)
+AI_MODEL = "gemini-1.5-flash-latest" # Ensure you are using a model that supports this
+
+# LLM_PROVIDER=fake answers in-process with canned text (load tests). LLM_BASE_URL
+# points the Gemini client at another endpoint, e.g. the local stub server
+# ('python stub_llm_server.py') for development and tests.
+if os.environ.get("LLM_PROVIDER", "gemini").strip().lower() == "fake":
+    llm_provider = FakeProvider()
+else:
+    llm_provider = GeminiProvider(
+        GEMINI_API_KEY, AI_MODEL,
+        base_url=os.environ.get("LLM_BASE_URL") or None,
+        temperature=0.7, # Adds a little creativity/natural flow
+        max_output_tokens=800 # Allows for longer, detailed answers
+    )
+# Every answer goes through the gateway: coalescing, circuit breaker, rate limit,
+# concurrency cap, deadlines and retries (limits are per worker process)
+llm_gateway = LLMGateway(
+    llm_provider,
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "8")),
+    rate=float(os.environ.get("LLM_RATE", "5")),
+    burst=int(os.environ.get("LLM_BURST", "10")),
+    deadline_seconds=float(os.environ.get("LLM_DEADLINE", "60")),
+    first_token_seconds=float(os.environ.get("LLM_FIRST_TOKEN_TIMEOUT", "20")),
+    retries=int(os.environ.get("LLM_RETRIES", "2")),
+)
+AI_UNAVAILABLE = "### AI Insight Unavailable\nI'm having trouble connecting to the knowledge base right now. Please try again in a moment."
+# Answers stream from one shared event loop; retrieval runs on a small thread pool
+llm_runner = AsyncLLMRunner()
+retrieval_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+# Paraphrased questions reuse a cached answer when their embeddings are at least
+# ANSWER_CACHE_THRESHOLD similar and the retrieved verses overlap by at least
+# ANSWER_CACHE_MIN_OVERLAP. ANSWER_CACHE_PATH="" keeps the cache in memory only.
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", "1000")),
+    ttl_seconds=float(os.environ.get("ANSWER_CACHE_TTL", str(7 * 86400))),
+    path=os.environ.get("ANSWER_CACHE_PATH", os.path.join(INDEX_DIR, "answer_cache.sqlite")) or None,
+    threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.85")),
+    min_overlap=float(os.environ.get("ANSWER_CACHE_MIN_OVERLAP", "0.5")),
+)
 
 # ==========================================
 # 1. Load Data & Build Indices (On Startup)
 # ==========================================
 
 print("⏳ Loading Quran data...")
-# Load verses for Search functionality
-verses = load_verses("quran_complete.json")
+# Open the compiled, memory-mapped corpus store (built from quran_complete.json on first run)
+corpus = load_corpus("quran_complete.json")
+
+# Columnar verse table for Search functionality (rows are views, not copied dicts).
+# Tafsir HTML is by far the largest part of the corpus and most requests never touch it,
+# so it stays on disk and only recently requested entries are kept in memory.
+TAFSIR_CACHE_MB = int(os.environ.get("TAFSIR_CACHE_MB", "16"))
+verses = VerseTable(corpus, tafsir_cache_bytes=TAFSIR_CACHE_MB * 1024 * 1024) if corpus else []
 
 if not verses:
     print("❌ CRITICAL ERROR: No verses loaded. Check 'quran_complete.json'.")
 else:
     print(f"✅ Loaded {len(verses)} verses successfully.")
 
-# --- Build Tafsir Lookup ---
-tafsir_map = {}
-for v in verses:
-    s_id = v.get('surah_id')
-    a_num = v.get('ayah_number')
-    if s_id and a_num:
-        key = f"{s_id}:{a_num}"
-        tafsir_map[key] = v
-
 # --- Build Rich Surah Metadata for Browse Page ---
-# We read the JSON file directly again to ensure we get fields like 
-# 'name_ar', 'revelation_type', etc. which might be lost in the flattened 'verses' list.
-SURAHS_LIST = []
-try:
-    filepath = "quran_complete.json"
-    if not os.path.exists(filepath) and os.path.exists(os.path.join("data", filepath)):
-        filepath = os.path.join("data", filepath)
-        
-    with open(filepath, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
-        for s in raw_data.get('surahs', []):
-            SURAHS_LIST.append({
-                "id": s.get('id'),
-                "name": s.get('name_en', 'Unknown'),         # Matches browse.html 'name'
-                "ar": s.get('name_ar', 'القرآن'),            # Matches browse.html 'ar'
-                "translation": s.get('translation_en', 'The Chapter'), # Matches browse.html 'translation'
-                "verses": len(s.get('verses', [])),          # Matches browse.html 'verses'
-                "type": s.get('type', 'Meccan').capitalize() # Matches browse.html 'type'
-            })
-    print(f"✅ Loaded Metadata for {len(SURAHS_LIST)} Surahs.")
-except Exception as e:
-    print(f"⚠️ Warning: Could not load detailed Surah metadata: {e}")
-    # Fallback if file read fails
-    SURAHS_LIST = []
+# The corpus store keeps fields like 'name_ar' and 'revelation_type' in its manifest,
+# so there is no need to parse the JSON a second time.
+SURAHS_LIST = corpus.surah_list() if corpus else []
+SURAHS_BY_ID = {s['id']: s for s in SURAHS_LIST}
+print(f"✅ Loaded Metadata for {len(SURAHS_LIST)} Surahs.")
+
+# "2:255", "Al-Baqarah 255", "surah yasin", "Ayat al-Kursi" are answered
+# straight from the (surah, ayah) index, before any search engine runs
+reference_resolver = ReferenceResolver(verses, SURAHS_LIST) if verses else None
 
 # --- Build Search Indices ---
 if verses:
     print("⏳ Building TF-IDF index...")
-    vectorizer, tfidf_matrix = build_tfidf_index(verses)
+    tfidf_index = build_tfidf_index(verses)
+
+    print("⏳ Loading BM25 index...")
+    bm25_index = build_bm25_index(verses)
+
+    print("⏳ Loading Arabic/Urdu index...")
+    arabic_index = build_arabic_index(verses)
+
+    print("⏳ Loading phrase index...")
+    phrase_index = build_phrase_index(verses)
 
     # FIX: Use the builder function from search_engine.py
-    # This ensures consistency between generation and loading (using Torch)
+    # This ensures consistency between generation and loading (pre-normalized NumPy matrix)
     from search_engine import build_semantic_index
     
     print("⏳ Initializing Semantic Search...")
-    # This will load 'quran_embeddings.pt' if it exists, or create it if missing/broken
-    semantic_model, semantic_embeddings = build_semantic_index(verses)
+    # Loads the embedding store under data/index/embeddings (built offline by build_index.py)
+    semantic_model, semantic_index = build_semantic_index(verses)
 
-    if semantic_embeddings is not None:
+    if semantic_index is not None:
         print("✅ Semantic Search System Ready!")
     else:
         print("⚠️ Semantic embeddings could not be loaded.")
+
+    # Urdu / Arabic queries are routed to their own vector indices, loaded on first use
+    semantic_router = SemanticRouter(verses, preloaded={
+        "english": (semantic_model, semantic_index) if semantic_index is not None else None
+    })
+
+    # Tafsir passages for /ask_ai (optional; built by 'build_index.py --only tafsir')
+    tafsir_index = load_tafsir_index(verses)
 else:
-    vectorizer, tfidf_matrix = None, None
-    semantic_model, semantic_embeddings = None, None
+    tfidf_index = None
+    bm25_index = None
+    arabic_index = None
+    phrase_index = None
+    semantic_model, semantic_index = None, None
+    semantic_router = None
+    tafsir_index = None
+
+
+# --- Prompt Context ---
+# Retrieval over-fetches CONTEXT_VERSES verses and CONTEXT_PASSAGES tafsir
+# passages; the packer keeps the best of them that fit CONTEXT_TOKEN_BUDGET
+# tokens (counted with the embedding model's tokenizer). Without the tafsir
+# passage index, each verse's tafsir is offered as a snippet of at most
+# TAFSIR_SNIPPET_TOKENS tokens instead.
+CONTEXT_VERSES = int(os.environ.get("CONTEXT_VERSES", "12"))
+CONTEXT_PASSAGES = int(os.environ.get("CONTEXT_PASSAGES", "6"))
+TAFSIR_SNIPPET_TOKENS = int(os.environ.get("TAFSIR_SNIPPET_TOKENS", "120"))
+token_counter = make_token_counter(semantic_model, vocab_file=os.path.join(onnx_dir(SEMANTIC_MODEL_NAME), "vocab.txt"))
+context_packer = ContextPacker(token_counter, budget=int(os.environ.get("CONTEXT_TOKEN_BUDGET", "800")))
+print(f"✅ Prompt context budget: {context_packer.budget} tokens ({token_counter.name}).")
+
+# /chat conversations: at most CHAT_MAX_SESSIONS in memory, dropped after
+# CHAT_TTL seconds idle. CHAT_SPILL_DIR keeps sessions pushed out of memory on
+# disk (empty = memory only). Older turns are compacted into a summary once the
+# recent turns exceed CHAT_HISTORY_TOKENS. A turn's new verses are packed into
+# CHAT_CONTEXT_TOKENS.
+CHAT_VERSES = int(os.environ.get("CHAT_VERSES", "5"))
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", "400"))
+chat_sessions = ChatSessionStore(
+    max_sessions=int(os.environ.get("CHAT_MAX_SESSIONS", "1000")),
+    ttl_seconds=float(os.environ.get("CHAT_TTL", "3600")),
+    spill_dir=os.environ.get("CHAT_SPILL_DIR", os.path.join(INDEX_DIR, "chat_sessions")) or None,
+    history_tokens=int(os.environ.get("CHAT_HISTORY_TOKENS", "1500")),
+    summary_tokens=int(os.environ.get("CHAT_SUMMARY_TOKENS", "400")),
+    count_tokens=token_counter,
+)
+
 
+# --- Rendered Page Cache ---
+# Surah and browse pages never change between deploys, so they are rendered once
+# (on first request, or at startup) and served with ETag/Last-Modified for 304s.
+# Every worker pre-renders its own copy, so only the browse page is rendered at
+# startup by default. PREWARM_PAGES: "browse" (default), "all", "none", or a
+# comma-separated list of Surah ids (the browse page included).
+page_cache = PageCache(app, data_mtime=corpus.mtime if corpus else 0.0)
+PREWARM_PAGES = os.environ.get("PREWARM_PAGES", "browse").strip().lower()
+
+def pages_to_prewarm():
+    if PREWARM_PAGES == "none" or not SURAHS_LIST:
+        return []
+    if PREWARM_PAGES == "all":
+        surah_ids = list(SURAHS_BY_ID)
+    else:
+        surah_ids = [int(x) for x in PREWARM_PAGES.split(",") if x.strip().isdigit() and int(x) in SURAHS_BY_ID]
+    pages = [('browse.html', None, browse_context)]
+    pages += [('surah.html', s_id, (lambda s_id=s_id: surah_context(s_id))) for s_id in surah_ids]
+    return pages
 
 # ==========================================
 # 2. Application Routes
 # ==========================================
 
+def run_search(query, mode):
+    """Ranks verses for 'query' with the engine of the selected search mode."""
+    if mode == 'semantic':
+        results = semantic_router.search(query) if semantic_router else None
+        if results is not None:
+            return results
+        # No vector index for this language: keyword search in the same language
+        if detect_language(query) != 'english' and arabic_index is not None:
+            return arabic_search(query, verses, arabic_index)
+        return search_verses(query, verses, tfidf_index)
+    if mode == 'hybrid' and semantic_model and semantic_index is not None:
+        # BM25 (translation + tafsir) is the stronger lexical side when available
+        lexical_index = bm25_index if bm25_index is not None else tfidf_index
+        return hybrid_search(query, verses, lexical_index, semantic_model, semantic_index)
+    if mode == 'bm25' and bm25_index is not None:
+        return bm25_search(query, verses, bm25_index)
+    if mode == 'arabic' and arabic_index is not None:
+        return arabic_search(query, verses, arabic_index)
+    return search_verses(query, verses, tfidf_index)
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     results = []
@@ -104,70 +238,117 @@ def index():
         query = request.form.get('query', '').strip()
         mode = request.form.get('mode', 'semantic')
 
-        if query and verses:
+        resolved = reference_resolver.resolve(query, mode) if query and reference_resolver else None
+        if resolved is not None:
+            reference, results = resolved
+            if reference.whole_surah:
+                return redirect(url_for('surah', surah_id=reference.surah_id))
+        elif query and verses:
             try:
-                if mode == 'semantic' and semantic_model and semantic_embeddings is not None:
-                    results = semantic_search(query, verses, semantic_model, semantic_embeddings)
-                else:
-                    results = search_verses(query, verses, vectorizer, tfidf_matrix)
+                # Quoted phrases / NEAR/k (and the Exact Phrase mode) are matched exactly first;
+                # without an exact match the query goes to the selected engine
+                if phrase_index is not None and (mode == 'phrase' or is_phrase_query(query)):
+                    results = phrase_search(query, verses, phrase_index)
+                if not results:
+                    results = run_search(query, mode)
             except Exception as e:
                 print(f"❌ Search Error: {e}")
 
     return render_template('index.html', query=query, results=results, mode=mode)
 
+def browse_context():
+    # Passes the rich metadata list to the template
+    return {"surahs": SURAHS_LIST}
+
+def surah_context(surah_id):
+    # Verses of a Surah are stored contiguously and in ayah order
+    return {"surah": SURAHS_BY_ID[surah_id], "verses": verses.surah_rows(surah_id)}
+
 @app.route('/browse')
 def browse():
-    # Passes the rich metadata list to the template
-    return render_template('browse.html', surahs=SURAHS_LIST)
+    return page_cache.response('browse.html', None, browse_context)
 
 @app.route('/surah/<int:surah_id>')
 def surah(surah_id):
-    # Find metadata for this specific Surah
-    meta = next((s for s in SURAHS_LIST if s['id'] == surah_id), None)
-    
-    if not meta:
+    if surah_id not in SURAHS_BY_ID:
         return "Surah not found", 404
-        
-    # Filter verses for this Surah
-    surah_verses = [v for v in verses if v['surah_id'] == surah_id]
-    surah_verses.sort(key=lambda x: x['ayah_number'])
 
-    return render_template('surah.html', surah=meta, verses=surah_verses)
+    return page_cache.response('surah.html', surah_id, lambda: surah_context(surah_id))
 
 @app.route('/about')
 def about():
     return render_template('about.html')
 
+@app.route('/stats')
+def stats():
+    """Runtime counters for monitoring (per worker)."""
+    return jsonify({
+        "query_cache": query_cache.stats(),
+        "query_encoder": query_encoder_stats(),
+        "router": semantic_router.stats() if semantic_router else None,
+        "llm": dict(llm_runner.stats(), gateway=llm_gateway.stats()),
+        "answer_cache": answer_cache.stats(),
+        "references": reference_resolver.stats() if reference_resolver else None,
+        "chat": chat_sessions.stats(),
+        "context": context_packer.stats(),
+    })
+
 @app.route('/get_tafsir/<int:surah_id>/<int:ayah_id>')
 def get_tafsir(surah_id, ayah_id):
-    key = f"{surah_id}:{ayah_id}"
-    verse = tafsir_map.get(key)
+    verse = verses.row(surah_id, ayah_id) if verses else None
     if verse:
-        en_content = verse.get('tafsir_en') or "<p class='text-gray-500 italic'>No English Tafsir available.</p>"
-        ur_content = verse.get('tafsir_ur') or "<p class='text-gray-500 italic'>Urdu Tafsir not available.</p>"
+        en_content = verse.tafsir_en or "<p class='text-gray-500 italic'>No English Tafsir available.</p>"
+        ur_content = verse.tafsir_ur or "<p class='text-gray-500 italic'>Urdu Tafsir not available.</p>"
         return jsonify({"en": en_content, "ur": ur_content})
     return jsonify({"error": "Verse not found"}), 404
 
-@app.route('/ask_ai', methods=['POST'])
-def ask_ai():
-    try:
-        user_query = request.form.get('query', '').strip()
-        
-        # 1. Local Search (Retrieval) - Fetch more context for better answers
-        if semantic_model and semantic_embeddings is not None:
-            # Increased top_k from 4 to 8 to give the AI more material to work with
-            context_results = semantic_search(user_query, verses, semantic_model, semantic_embeddings, top_k=8)
-        else:
-            context_results = []
-
-        # 2. Build Context
-        context_text = "\n".join([
-            f"- Surah {v['surah']} ({v['surah_id']}:{v['ayah_number']}): {v['english']} (Tafsir: {v.get('tafsir_en', '')[:200]}...)" 
-            for v, score in context_results
-        ])
-
-        # 3. Enhanced "Scholar" Prompt
-        prompt = f"""
+def start_retrieval(user_query):
+    """
+    Starts the verse and tafsir retrieval for /ask_ai on the retrieval pool, so
+    both run concurrently with each other (and with opening the response).
+    Returns (verse future, tafsir future).
+    """
+    def verse_context():
+        # More candidates than fit: the context packer decides how many go into the prompt
+        return (semantic_router.search(user_query, top_k=CONTEXT_VERSES) or []) if semantic_router else []
+
+    def tafsir_context():
+        # Relevant tafsir passages when the passage index is available
+        if semantic_model and tafsir_index is not None and detect_language(user_query) == 'english':
+            return retrieve_tafsir(user_query, verses, semantic_model, tafsir_index, top_k=CONTEXT_PASSAGES)
+        return []
+
+    return retrieval_pool.submit(verse_context), retrieval_pool.submit(tafsir_context)
+
+def context_candidates(context_results, tafsir_results):
+    """ContextItems for the packer: the retrieved verses, then tafsir passages (or per-verse snippets)."""
+    candidates = [ContextItem("verse", v, v['english'], score) for v, score in context_results]
+    if tafsir_results:
+        candidates += [ContextItem("tafsir", v, passage, score) for v, passage, score in tafsir_results]
+    else:
+        candidates += [ContextItem("tafsir", v, context_packer.snippet(v['tafsir_en_text'], TAFSIR_SNIPPET_TOKENS), score)
+                       for v, score in context_results]
+    return candidates
+
+def format_context(packed):
+    """Prompt lines for packed ContextItems: verses first, then tafsir, each in score order."""
+    context_text = "\n".join([
+        f"- Surah {item.verse['surah']} ({item.verse_id}): {item.text}"
+        for item in packed if item.kind == "verse"
+    ])
+    tafsir_lines = [f"- On {item.verse_id}: {item.text}" for item in packed if item.kind == "tafsir"]
+    if tafsir_lines:
+        context_text += "\n\n**Relevant Tafsir (Ibn Kathir):**\n" + "\n".join(tafsir_lines)
+    return context_text
+
+def build_ai_prompt(user_query, packed):
+    # 1. Local Search (Retrieval) - see start_retrieval
+
+    # 2. Build Context - the verses and tafsir chosen by the context packer
+    context_text = format_context(packed)
+
+    # 3. Enhanced "Scholar" Prompt
+    return f"""
         You are a wise and knowledgeable Quranic AI assistant. Your goal is to provide a deep, spiritually uplifting, and comprehensive answer to the user's question.
 
         **User Question:** "{user_query}"
@@ -186,22 +367,180 @@ def ask_ai():
 
         If the answer is not found in the verses provided, use your general Islamic knowledge to answer politely, but mention that you are drawing from general knowledge.
         """
-        
-        # Generates a more creative and longer response
-        response = client.models.generate_content(
-            model="gemini-1.5-flash-latest", # Ensure you are using a model that supports this
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(
-                temperature=0.7, # Adds a little creativity/natural flow
-                max_output_tokens=800 # Allows for longer, detailed answers
-            )
-        )
-        
-        return jsonify({"answer": response.text})
+
+def stream_ai_answer(prompt):
+    """Yields the answer's Markdown text chunks as the model produces them."""
+    return llm_runner.stream(lambda: llm_gateway.stream(prompt))
+
+def answer_cache_key(user_query, packed):
+    """(namespace, query embedding, verse ids) for the answer cache, or None without semantic retrieval."""
+    language = detect_language(user_query)
+    loaded = semantic_router.index_for(language) if semantic_router else None
+    verse_ids = [item.verse_id for item in packed if item.kind == "verse"]
+    if loaded is None or not verse_ids:
+        return None
+    model = loaded[0]
+    # Served from the query embedding cache: retrieval just encoded the same query
+    vector = encode_query(user_query, model)
+    return f"{language}|{getattr(model, 'backend_name', '')}", vector, verse_ids
+
+def answer_question(user_query, retrieval):
+    """
+    Waits for the retrieval started by start_retrieval. Returns (from_cache,
+    iterator of Markdown chunks); a fresh answer is cached once it is complete.
+    """
+    verse_future, tafsir_future = retrieval
+    context_results = verse_future.result()
+    tafsir_results = tafsir_future.result()
+    packed, tokens = context_packer.pack(context_candidates(context_results, tafsir_results))
+
+    # Keyed on the verses the answer is grounded on, i.e. the packed ones
+    key = answer_cache_key(user_query, packed)
+    cached = answer_cache.get(*key) if key else None
+    if cached is not None:
+        return True, iter([cached])
+
+    prompt = build_ai_prompt(user_query, packed)
+
+    def generate():
+        chunks = []
+        for text in stream_ai_answer(prompt):
+            chunks.append(text)
+            yield text
+        # Only complete answers are cached (not failed or abandoned streams)
+        if key and chunks:
+            answer_cache.put(key[0], user_query, key[1], key[2], "".join(chunks))
+
+    return False, generate()
+
+@app.route('/ask_ai', methods=['POST'])
+def ask_ai():
+    try:
+        user_query = request.form.get('query', '').strip()
+        cached, chunks = answer_question(user_query, start_retrieval(user_query))
+        # Whole answer as one JSON blob (the page itself uses /ask_ai/stream)
+        return jsonify({"answer": "".join(chunks), "cached": cached})
 
     except Exception as e:
         print(f"❌ AI ERROR: {e}")
-        return jsonify({"answer": "### AI Insight Unavailable\nI'm having trouble connecting to the knowledge base right now. Please try again in a moment."}), 500
+        return jsonify({"answer": AI_UNAVAILABLE}), 500
+
+@app.route('/ask_ai/stream', methods=['POST'])
+def ask_ai_stream():
+    """
+    Server-sent events: 'status' (retrieving, then generating or cached), one
+    'token' per chunk of Markdown, then 'done' - or 'error' if the answer failed.
+    """
+    user_query = request.form.get('query', '').strip()
+    retrieval = start_retrieval(user_query)
+
+    def events():
+        yield sse_event("status", {"stage": "retrieving"})
+        try:
+            cached, chunks = answer_question(user_query, retrieval)
+            yield sse_event("status", {"stage": "cached" if cached else "generating"})
+            for text in chunks:
+                yield sse_event("token", {"text": text})
+            yield sse_event("done", {"cached": cached})
+        except Exception as e:
+            print(f"❌ AI ERROR: {e}")
+            yield sse_event("error", {"answer": AI_UNAVAILABLE})
+
+    # No proxy buffering: each event must reach the browser as soon as it is yielded
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Chat ---
+
+def chat_retrieve(question, session):
+    """
+    Up to CHAT_VERSES verses for this turn that the session has not cited yet.
+    Explicit references ("2:255") are always returned, even when cited before.
+    """
+    resolved = reference_resolver.resolve(question) if reference_resolver else None
+    if resolved is not None:
+        reference, results = resolved
+        if reference.whole_surah:
+            results = [(v, 1.0) for v in verses.surah_rows(reference.surah_id)[:CHAT_VERSES]]
+        return results[:CHAT_VERSES]
+
+    # Over-fetch by the number of cited verses (capped) so filtering still leaves CHAT_VERSES
+    top_k = CHAT_VERSES + min(len(session.cited), 50)
+    results = semantic_router.search(question, top_k=top_k) if semantic_router else None
+    if results is None:
+        results = search_verses(question, verses, tfidf_index, top_k=top_k)
+    fresh = [(v, score) for v, score in results if not session.is_cited(f"{v['surah_id']}:{v['ayah_number']}")]
+    return fresh[:CHAT_VERSES]
+
+def build_chat_prompt(question, session, packed):
+    """
+    The turn's prompt: the session summary, the recent turns, the ids (not the
+    text) of verses cited earlier, and the full text of this turn's new verses.
+    """
+    history = "\n".join(session.summary)
+    history += "".join(f"\nUser: {q}\nAssistant: {a}" for q, a in session.turns)
+    new_verses = format_context(packed) or "- (no new verses for this question)"
+    # Only the most recent ids: the model needs to know they exist, not all of them
+    earlier = ", ".join(session.cited[-30:]) or "none"
+
+    return f"""
+        You are a wise and knowledgeable Quranic AI assistant in an ongoing conversation. Answer the user's latest question clearly and warmly.
+
+        **Conversation so far:**
+        {history.strip() or "(this is the first question)"}
+
+        **Verses already discussed (cite them by number if relevant):** {earlier}
+
+        **New Context Verses for this question:**
+        {new_verses}
+
+        **User Question:** "{question}"
+
+        **Instructions:** Answer in a few short paragraphs of Markdown. Always cite the Surah and Ayah number (e.g., *2:152*) when quoting. If the verses do not answer the question, use your general Islamic knowledge politely and say so.
+        """
+
+@app.route('/chat', methods=['GET', 'POST'])
+def chat():
+    if request.method == 'GET':
+        return render_template('chat.html')
+
+    data = request.get_json(silent=True) or {}
+    question = str(data.get('question', '')).strip()
+    if not question:
+        return jsonify({"error": "Question is empty"}), 400
+
+    # Turns of one conversation are answered in order; unknown ids start a new session
+    with chat_sessions.turn(data.get('session_id')) as session:
+        results = chat_retrieve(question, session) if verses else []
+        packed, tokens = context_packer.pack([ContextItem("verse", v, v['english'], score) for v, score in results],
+                                             budget=CHAT_CONTEXT_TOKENS)
+        try:
+            answer = "".join(stream_ai_answer(build_chat_prompt(question, session, packed)))
+        except Exception as e:
+            print(f"❌ AI ERROR: {e}")
+            answer = None  # the verses are still worth showing
+        verse_ids = [item.verse_id for item in packed]
+        if answer:
+            chat_sessions.record_turn(session, question, answer, verse_ids)
+
+    return jsonify({
+        "session_id": session.id,
+        "answer": answer or AI_UNAVAILABLE,
+        "verses": [{
+            "surah": item.verse['surah'],
+            "surah_id": item.verse['surah_id'],
+            "ayah_number": item.verse['ayah_number'],
+            "english": item.text,
+            "urdu": item.verse['urdu'],
+        } for item in packed],
+    })
+
+# --- Pre-warm Page Cache ---
+prewarm = pages_to_prewarm()
+if prewarm:
+    print(f"⏳ Pre-rendering {len(prewarm)} pages...")
+    page_cache.warm(prewarm)
+    print("✅ Page cache warm.")
 
 if __name__ == '__main__':
 
@@ -0,0 +1,66 @@
+import re
+
+# --- Arabic / Urdu Text Normalization ---
+# The Quranic text is in Uthmani script: full tashkeel, Quranic annotation
+# marks, small letters, and alef wasla. Users type plain Arabic or Urdu. Both
+# sides are folded to the same skeleton before tokenizing:
+#   - remove tashkeel, Quranic marks, small letters and tatweel
+#   - unify alef variants (أ إ آ ٱ -> ا), yaa (ى ی ے ئ -> ي), kaf (ک -> ك),
+#     haa / taa marbuta (ة ہ ھ ۀ -> ه) and waw with hamza (ؤ -> و)
+# Words are then light-stemmed (clitic prefixes and common suffixes stripped,
+# as in the 'light10' stemmer, and word-internal alefs dropped), so
+# و/ب/ال-prefixed, suffixed and defectively spelled forms match.
+
+# Bump when normalization/stemming changes: persisted indices are rebuilt
+ANALYZER_VERSION = 1
+
+_DIACRITICS_RE = re.compile(
+    "[\u0610-\u061a"   # Quranic honorific signs
+    "\u064b-\u065f"    # tashkeel (fatha, damma, kasra, shadda, sukun, tanween...)
+    "\u0670"           # superscript (dagger) alef
+    "\u06d6-\u06dc\u06df-\u06e8\u06ea-\u06ed"  # Quranic annotation marks and small letters
+    "\u08d3-\u08ff"    # extended Quranic marks
+    "\u0640]"          # tatweel
+)
+_FOLD = str.maketrans({
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u0671": "\u0627",  # alef variants
+    "\u0649": "\u064a", "\u06cc": "\u064a", "\u06d2": "\u064a", "\u0626": "\u064a",  # yaa variants
+    "\u06d3": "\u064a",
+    "\u06a9": "\u0643",                                                      # Urdu kaf
+    "\u0629": "\u0647", "\u06c1": "\u0647", "\u06be": "\u0647", "\u06c0": "\u0647",  # haa / taa marbuta
+    "\u0624": "\u0648",                                                      # waw with hamza
+    "\u06f0": "0", "\u06f1": "1", "\u06f2": "2", "\u06f3": "3", "\u06f4": "4",        # Urdu digits
+    "\u06f5": "5", "\u06f6": "6", "\u06f7": "7", "\u06f8": "8", "\u06f9": "9",
+})
+_WORD_RE = re.compile(r"[\u0621-\u064a\u0660-\u0669\u0671-\u06d3\u06fa-\u06ff0-9]+")
+
+_PREFIXES = ("\u0648\u0627\u0644", "\u0628\u0627\u0644", "\u0643\u0627\u0644", "\u0641\u0627\u0644",
+             "\u0644\u0644", "\u0627\u0644")                                  # وال بال كال فال لل ال
+_SUFFIXES = ("\u0647\u0627", "\u0648\u0646", "\u064a\u0646",
+             "\u064a\u0647", "\u0647", "\u064a")                              # ها ون ين يه ه ي
+
+
+def normalize_arabic(text):
+    """Strips diacritics/annotation marks and folds letter variants (Arabic and Urdu)."""
+    return _DIACRITICS_RE.sub("", text).translate(_FOLD)
+
+
+def light_stem(word):
+    if len(word) > 3 and word.startswith("\u0648"):   # conjunction و
+        word = word[1:]
+    for prefix in _PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+            word = word[len(prefix):]
+            break
+    # Uthmani spelling often writes a long 'a' as a dagger alef (removed above):
+    # العٰلمين vs العالمين, so word-internal alefs are dropped on both sides
+    word = word[:1] + word[1:].replace("\u0627", "")
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 2:
+            word = word[:-len(suffix)]
+    return word
+
+
+def arabic_tokenize(text):
+    """Normalized, light-stemmed Arabic-script word tokens."""
+    return [light_stem(w) for w in _WORD_RE.findall(normalize_arabic(text))]
@@ -0,0 +1,184 @@
+import argparse
+import sys
+
+from corpus_store import load_corpus
+from models import VerseTable
+
+# --- Offline Index Builder ---
+# Builds every artifact the web app loads at startup, so serving processes only
+# ever memory-map finished files:
+#   corpus      -> data/corpus/            (compiled verse store)
+#   tfidf       -> data/index/tfidf/       (TF-IDF keyword index)
+#   bm25        -> data/index/bm25.npz     (BM25F keyword index)
+#   arabic      -> data/index/bm25_arabic.npz  (Arabic text + Urdu keyword index)
+#   phrase      -> data/index/phrase/      (positional index for phrase / NEAR/k queries)
+#   embeddings  -> data/index/embeddings/  (semantic search vectors)
+#   onnx        -> data/index/onnx/        (torch-free query encoder; opt-in)
+#   ann         -> data/index/embeddings-ivf/  (approximate vector index; opt-in)
+#   tafsir      -> data/index/tafsir/      (tafsir passage vectors for /ask_ai; opt-in)
+#   multilingual -> data/index/embeddings-{urdu,arabic}/  (Urdu/Arabic semantic search; opt-in)
+# Every step is incremental: up-to-date artifacts are left alone.
+
+STEPS = ("corpus", "tfidf", "bm25", "arabic", "phrase", "embeddings", "onnx", "ann", "tafsir", "multilingual")
+DEFAULT_STEPS = ("corpus", "tfidf", "bm25", "arabic", "phrase", "embeddings")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build Al-Bayan's search indices offline.")
+    parser.add_argument("--data", default="quran_complete.json", help="Source dataset")
+    parser.add_argument("--only", default=",".join(DEFAULT_STEPS),
+                        help=f"Comma-separated steps to run, out of {', '.join(STEPS)} (default: corpus, tfidf, bm25, arabic, phrase, embeddings)")
+    parser.add_argument("--workers", type=int, default=None, help="Embedding worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Embedding batch size per worker")
+    parser.add_argument("--dtype", choices=("float32", "float16", "int8"), default="float32",
+                        help="Embedding storage precision")
+    parser.add_argument("--quantize", action="store_true", help="Also write an int8 ONNX encoder (onnx step)")
+    parser.add_argument("--verify-sample", type=int, default=512,
+                        help="Verses used to check the ONNX encoder against the torch embeddings")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF clusters (ann step; default ~4*sqrt(vectors))")
+    return parser.parse_args()
+
+
+def report_recall(ann_index, store, k=10, queries=200, seed=0):
+    """
+    Prints recall@k and latency of the IVF index against exact search for a
+    range of nprobe values. Queries are midpoints of random verse pairs, so
+    they are close to, but never exactly on, stored vectors.
+    """
+    import time
+    import numpy as np
+    from vector_index import VectorIndex, recall_at_k
+
+    exact = VectorIndex.from_vectors(store.to_float32())
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(exact), size=(queries, 2))
+    sample = exact.matrix[pairs[:, 0]] + exact.matrix[pairs[:, 1]]
+
+    start = time.perf_counter()
+    truth = exact.search_batch(sample, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / queries
+    print(f"📊 recall@{k} vs exact search ({queries} queries, exact: {exact_ms:.3f} ms/query)")
+
+    nprobe = 1
+    while nprobe <= ann_index.n_lists:
+        start = time.perf_counter()
+        found = ann_index.search_batch(sample, k, nprobe=nprobe)
+        ann_ms = (time.perf_counter() - start) * 1000 / queries
+        print(f"   nprobe={nprobe:<4} recall@{k}={recall_at_k(truth, found):.3f}  {ann_ms:.3f} ms/query")
+        nprobe *= 2
+
+
+def build_onnx(verses, model_name, quantize=False, sample=512):
+    """
+    Exports the query encoder to ONNX and checks it against the torch path:
+    every sampled verse embedding must match the embedding store (or a fresh
+    torch encode) to within a cosine tolerance.
+    """
+    import numpy as np
+    from embedding_store import load_embeddings, recipe_texts
+    from onnx_encoder import OnnxEncoder, export_onnx, verify_encoder
+
+    print(f"⏳ Exporting {model_name} to ONNX{' (+ int8)' if quantize else ''}...")
+    try:
+        export_dir = export_onnx(model_name, quantize=quantize)
+    except ImportError as e:
+        print(f"❌ {e}")
+        return False
+    print(f"💾 ONNX encoder saved to '{export_dir}'.")
+
+    texts = recipe_texts(verses, "english")
+    picks = np.unique(np.linspace(0, len(texts) - 1, min(sample, len(texts))).astype(np.int64))
+    store = load_embeddings(texts, model_name)
+    if store is not None:
+        reference = store.to_float32()[picks]
+    else:
+        from sentence_transformers import SentenceTransformer
+        print("⏳ No current embedding store; encoding the sample with torch for reference...")
+        reference = SentenceTransformer(model_name, device="cpu").encode([texts[i] for i in picks], convert_to_numpy=True)
+
+    ok = True
+    variants = [(False, 1e-3)] + ([(True, 0.03)] if quantize else [])
+    for quantized, tolerance in variants:
+        encoder = OnnxEncoder(export_dir, quantized=quantized)
+        passed, min_cos, mean_cos = verify_encoder(encoder, [texts[i] for i in picks], reference, tolerance)
+        label = "int8" if quantized else "fp32"
+        print(f"{'✅' if passed else '❌'} ONNX {label}: cosine vs torch min={min_cos:.5f} mean={mean_cos:.5f} "
+              f"(tolerance {tolerance}, {len(picks)} verses)")
+        ok = ok and passed
+    return ok
+
+
+def main():
+    args = parse_args()
+    steps = {s.strip() for s in args.only.split(",") if s.strip()}
+    unknown = steps - set(STEPS)
+    if unknown:
+        print(f"❌ Unknown step(s): {', '.join(sorted(unknown))}")
+        return 1
+
+    # The corpus store is always needed; load_corpus (re)builds it if it is stale
+    corpus = load_corpus(args.data)
+    if corpus is None:
+        return 1
+    verses = VerseTable(corpus)
+    print(f"✅ Corpus ready ({len(verses)} verses).")
+
+    if steps & {"tfidf", "bm25", "arabic", "phrase", "embeddings"}:
+        import search_engine
+
+    if "tfidf" in steps:
+        search_engine.build_tfidf_index(verses)
+
+    if "bm25" in steps:
+        search_engine.build_bm25_index(verses)
+
+    if "arabic" in steps:
+        search_engine.build_arabic_index(verses)
+
+    if "phrase" in steps:
+        search_engine.build_phrase_index(verses)
+
+    if "embeddings" in steps:
+        from embedding_builder import build_embeddings
+        store = build_embeddings(verses, search_engine.SEMANTIC_MODEL_NAME, dtype=args.dtype,
+                                 workers=args.workers, batch_size=args.batch_size)
+        if store is None:
+            return 1
+
+    if "onnx" in steps:
+        import search_engine
+        if not build_onnx(verses, search_engine.SEMANTIC_MODEL_NAME, quantize=args.quantize,
+                          sample=args.verify_sample):
+            return 1
+
+    if "ann" in steps:
+        import search_engine
+        from embedding_store import load_embeddings, recipe_texts
+        store = load_embeddings(recipe_texts(verses, "english"), search_engine.SEMANTIC_MODEL_NAME)
+        if store is None:
+            return 1
+        report_recall(search_engine.build_ann_index(store, n_lists=args.nlist), store)
+
+    if "tafsir" in steps:
+        import search_engine
+        from tafsir_index import build_tafsir_index
+        if build_tafsir_index(verses, search_engine.SEMANTIC_MODEL_NAME, dtype=args.dtype,
+                              workers=args.workers, batch_size=args.batch_size) is None:
+            return 1
+
+    if "multilingual" in steps:
+        from embedding_builder import build_embeddings
+        from query_router import LANGUAGE_INDICES
+        for language in ("urdu", "arabic"):
+            model_name, recipe, store_dir = LANGUAGE_INDICES[language]
+            print(f"⏳ {language} embeddings ({model_name})...")
+            if build_embeddings(verses, model_name, recipe=recipe, dtype=args.dtype, store_dir=store_dir,
+                                workers=args.workers, batch_size=args.batch_size) is None:
+                return 1
+
+    print("✅ All requested indices are up to date.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
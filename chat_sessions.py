@@ -0,0 +1,292 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# --- Chat Sessions ---
+# /chat is a multi-turn conversation over the Quran. Re-sending the whole
+# history (and every verse cited so far) with each question made every turn
+# slower and more expensive than the last, so each session keeps:
+#   - the ids of the verses already cited: a turn only adds verses that are new
+#   - a short running summary of older turns plus the last few turns verbatim;
+#     once the verbatim turns exceed 'history_tokens', the oldest are compacted
+#     into one summary line each, and the summary itself is capped at
+#     'summary_tokens' (oldest lines dropped first)
+# so the prompt of turn 50 costs about as much as the prompt of turn 3.
+#
+# Sessions live in memory (LRU + idle TTL). With a spill directory, sessions
+# pushed out of memory are written there as JSON and restored on their next
+# turn, so a busy worker does not forget a conversation that is still going.
+# A session whose turn is being answered is never pushed out, and files are
+# read and written outside the store lock.
+#
+# Session ids are issued here (uuid4 hex) and returned to the browser; an id
+# the store does not know, in memory or spilled, starts a new session with a
+# new id, so a guessed id never reads or extends someone else's conversation.
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_MARKDOWN_RE = re.compile(r"[*_#`>]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English text)."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def compact_turn(question, answer, max_chars=160):
+    """One summary line for a turn: the question and the first sentence of its answer."""
+    answer = " ".join(_MARKDOWN_RE.sub("", answer or "").split())
+    answer = _SENTENCE_RE.split(answer, 1)[0]
+    if len(answer) > max_chars:
+        answer = answer[:max_chars].rsplit(" ", 1)[0] + "..."
+    return f"- Asked: {question} | Answered: {answer}"
+
+
+class ChatSession:
+    def __init__(self, session_id, created=None):
+        self.id = session_id
+        self.created = created or time.time()
+        self.updated = self.created
+        self.summary = []   # compacted lines of older turns, oldest first
+        self.turns = []     # recent turns as [question, answer], oldest first
+        self.cited = []     # "surah:ayah" ids in the order they were first cited
+        self.turn_count = 0
+        self.lock = threading.Lock()  # one turn at a time per session
+        self._cited_set = set()
+
+    def is_cited(self, verse_id):
+        return verse_id in self._cited_set
+
+    def cite(self, verse_ids):
+        for verse_id in verse_ids:
+            if verse_id not in self._cited_set:
+                self._cited_set.add(verse_id)
+                self.cited.append(verse_id)
+
+    def history_tokens(self, count=estimate_tokens):
+        return sum(count(q) + count(a) for q, a in self.turns)
+
+    def add_turn(self, question, answer, history_tokens, summary_tokens, count=estimate_tokens):
+        """Records a turn, then compacts old turns to stay within the budgets. Returns turns compacted."""
+        self.turns.append([question, answer or ""])
+        self.turn_count += 1
+        self.updated = time.time()
+
+        compacted = 0
+        # The newest turn always stays verbatim, whatever its size
+        while len(self.turns) > 1 and self.history_tokens(count) > history_tokens:
+            self.summary.append(compact_turn(*self.turns.pop(0)))
+            compacted += 1
+        while len(self.summary) > 1 and sum(count(line) for line in self.summary) > summary_tokens:
+            self.summary.pop(0)
+        return compacted
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "created": self.created,
+            "updated": self.updated,
+            "summary": self.summary,
+            "turns": self.turns,
+            "cited": self.cited,
+            "turn_count": self.turn_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        session = cls(data["id"], data.get("created"))
+        session.updated = data.get("updated", session.created)
+        session.summary = list(data.get("summary", []))
+        session.turns = [list(turn) for turn in data.get("turns", [])]
+        session.cite(data.get("cited", []))
+        session.turn_count = data.get("turn_count", len(session.turns))
+        return session
+
+
+class ChatSessionStore:
+    def __init__(self, max_sessions=1000, ttl_seconds=3600, spill_dir=None, history_tokens=1500,
+                 summary_tokens=400, count_tokens=estimate_tokens):
+        """'count_tokens' measures text for the budgets (e.g. a context_packer.TokenCounter)."""
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.count_tokens = count_tokens
+        self._sessions = OrderedDict()  # id -> ChatSession, least recently used first
+        self._spilling = {}             # id -> ChatSession evicted but not yet written out
+        self._lock = threading.Lock()
+        self._saves = 0
+        self.counters = {"created": 0, "turns": 0, "compacted": 0, "expired": 0, "spilled": 0, "restored": 0}
+
+        if spill_dir:
+            try:
+                os.makedirs(spill_dir, exist_ok=True)
+            except OSError as e:
+                print(f"⚠️ Chat spill directory unusable ({e}); sessions are kept in memory only.")
+                self.spill_dir = None
+
+    def _expired(self, session, now):
+        return self.ttl_seconds and now - session.updated > self.ttl_seconds
+
+    def _spill_path(self, session_id):
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _write_spill(self, session):
+        # Written to a temporary file first, so a crash never leaves half a session behind
+        path = self._spill_path(session.id)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(session.to_dict(), f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            return True
+        except OSError as e:
+            print(f"⚠️ Could not spill chat session {session.id}: {e}")
+            return False
+
+    def _read_spill(self, session_id):
+        # The file stays: the next spill overwrites it, and the sweep removes it once idle
+        try:
+            with open(self._spill_path(session_id), encoding="utf-8") as f:
+                return ChatSession.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _spill(self, sessions):
+        """Writes evicted sessions out (store lock not held); each one's lock is held since eviction."""
+        for session in sessions:
+            saved = self._write_spill(session)
+            with self._lock:
+                self._spilling.pop(session.id, None)
+                self.counters["spilled"] += saved
+            session.lock.release()
+
+    def _lookup(self, session_id, now):
+        # Caller holds the lock. A session on its way to disk is taken back as is.
+        session = self._sessions.get(session_id) or self._spilling.pop(session_id, None)
+        if session is not None and self._expired(session, now) and not session.lock.locked():
+            self._sessions.pop(session_id, None)
+            self.counters["expired"] += 1
+            return None
+        return session
+
+    def _evict(self, now):
+        """
+        Caller holds the lock. Idle sessions are dropped and the overflow is
+        taken out of memory, skipping sessions with a turn in flight. Returns the
+        sessions to write out with _spill, each with its lock acquired.
+        """
+        overflow = len(self._sessions) - self.max_sessions
+        evicted = []
+        for session in list(self._sessions.values()):
+            if self._expired(session, now):
+                if session.lock.locked():
+                    continue
+                del self._sessions[session.id]
+                self.counters["expired"] += 1
+                overflow -= 1
+            elif overflow <= 0:
+                break
+            elif session.lock.acquire(blocking=False):
+                del self._sessions[session.id]
+                overflow -= 1
+                if self.spill_dir:
+                    self._spilling[session.id] = session
+                    evicted.append(session)
+                else:
+                    session.lock.release()
+        return evicted
+
+    def _sweep_spill(self, now):
+        # Spilled sessions that were never resumed expire too
+        expired = 0
+        try:
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+                    expired += 1
+        except OSError:
+            pass
+        with self._lock:
+            self.counters["expired"] += expired
+
+    def get(self, session_id):
+        """
+        The session with this id, from memory or the spill directory. A missing,
+        unknown or expired id gets a new session with a newly issued id.
+        """
+        now = time.time()
+        session_id = str(session_id) if session_id else ""
+        if not _SESSION_ID_RE.match(session_id):
+            session_id = None
+
+        session = restored = None
+        if session_id:
+            with self._lock:
+                session = self._lookup(session_id, now)
+            if session is None and self.spill_dir:
+                restored = self._read_spill(session_id)
+
+        with self._lock:
+            if session is None and session_id:
+                # Another request may have brought it back while the file was read
+                session = self._lookup(session_id, now)
+                if session is None and restored is not None:
+                    if self._expired(restored, now):
+                        self.counters["expired"] += 1
+                    else:
+                        session = restored
+                        self.counters["restored"] += 1
+            if session is None:
+                session = ChatSession(uuid.uuid4().hex, now)
+                self.counters["created"] += 1
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            evicted = self._evict(now)
+        self._spill(evicted)
+        return session
+
+    @contextmanager
+    def turn(self, session_id):
+        """
+        get(session_id) with the session's lock held for the block, so turns of
+        one conversation run in order and the session stays in memory meanwhile.
+        """
+        while True:
+            session = self.get(session_id)
+            session.lock.acquire()
+            with self._lock:
+                current = self._sessions.get(session.id) is session
+            if current:
+                break
+            # Pushed out before the lock was taken: continue from the copy on disk
+            session.lock.release()
+            session_id = session.id
+        try:
+            yield session
+        finally:
+            session.lock.release()
+
+    def record_turn(self, session, question, answer, verse_ids):
+        """Adds a finished turn and its newly cited verses to 'session' (the caller holds session.lock)."""
+        session.cite(verse_ids)
+        compacted = session.add_turn(question, answer, self.history_tokens, self.summary_tokens,
+                                     self.count_tokens)
+        with self._lock:
+            self.counters["turns"] += 1
+            self.counters["compacted"] += compacted
+            self._saves += 1
+            sweep = self.spill_dir and self.ttl_seconds and self._saves % 100 == 0
+        if sweep:
+            self._sweep_spill(time.time())
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, sessions=len(self._sessions), max_sessions=self.max_sessions,
+                        spill=bool(self.spill_dir))
@@ -1,52 +1,81 @@
-import sys
-from utils import load_verses
-from search_engine import build_tfidf_index, search_verses
-
-def main():
-    print("⏳ Loading Quran Data from quran_complete.json...")
-    verses = load_verses()
-    
-    if not verses:
-        print("❌ Failed to load data. Check if 'quran_complete.json' exists.")
-        return
-
-    print(f"✅ Loaded {len(verses)} verses.")
-    print("⏳ Building Search Index...")
-    vectorizer, tfidf_matrix = build_tfidf_index(verses)
-    print("✅ System Ready!\n")
-
-    while True:
-        try:
-            query = input("🔍 Enter search query (or 'q' to quit): ").strip()
-        except KeyboardInterrupt:
-            print("\nExiting...")
-            break
-
-        if query.lower() in ('q', 'quit', 'exit'):
-            break
-        
-        if not query:
-            continue
-
-        # Perform Search
-        results = search_verses(query, verses, vectorizer, tfidf_matrix, top_k=5)
-
-        if not results:
-            print("   No results found.")
-        else:
-            print(f"\nTop {len(results)} results for '{query}':")
-            print("=" * 60)
-            
-            for i, (verse, score) in enumerate(results, 1):
-                # Update: Access dictionary keys instead of object attributes
-                surah = verse.get('surah', 'Unknown')
-                ayah = verse.get('ayah_number', 0)
-                english = verse.get('english', '')
-                
-                print(f"{i}. Surah {surah} ({ayah}) | Score: {score:.2f}")
-                print(f"   {english}")
-                print("-" * 60)
-        print("\n")
-
-if __name__ == "__main__":
+import argparse
+import sys
+from utils import load_verses
+from search_engine import (build_tfidf_index, search_verses, build_bm25_index, bm25_search,
+                           build_phrase_index, phrase_search, is_phrase_query)
+from reference_parser import ReferenceResolver
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Search the Quran from the command line.")
+    parser.add_argument("--mode", choices=("tfidf", "bm25", "phrase"), default="tfidf",
+                        help="Keyword ranking to use (default: tfidf). Quoted phrases and NEAR/k "
+                             "are matched exactly in every mode; 'phrase' treats the whole query as a phrase")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print("⏳ Loading Quran Data from quran_complete.json...")
+    verses = load_verses()
+    
+    if not verses:
+        print("❌ Failed to load data. Check if 'quran_complete.json' exists.")
+        return
+
+    print(f"✅ Loaded {len(verses)} verses.")
+    print("⏳ Building Search Index...")
+    if args.mode == "bm25":
+        bm25_index = build_bm25_index(verses)
+    else:
+        tfidf_index = build_tfidf_index(verses)
+    phrase_index = build_phrase_index(verses)
+    resolver = ReferenceResolver(verses, verses.corpus.surah_list())
+    print("✅ System Ready!\n")
+
+    while True:
+        try:
+            query = input("🔍 Enter search query (or 'q' to quit): ").strip()
+        except KeyboardInterrupt:
+            print("\nExiting...")
+            break
+
+        if query.lower() in ('q', 'quit', 'exit'):
+            break
+        
+        if not query:
+            continue
+
+        # Verse references ("2:255", "Al-Baqarah 255") need no search at all
+        resolved = resolver.resolve(query, args.mode)
+        if resolved is not None:
+            reference, results = resolved
+            if reference.whole_surah:
+                results = [(verse, 1.0) for verse in verses.surah_rows(reference.surah_id)[:5]]
+        # Perform Search (exact phrase / NEAR matches first, if the query asks for them)
+        else:
+            results = []
+            if args.mode == "phrase" or is_phrase_query(query):
+                results = phrase_search(query, verses, phrase_index, top_k=5)
+            if not results and args.mode == "bm25":
+                results = bm25_search(query, verses, bm25_index, top_k=5)
+            elif not results:
+                results = search_verses(query, verses, tfidf_index, top_k=5)
+
+        if not results:
+            print("   No results found.")
+        else:
+            print(f"\nTop {len(results)} results for '{query}':")
+            print("=" * 60)
+            
+            for i, (verse, score) in enumerate(results, 1):
+                # Update: Access dictionary keys instead of object attributes
+                surah = verse.get('surah', 'Unknown')
+                ayah = verse.get('ayah_number', 0)
+                english = verse.get('english', '')
+                
+                print(f"{i}. Surah {surah} ({ayah}) | Score: {score:.2f}")
+                print(f"   {english}")
+                print("-" * 60)
+        print("\n")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
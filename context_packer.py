@@ -0,0 +1,208 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# --- Context Packer ---
+# /ask_ai used to paste a fixed eight verses into the prompt, each followed by
+# the first 200 characters of its raw tafsir HTML: tags and entities were paid
+# for as prompt tokens, sentences were cut mid-word, and a question answered by
+# a few long verses got the same eight as one answered by short ones.
+#
+# Retrieval now returns more candidates than fit (verses and tafsir passages,
+# each with its retrieval score), and the packer fills a token budget with the
+# best of them:
+#   1. candidates are taken in score order; verse and passage scores come from
+#      different searches, so each is first divided by the best score of its kind
+#   2. a verse already packed, or a passage whose word 5-grams are mostly
+#      covered by packed text (Ibn Kathir repeats commentary across verses,
+#      and passages overlap by design), is skipped
+#   3. a tafsir passage that does not fit is cut to its leading whole sentences
+# Token counts come from the embedding model's local tokenizer (or ~4
+# characters per token without one) and are cached, since the same verses and
+# passages come back for many questions.
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_WORD_RE = re.compile(r"\w+")
+SHINGLE_WORDS = 5
+
+
+class TokenCounter:
+    def __init__(self, tokenize=None, name="chars/4", max_entries=8192):
+        self.tokenize = tokenize
+        self.name = name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._counts = OrderedDict()  # text -> tokens, least recently used first
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        return self.count(text)
+
+    def count(self, text):
+        if not text:
+            return 0
+        with self._lock:
+            tokens = self._counts.get(text)
+            if tokens is not None:
+                self._counts.move_to_end(text)
+                self.hits += 1
+                return tokens
+
+        tokens = self.tokenize(text) if self.tokenize else len(text) // 4 + 1
+
+        with self._lock:
+            self.misses += 1
+            self._counts[text] = tokens
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def stats(self):
+        with self._lock:
+            return {"tokenizer": self.name, "entries": len(self._counts), "hits": self.hits, "misses": self.misses}
+
+
+def make_token_counter(model=None, vocab_file=None):
+    """
+    TokenCounter backed by the tokenizer of a loaded embedding 'model'
+    (SentenceTransformer or OnnxEncoder), else by the WordPiece vocabulary of
+    an ONNX export, else by the character estimate.
+    """
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None and vocab_file and os.path.exists(vocab_file):
+        from onnx_encoder import WordPieceTokenizer
+        tokenizer = WordPieceTokenizer(vocab_file)
+
+    if hasattr(tokenizer, "count"):
+        return TokenCounter(tokenizer.count, name="wordpiece")
+    if hasattr(tokenizer, "encode"):
+        # Hugging Face tokenizer: 'verbose=False' silences its too-long-for-the-model warning
+        return TokenCounter(lambda text: len(tokenizer.encode(text, add_special_tokens=False, verbose=False)),
+                            name=type(tokenizer).__name__)
+    return TokenCounter()
+
+
+def trim_to_tokens(text, max_tokens, count):
+    """(leading whole sentences of 'text' within 'max_tokens', their tokens); ('', 0) if none fit."""
+    kept, used = [], 0
+    for sentence in _SENTENCE_RE.split(text):
+        tokens = count(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept), used
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """Set of word 'size'-grams of 'text' (one shorter gram for very short texts)."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextItem:
+    """One candidate for the prompt: a verse translation ('verse') or a tafsir passage ('tafsir')."""
+
+    __slots__ = ("kind", "verse", "text", "score", "tokens")
+
+    def __init__(self, kind, verse, text, score, tokens=0):
+        self.kind = kind
+        self.verse = verse
+        self.text = text
+        self.score = score
+        self.tokens = tokens
+
+    @property
+    def verse_id(self):
+        return f"{self.verse['surah_id']}:{self.verse['ayah_number']}"
+
+    def __repr__(self):
+        return f"<ContextItem {self.kind} {self.verse_id} {self.tokens}t>"
+
+
+class ContextPacker:
+    def __init__(self, count, budget=800, item_overhead=12, max_overlap=0.5, min_tokens=24):
+        """
+        'budget' is in tokens of 'count' (a TokenCounter); 'item_overhead'
+        covers each item's line prefix ("- Surah Al-Baqarah (2:255): ").
+        """
+        self.count = count
+        self.budget = budget
+        self.item_overhead = item_overhead
+        self.max_overlap = max_overlap
+        self.min_tokens = min_tokens
+        self._lock = threading.Lock()
+        self.counters = {"packed": 0, "tokens": 0, "items": 0, "candidates": 0,
+                         "deduplicated": 0, "trimmed": 0, "dropped": 0}
+
+    def snippet(self, text, max_tokens):
+        """Leading sentences of a long text (e.g. a whole tafsir entry) within 'max_tokens'."""
+        return trim_to_tokens(text, max_tokens, self.count)[0]
+
+    def pack(self, candidates, budget=None):
+        """
+        Greedily fills 'budget' tokens (default: self.budget) with the
+        highest-scoring ContextItems, each scored relative to the best item of
+        its kind. Returns (packed items in that order, tokens used). The packed
+        items are new ContextItems; 'candidates' are left as they were.
+        """
+        budget = self.budget if budget is None else budget
+        packed, used = [], 0
+        packed_verses, seen = set(), set()
+        counts = {"deduplicated": 0, "trimmed": 0, "dropped": 0}
+
+        best = {}
+        for item in candidates:
+            best[item.kind] = max(best.get(item.kind, 0.0), item.score)
+
+        def relative_score(item):
+            return item.score / best[item.kind] if best[item.kind] > 0 else item.score
+
+        # sorted() is stable: a verse listed before its own tafsir keeps that place on equal scores
+        for item in sorted(candidates, key=lambda c: -relative_score(c)):
+            if not item.text or (item.kind == "verse" and item.verse_id in packed_verses):
+                counts["deduplicated"] += 1
+                continue
+            grams = shingles(item.text)
+            if grams and len(grams & seen) > self.max_overlap * len(grams):
+                counts["deduplicated"] += 1
+                continue
+
+            remaining = budget - used - self.item_overhead
+            text, tokens = item.text, self.count(item.text)
+            if tokens > remaining:
+                # Only tafsir is cut: half a verse would misquote it
+                text, tokens = trim_to_tokens(text, remaining, self.count) \
+                    if item.kind == "tafsir" and remaining >= self.min_tokens else ("", 0)
+                if not text:
+                    counts["dropped"] += 1
+                    continue
+                grams = shingles(text)
+                counts["trimmed"] += 1
+
+            item = ContextItem(item.kind, item.verse, text, item.score, tokens)
+            packed.append(item)
+            used += tokens + self.item_overhead
+            seen |= grams
+            if item.kind == "verse":
+                packed_verses.add(item.verse_id)
+
+        with self._lock:
+            self.counters["packed"] += 1
+            self.counters["tokens"] += used
+            self.counters["items"] += len(packed)
+            self.counters["candidates"] += len(candidates)
+            for key, value in counts.items():
+                self.counters[key] += value
+        return packed, used
+
+    def stats(self):
+        with self._lock:
+            packed = self.counters["packed"]
+            return dict(self.counters, budget=self.budget,
+                        mean_tokens=round(self.counters["tokens"] / packed, 1) if packed else 0.0,
+                        token_counter=self.count.stats() if hasattr(self.count, "stats") else None)
@@ -0,0 +1,422 @@
+import array
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, development servers run a single process
+    fcntl = None
+
+# --- Compiled Corpus Store ---
+# 'quran_complete.json' is ~37 MB and takes seconds to parse. The build step
+# below compiles it once into a directory of flat binary files that every
+# process can memory-map, so workers share the same page-cache pages:
+#
+#   manifest.json    -> format version, source signature, content hashes, surah metadata
+#   rows.bin         -> fixed-width (surah_id, ayah_number) per verse  ('H', 'H')
+#   surahs.bin       -> fixed-width (start_row, verse_count) per surah id ('I', 'I')
+#   <field>.idx      -> N + 1 byte offsets into <field>.dat               ('Q')
+#   <field>.dat      -> UTF-8 text of every verse, concatenated
+#                       (tafsir fields are zlib-compressed entry by entry)
+
+STORE_FORMAT = "albayan-corpus"
+STORE_VERSION = 4
+DEFAULT_STORE_DIR = os.path.join("data", "corpus")
+# Search indices and other derived artifacts live next to the store
+INDEX_DIR = os.path.join("data", "index")
+
+# Verse fields, named after the keys used by the rest of the app.
+# 'tafsir_en_text' is the English tafsir with its HTML stripped at compile time,
+# so prompts and passage lookups never parse HTML while serving.
+FIELDS = ("text", "english", "urdu", "tafsir_en", "tafsir_ur", "tafsir_en_text")
+TAFSIR_FIELDS = ("tafsir_en", "tafsir_ur", "tafsir_en_text")
+
+
+def _locate(filepath):
+    """Return 'filepath' or its 'data/' fallback, whichever exists (else None)."""
+    if os.path.exists(filepath):
+        return filepath
+    if os.path.exists(os.path.join("data", filepath)):
+        return os.path.join("data", filepath)
+    return None
+
+
+def store_dir_for(json_path):
+    """
+    Store directory of a source JSON: 'data/corpus' for the default
+    'quran_complete.json', 'data/corpus-<name>' for any other source, so two
+    sources never overwrite each other's store.
+    """
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    if name == "quran_complete":
+        return DEFAULT_STORE_DIR
+    return f"{DEFAULT_STORE_DIR}-{name}"
+
+
+@contextmanager
+def store_lock(store_dir):
+    """
+    Exclusive lock (a flock on '<store_dir>.lock') held while a store is
+    compiled and swapped in, so concurrently starting workers build it once.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(store_dir)), exist_ok=True)
+    with open(f"{store_dir}.lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _source_signature(filepath):
+    """Cheap change detector for the source JSON (hashing 37 MB would defeat the purpose)."""
+    st = os.stat(filepath)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def make_scratch_dir(final_dir):
+    """Fresh per-process directory next to 'final_dir' to build an artifact in."""
+    tmp_dir = f"{final_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def replace_dir(tmp_dir, final_dir):
+    """
+    Swaps a fully written artifact directory into place, so readers either see
+    the old version or the new one, never a half-written mix.
+    """
+    old_dir = f"{final_dir}.old-{os.getpid()}"
+    if os.path.exists(final_dir):
+        os.rename(final_dir, old_dir)
+    os.rename(tmp_dir, final_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def build_corpus_store(json_path="quran_complete.json", store_dir=None):
+    """
+    Compiles 'quran_complete.json' into the memory-mappable store format.
+    The store is written to a temporary directory first and swapped in at the
+    end, so a concurrently starting worker never sees a half-written store.
+    Callers hold store_lock(store_dir) so that only one process builds it.
+    """
+    store_dir = store_dir or store_dir_for(json_path)
+    source = _locate(json_path)
+    if source is None:
+        print(f"❌ File not found: {json_path}")
+        return False
+
+    # utils imports models, which imports this module
+    from utils import strip_html
+
+    print(f"⏳ Compiling corpus store from {source}...")
+    try:
+        with open(source, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"❌ Error reading JSON: {e}")
+        return False
+
+    # 1. Flatten surahs/verses in (surah, ayah) order
+    surahs = sorted(data.get("surahs", []), key=lambda s: int(s.get("id", 0)))
+    rows = array.array("H")
+    surah_table = array.array("I")
+    columns = {field: [] for field in FIELDS}
+    surah_meta = []
+
+    for surah in surahs:
+        surah_id = int(surah.get("id", 0))
+        verses = sorted(surah.get("verses", []), key=lambda v: int(v.get("ayah", 0)))
+
+        # surahs.bin is indexed directly by surah id, so pad any gaps
+        while len(surah_table) < 2 * (surah_id + 1):
+            surah_table.extend((0, 0))
+        surah_table[2 * surah_id] = len(rows) // 2
+        surah_table[2 * surah_id + 1] = len(verses)
+
+        # Keep only the keys the source actually has, so defaults apply as before
+        meta = {k: surah[k] for k in ("name_en", "name_ar", "translation_en", "type") if k in surah}
+        meta["id"] = surah_id
+        surah_meta.append(meta)
+
+        for verse in verses:
+            rows.extend((surah_id, int(verse.get("ayah", 0))))
+
+            translations = verse.get("translations", {})
+            tafsir = verse.get("tafsir", {})
+            columns["text"].append(verse.get("arabic", {}).get("text", ""))
+            columns["english"].append(translations.get("en", ""))
+            columns["urdu"].append(translations.get("ur", ""))
+            columns["tafsir_en"].append(tafsir.get("en", ""))
+            columns["tafsir_ur"].append(tafsir.get("ur", ""))
+            columns["tafsir_en_text"].append(strip_html(tafsir.get("en", "")))
+
+    # 2. Write everything into a scratch directory
+    tmp_dir = make_scratch_dir(store_dir)
+
+    # Content hashes let derived indices (TF-IDF, BM25, embeddings...) tell
+    # whether the fields they were built from actually changed
+    content_hashes = {"rows": hashlib.sha256(rows.tobytes()).hexdigest()}
+
+    with open(os.path.join(tmp_dir, "rows.bin"), "wb") as f:
+        rows.tofile(f)
+    with open(os.path.join(tmp_dir, "surahs.bin"), "wb") as f:
+        surah_table.tofile(f)
+
+    for field, values in columns.items():
+        offsets = array.array("Q", [0])
+        hasher = hashlib.sha256()
+        with open(os.path.join(tmp_dir, f"{field}.dat"), "wb") as f:
+            for value in values:
+                encoded = (value or "").encode("utf-8")
+                hasher.update(len(encoded).to_bytes(8, "little"))
+                hasher.update(encoded)
+                if field in TAFSIR_FIELDS and encoded:
+                    encoded = zlib.compress(encoded, 9)
+                f.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+        with open(os.path.join(tmp_dir, f"{field}.idx"), "wb") as f:
+            offsets.tofile(f)
+        content_hashes[field] = hasher.hexdigest()
+
+    manifest = {
+        "format": STORE_FORMAT,
+        "version": STORE_VERSION,
+        "byteorder": sys.byteorder,
+        "source": _source_signature(source),
+        "metadata": data.get("metadata", {}),
+        "count": len(rows) // 2,
+        "fields": list(FIELDS),
+        "compressed": list(TAFSIR_FIELDS),
+        "content_hashes": content_hashes,
+        "surahs": surah_meta,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 3. Swap the finished store into place
+    replace_dir(tmp_dir, store_dir)
+
+    print(f"✅ Corpus store written to '{store_dir}' ({manifest['count']} verses).")
+    return True
+
+
+class CorpusStore:
+    """
+    Read-only view over a compiled corpus store.
+    Nothing is parsed up front: offset tables and text blobs are memory-mapped
+    and a verse field is only decoded when it is asked for.
+    """
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.mtime = os.path.getmtime(os.path.join(store_dir, "manifest.json"))
+
+        if self.manifest.get("format") != STORE_FORMAT or self.manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported corpus store format in '{store_dir}'")
+        if self.manifest.get("byteorder") != sys.byteorder:
+            raise ValueError(f"Corpus store '{store_dir}' was built on a different byte order")
+
+        self.count = self.manifest["count"]
+        self.compressed = set(self.manifest.get("compressed", []))
+        self._maps = []
+        self.rows = self._map_array("rows.bin", "H")
+        self.surah_table = self._map_array("surahs.bin", "I")
+        self._offsets = {}
+        self._blobs = {}
+        for field in self.manifest["fields"]:
+            self._offsets[field] = self._map_array(f"{field}.idx", "Q")
+            self._blobs[field] = self._map_bytes(f"{field}.dat")
+
+    def _map_bytes(self, name):
+        path = os.path.join(self.store_dir, name)
+        if os.path.getsize(path) == 0:
+            # mmap refuses empty files (e.g. a field that is blank everywhere)
+            return memoryview(b"")
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm)
+
+    def _map_array(self, name, typecode):
+        return self._map_bytes(name).cast(typecode)
+
+    def __len__(self):
+        return self.count
+
+    def is_current(self, json_path):
+        """True if the store was compiled from the current version of 'json_path'."""
+        source = _locate(json_path)
+        if source is None:
+            return True  # Nothing to compare against, the store is all we have
+        return self.manifest.get("source") == _source_signature(source)
+
+    def content_hash(self, *fields):
+        """
+        Hash of the verse layout plus the given fields' text. An index built from
+        e.g. 'english' only needs rebuilding when content_hash("english") changes.
+        """
+        hashes = self.manifest["content_hashes"]
+        hasher = hashlib.sha256(hashes["rows"].encode("ascii"))
+        for field in fields:
+            hasher.update(f"|{field}={hashes[field]}".encode("ascii"))
+        return hasher.hexdigest()
+
+    def get(self, field, index):
+        """Decodes a single field of the verse at global row 'index'."""
+        offsets = self._offsets[field]
+        raw = bytes(self._blobs[field][offsets[index]:offsets[index + 1]])
+        if raw and field in self.compressed:
+            raw = zlib.decompress(raw)
+        return raw.decode("utf-8")
+
+    def surah_id(self, index):
+        return self.rows[2 * index]
+
+    def ayah_number(self, index):
+        return self.rows[2 * index + 1]
+
+    def surah_range(self, surah_id):
+        """Returns the (start, end) row range of a surah, or None if it does not exist."""
+        if surah_id < 0 or 2 * surah_id + 1 >= len(self.surah_table):
+            return None
+        start = self.surah_table[2 * surah_id]
+        count = self.surah_table[2 * surah_id + 1]
+        if count == 0:
+            return None
+        return start, start + count
+
+    def row_index(self, surah_id, ayah_number):
+        """Global row of (surah_id, ayah_number), or None if there is no such verse."""
+        span = self.surah_range(surah_id)
+        if span is None:
+            return None
+        index = span[0] + ayah_number - 1
+        # Ayat are stored in order, so the verse normally sits exactly at 'ayah - 1'
+        if span[0] <= index < span[1] and self.ayah_number(index) == ayah_number:
+            return index
+        for i in range(*span):
+            if self.ayah_number(i) == ayah_number:
+                return i
+        return None
+
+    def surah_list(self):
+        """Surah metadata in the shape expected by 'browse.html' and 'surah.html'."""
+        surahs = []
+        for s in self.manifest["surahs"]:
+            span = self.surah_range(s["id"])
+            surahs.append({
+                "id": s["id"],
+                "name": s.get("name_en", "Unknown"),         # Matches browse.html 'name'
+                "ar": s.get("name_ar", "القرآن"),            # Matches browse.html 'ar'
+                "translation": s.get("translation_en", "The Chapter"),  # Matches browse.html 'translation'
+                "verses": span[1] - span[0] if span else 0,  # Matches browse.html 'verses'
+                "type": s.get("type", "Meccan").capitalize() # Matches browse.html 'type'
+            })
+        return surahs
+
+
+class TafsirCache:
+    """
+    Lazy tafsir accessor. Only the store's offset tables stay mapped in memory;
+    an entry is read and decompressed when requested, and the most recently
+    used entries are kept in an LRU bounded by 'max_bytes'.
+    """
+
+    def __init__(self, corpus, max_bytes=16 * 1024 * 1024):
+        self.corpus = corpus
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, surah_id, ayah_number, field="tafsir_en"):
+        """Returns the tafsir text for a verse ('' if blank), or None if the verse does not exist."""
+        index = self.corpus.row_index(surah_id, ayah_number)
+        if index is None:
+            return None
+        return self.get_row(index, field)
+
+    def get_row(self, index, field="tafsir_en"):
+        """Returns the tafsir text of the verse at global row 'index'."""
+        key = (index, field)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        text = self.corpus.get(field, index)
+
+        cost = sys.getsizeof(text)
+        if cost > self.max_bytes:
+            return text  # Too big to cache without evicting everything else
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = text
+                self.size += cost
+                while self.size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= sys.getsizeof(evicted)
+        return text
+
+
+def _open_current(json_path, store_dir):
+    """The store in 'store_dir' if it exists and was compiled from the current 'json_path'."""
+    if not os.path.exists(os.path.join(store_dir, "manifest.json")):
+        return None, False
+    try:
+        store = CorpusStore(store_dir)
+    except Exception as e:
+        print(f"⚠️ Could not open corpus store: {e}. Rebuilding...")
+        return None, False
+    if store.is_current(json_path):
+        return store, True
+    return store, False
+
+
+def load_corpus(json_path="quran_complete.json", store_dir=None):
+    """
+    Opens the compiled corpus store, (re)building it first if it is missing or
+    older than 'json_path'. Returns None if neither exists. 'store_dir'
+    defaults to store_dir_for(json_path).
+    """
+    store_dir = store_dir or store_dir_for(json_path)
+    store, current = _open_current(json_path, store_dir)
+    if current:
+        return store
+
+    with store_lock(store_dir):
+        # Another worker may have rebuilt it while this one waited for the lock
+        fresh, current = _open_current(json_path, store_dir)
+        if current:
+            return fresh
+        store = fresh or store
+        if store is not None:
+            print(f"⚠️ Corpus store '{store_dir}' is older than {json_path}. Rebuilding...")
+        if not build_corpus_store(json_path, store_dir):
+            return store  # Keep serving a stale store rather than nothing
+    return CorpusStore(store_dir)
+
+
+if __name__ == "__main__":
+    # Usage: python corpus_store.py [quran_complete.json] [data/corpus]
+    args = sys.argv[1:]
+    json_path = args[0] if args else "quran_complete.json"
+    store_dir = args[1] if len(args) > 1 else store_dir_for(json_path)
+    with store_lock(store_dir):
+        ok = build_corpus_store(json_path, store_dir)
+    sys.exit(0 if ok else 1)
@@ -1,32 +1,40 @@
-import json
-import pickle
-from sentence_transformers import SentenceTransformer
-
-DATA_PATH = "data/quran_complete.json"
-OUT_PATH = "data/embeddings.pkl"
-
-print("⏳ Loading Quran dataset...")
-with open(DATA_PATH, encoding="utf-8") as f:
-    data = json.load(f)
-
-texts = []
-for s in data["surahs"]:
-    for v in s["verses"]:
-        # Combine translation + tafsir for better semantic understanding
-        en = v.get("english", "")
-        tafsir_en = v.get("tafsir_en", "")
-        texts.append(en + " " + tafsir_en)
-
-print(f"✅ Loaded {len(texts)} verses")
-
-print("⏳ Loading SentenceTransformer model...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
-
-print("⏳ Encoding verses (this takes time ONCE)...")
-embeddings = model.encode(texts, show_progress_bar=True)
-
-print("⏳ Saving embeddings to disk...")
-with open(OUT_PATH, "wb") as f:
-    pickle.dump(embeddings, f)
-
-print("✅ DONE — embeddings saved to data/embeddings.pkl")
+import argparse
+import os
+import sys
+
+# Allow importing the app modules when run as 'python data/scripts/precompute_embeddings.py'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from embedding_builder import build_embeddings
+from embedding_store import DEFAULT_EMBEDDING_DIR, DTYPES, TEXT_RECIPES
+from models import load_verse_table
+from search_engine import SEMANTIC_MODEL_NAME
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute verse embeddings into the shared embedding store.")
+    parser.add_argument("--data", default="quran_complete.json", help="Source dataset")
+    parser.add_argument("--out", default=DEFAULT_EMBEDDING_DIR, help="Embedding store directory")
+    parser.add_argument("--recipe", choices=sorted(TEXT_RECIPES), default="english",
+                        help="Which verse fields to embed (the web app serves 'english')")
+    parser.add_argument("--dtype", choices=DTYPES, default="float32", help="Storage precision")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Batch size per worker")
+    args = parser.parse_args()
+
+    print("⏳ Loading Quran dataset...")
+    verses = load_verse_table(args.data)
+    if verses is None:
+        return 1
+    print(f"✅ Loaded {len(verses)} verses")
+
+    print("⏳ Encoding verses (only new or changed verses are encoded)...")
+    store = build_embeddings(verses, SEMANTIC_MODEL_NAME, recipe=args.recipe, dtype=args.dtype,
+                             store_dir=args.out, workers=args.workers, batch_size=args.batch_size)
+    if store is None:
+        return 1
+
+    print(f"✅ DONE — embeddings saved to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from embedding_store import DEFAULT_EMBEDDING_DIR, recipe_texts, sync_embeddings
+
+# --- Offline Parallel Embedding Builder ---
+# Encodes verses across a pool of processes, each with its own SentenceTransformer.
+# Texts are sorted by length before being cut into shards, so every batch holds
+# texts of similar length and wastes little work on padding. Each finished shard
+# is written to a checkpoint directory right away; re-running an interrupted
+# build picks up the finished shards instead of encoding them again.
+#
+# ParallelEncoder is a drop-in 'encode' callable for embedding_store.sync_embeddings.
+
+_worker_model = None
+
+
+def _init_worker(model_name, threads):
+    """Runs once per worker process: load a private model and cap its thread count."""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # N workers x all cores each would just oversubscribe the CPU
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_shard(shard_path, texts, batch_size):
+    vectors = _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    tmp_path = f"{shard_path}.tmp-{os.getpid()}.npy"
+    np.save(tmp_path, np.asarray(vectors, dtype=np.float32))
+    os.replace(tmp_path, shard_path)
+    return shard_path
+
+
+def _shard_id(model_name, texts):
+    """Names a shard after its content, so a resumed build only trusts matching shards."""
+    hasher = hashlib.blake2b(model_name.encode("utf-8"), digest_size=16)
+    for text in texts:
+        hasher.update(b"\0" + text.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class ParallelEncoder:
+    def __init__(self, model_name, checkpoint_dir, workers=None, batch_size=64, shard_size=512):
+        self.model_name = model_name
+        self.checkpoint_dir = checkpoint_dir
+        self.workers = max(1, workers or (os.cpu_count() or 1))
+        self.batch_size = batch_size
+        self.shard_size = shard_size
+
+    def __call__(self, texts):
+        """Encodes 'texts' and returns a float32 matrix in the original order."""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+        # 1. Sort by (approximate) token count and cut into shards
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i].split()))
+        shards = []
+        for start in range(0, len(order), self.shard_size):
+            members = order[start:start + self.shard_size]
+            shard_texts = [texts[i] for i in members]
+            path = os.path.join(self.checkpoint_dir, f"{_shard_id(self.model_name, shard_texts)}.npy")
+            shards.append((members, shard_texts, path))
+
+        pending = [s for s in shards if not os.path.exists(s[2])]
+        if len(pending) < len(shards):
+            print(f"♻️ Resuming: {len(shards) - len(pending)} of {len(shards)} shards already encoded.")
+
+        # 2. Encode the missing shards in parallel, checkpointing each as it finishes
+        if pending:
+            workers = min(self.workers, len(pending))
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            print(f"⏳ Encoding {len(pending)} shards on {workers} worker(s) x {threads} thread(s)...")
+            context = multiprocessing.get_context("spawn")  # torch does not survive fork() well
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(self.model_name, threads)) as pool:
+                futures = [pool.submit(_encode_shard, path, shard_texts, self.batch_size)
+                           for _, shard_texts, path in pending]
+                for done, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    print(f"   ✔ shard {done}/{len(pending)}")
+
+        # 3. Merge the shards back into the original order
+        vectors = None
+        for members, _, path in shards:
+            shard = np.load(path)
+            if vectors is None:
+                vectors = np.zeros((len(texts), shard.shape[1]), dtype=np.float32)
+            vectors[members] = shard
+        return vectors
+
+    def cleanup(self):
+        """Removes the checkpoints once their vectors are safely in the embedding store."""
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+
+def build_embeddings(verses, model_name, recipe="english", dtype="float32", store_dir=None,
+                     workers=None, batch_size=64, shard_size=512):
+    """
+    Brings the embedding store up to date for a VerseTable, encoding only
+    new/changed verses with a ParallelEncoder. Checkpoints are kept next to the
+    store until the merged artifact has been written; returns None if it could
+    not be.
+    """
+    store_dir = store_dir or DEFAULT_EMBEDDING_DIR
+    encoder = ParallelEncoder(model_name, f"{store_dir}.checkpoints", workers=workers,
+                              batch_size=batch_size, shard_size=shard_size)
+    store, saved = sync_embeddings(recipe_texts(verses, recipe), model_name, encoder,
+                                   recipe=recipe, dtype=dtype, store_dir=store_dir)
+    if not saved:
+        # The checkpoints are the only copy of the new vectors: keep them for the next run
+        if store is not None:
+            print(f"⚠️ Embedding checkpoints kept in '{encoder.checkpoint_dir}'.")
+        return None
+    encoder.cleanup()
+    return store
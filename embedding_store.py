@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from arabic_text import normalize_arabic
+from corpus_store import INDEX_DIR, make_scratch_dir, replace_dir
+from utils import strip_html
+
+# --- Embedding Store ---
+# One on-disk format for verse embeddings, shared by the web app and the
+# offline scripts. An artifact is a directory:
+#
+#   header.json  -> format version, model name, text recipe, dtype, dim, count
+#   hashes.npy   -> 64-bit content hash of every verse's input text  (uint64)
+#   vectors.npy  -> (count x dim) matrix stored as float32, float16 or int8
+#   scales.npy   -> per-row dequantization scale (int8 only)           (float32)
+#
+# vectors.npy is memory-mapped on load so workers share the same pages, and the
+# per-verse hashes mean only verses whose text changed are ever re-encoded.
+
+EMBEDDING_FORMAT_VERSION = 1
+DEFAULT_EMBEDDING_DIR = os.path.join(INDEX_DIR, "embeddings")
+DTYPES = ("float32", "float16", "int8")
+
+# Which verse fields are joined to form the text that gets embedded
+TEXT_RECIPES = {
+    "english": ("english",),
+    "english+tafsir": ("english", "tafsir_en"),
+    "urdu": ("urdu",),
+    "arabic": ("text",),
+}
+
+
+def recipe_texts(verses, recipe="english"):
+    """Builds the input text of every verse for a recipe. Expects a VerseTable."""
+    columns = []
+    for field in TEXT_RECIPES[recipe]:
+        texts = verses.column(field)
+        if field.startswith("tafsir"):
+            texts = [strip_html(t) for t in texts]
+        elif field == "text":
+            # Uthmani diacritics and Quranic marks only confuse a general-purpose model
+            texts = [normalize_arabic(t) for t in texts]
+        columns.append(texts)
+    return [" ".join(part for part in parts if part) for parts in zip(*columns)]
+
+
+def text_hashes(texts):
+    """64-bit BLAKE2 digest of each text, as a uint64 array."""
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little") for t in texts],
+        dtype=np.uint64,
+    )
+
+
+def quantize(vectors, dtype):
+    """float32 matrix -> (stored matrix, per-row scales or None)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        # Symmetric per-row scaling keeps every row's full int8 range
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+
+class EmbeddingStore:
+    def __init__(self, header, vectors, hashes, scales=None):
+        self.header = header
+        self.vectors = vectors
+        self.hashes = hashes
+        self.scales = scales
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @property
+    def dtype(self):
+        return self.header["dtype"]
+
+    def matches(self, model_name, recipe):
+        return self.header.get("model") == model_name and self.header.get("recipe") == recipe
+
+    def fingerprint(self):
+        """Identifies the exact vectors: model, recipe, dtype and every verse hash."""
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(f"{self.header['model']}|{self.header['recipe']}|{self.dtype}|".encode("utf-8"))
+        hasher.update(np.ascontiguousarray(self.hashes).tobytes())
+        return hasher.hexdigest()
+
+    def to_float32(self):
+        """
+        The embeddings as float32. For float32 storage this is the memory map
+        itself (no copy); float16/int8 are dequantized into a private array.
+        """
+        if self.dtype == "float32":
+            return self.vectors
+        matrix = np.asarray(self.vectors, dtype=np.float32)
+        if self.scales is not None:
+            matrix *= self.scales[:, None]
+        return matrix
+
+    def save(self, store_dir):
+        tmp_dir = make_scratch_dir(store_dir)
+        np.save(os.path.join(tmp_dir, "vectors.npy"), self.vectors)
+        np.save(os.path.join(tmp_dir, "hashes.npy"), self.hashes)
+        if self.scales is not None:
+            np.save(os.path.join(tmp_dir, "scales.npy"), self.scales)
+        with open(os.path.join(tmp_dir, "header.json"), "w", encoding="utf-8") as f:
+            json.dump(self.header, f, indent=2)
+        replace_dir(tmp_dir, store_dir)
+
+    @classmethod
+    def load(cls, store_dir, mmap_mode="r"):
+        with open(os.path.join(store_dir, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("version") != EMBEDDING_FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store version in '{store_dir}'")
+
+        vectors = np.load(os.path.join(store_dir, "vectors.npy"), mmap_mode=mmap_mode)
+        hashes = np.load(os.path.join(store_dir, "hashes.npy"))
+        scales = None
+        if header["dtype"] == "int8":
+            scales = np.load(os.path.join(store_dir, "scales.npy"))
+        return cls(header, vectors, hashes, scales)
+
+    @classmethod
+    def create(cls, vectors, hashes, model_name, recipe, dtype="float32"):
+        stored, scales = quantize(vectors, dtype)
+        header = {
+            "version": EMBEDDING_FORMAT_VERSION,
+            "model": model_name,
+            "recipe": recipe,
+            "dtype": dtype,
+            "dim": int(stored.shape[1]) if stored.ndim == 2 else 0,
+            "count": len(hashes),
+        }
+        return cls(header, stored, hashes, scales)
+
+
+def load_embeddings(texts, model_name, recipe="english", store_dir=DEFAULT_EMBEDDING_DIR, mmap_mode="r"):
+    """
+    Opens the embedding store for serving. Never encodes anything: returns None
+    (with a hint to run 'build_index.py') if the store is missing or does not
+    match the current text, model or recipe.
+    """
+    if not os.path.exists(os.path.join(store_dir, "header.json")):
+        print(f"⚠️ No embeddings found in '{store_dir}'. Run 'python build_index.py' to build them.")
+        return None
+
+    try:
+        store = EmbeddingStore.load(store_dir, mmap_mode=mmap_mode)
+    except Exception as e:
+        print(f"⚠️ Error loading embeddings: {e}. Run 'python build_index.py' to rebuild them.")
+        return None
+
+    if not store.matches(model_name, recipe):
+        print(f"⚠️ Embeddings in '{store_dir}' were built with a different model/recipe. Run 'python build_index.py'.")
+        return None
+    stale = len(store) != len(texts) or not np.array_equal(store.hashes, text_hashes(texts))
+    if stale:
+        print(f"⚠️ Embeddings in '{store_dir}' are out of date with the verse text. Run 'python build_index.py'.")
+        return None
+
+    print(f"✅ Embeddings loaded from '{store_dir}' ({store.dtype}).")
+    return store
+
+
+def sync_embeddings(texts, model_name, encode, recipe="english", dtype="float32",
+                    store_dir=DEFAULT_EMBEDDING_DIR, mmap_mode="r"):
+    """
+    Returns (store, saved): an EmbeddingStore that is up to date with 'texts',
+    and whether it is on disk in 'store_dir' (False if writing it failed; the
+    store is then only in memory). Vectors of verses whose text hash is
+    unchanged are reused if they are stored with the requested dtype; only
+    new or changed verses are passed to 'encode' (a callable: list of str ->
+    float32 matrix). Nothing is written when everything is already current.
+    """
+    if not texts:
+        return None, False
+
+    hashes = text_hashes(texts)
+    previous = None
+
+    if os.path.exists(os.path.join(store_dir, "header.json")):
+        try:
+            previous = EmbeddingStore.load(store_dir, mmap_mode=mmap_mode)
+            if not previous.matches(model_name, recipe):
+                print(f"⚠️ Embeddings in '{store_dir}' were built with a different model/recipe. Re-encoding all verses...")
+                previous = None
+            elif previous.dtype != dtype:
+                # Reused rows would keep the stored precision (or be quantized twice)
+                print(f"⚠️ Embeddings in '{store_dir}' are stored as {previous.dtype}. Re-encoding all verses as {dtype}...")
+                previous = None
+            elif np.array_equal(previous.hashes, hashes):
+                print(f"✅ Embeddings loaded from '{store_dir}' ({dtype}, cache hit).")
+                return previous, True
+        except Exception as e:
+            print(f"⚠️ Error loading embeddings: {e}. Re-encoding all verses...")
+            previous = None
+
+    # Reuse by hash rather than by position, so inserted/removed verses don't shift everything
+    reusable = {}
+    if previous is not None:
+        reusable = {int(h): i for i, h in enumerate(previous.hashes)}
+    stale = [i for i, h in enumerate(hashes) if int(h) not in reusable]
+
+    vectors = None
+    if previous is not None and len(previous):
+        old = previous.to_float32()
+        vectors = np.zeros((len(texts), old.shape[1]), dtype=np.float32)
+        for i, h in enumerate(hashes):
+            if int(h) in reusable:
+                vectors[i] = old[reusable[int(h)]]
+
+    if stale:
+        print(f"⏳ Encoding {len(stale)} of {len(texts)} verses...")
+        fresh = np.asarray(encode([texts[i] for i in stale]), dtype=np.float32)
+        if vectors is None:
+            vectors = np.zeros((len(texts), fresh.shape[1]), dtype=np.float32)
+        vectors[stale] = fresh
+
+    store = EmbeddingStore.create(vectors, hashes, model_name, recipe, dtype)
+    try:
+        store.save(store_dir)
+        print(f"💾 Embeddings saved to '{store_dir}' ({dtype}).")
+        return EmbeddingStore.load(store_dir, mmap_mode=mmap_mode), True
+    except Exception as e:
+        print(f"⚠️ Could not save embeddings: {e}")
+        return store, False
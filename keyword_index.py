@@ -0,0 +1,254 @@
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, TfidfVectorizer
+
+from arabic_text import arabic_tokenize
+from corpus_store import make_scratch_dir, replace_dir
+
+# --- Sparse Keyword Scoring ---
+# Scoring a query against every verse and sorting all 6,236 scores wastes work:
+# only verses containing at least one query term can score above zero. The
+# inverted index below keeps, for every term, the verses it occurs in together
+# with a precomputed weight, so a query only touches the postings of its own terms.
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k largest scores, best first; equal scores keep index order.
+    Uses a partition to find the k-th largest score and sorts only the
+    candidates at or above it (every tie at the cut-off is included, so the
+    result does not depend on which tied entry the partition happened to pick).
+    """
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+
+class InvertedIndex:
+    """
+    Term -> posting list, stored in CSC layout:
+    the postings of term 't' are doc_ids[indptr[t]:indptr[t + 1]] with matching weights.
+    """
+
+    def __init__(self, indptr, doc_ids, weights, n_docs):
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = n_docs
+
+    @classmethod
+    def from_matrix(cls, doc_term_matrix):
+        """Builds the index from a (documents x terms) sparse matrix of weights."""
+        csc = doc_term_matrix.tocsc()
+        csc.sort_indices()
+        return cls(csc.indptr, csc.indices, csc.data, doc_term_matrix.shape[0])
+
+    def score(self, term_ids, query_weights):
+        """
+        Accumulates query_weight * posting_weight over the postings of the given terms.
+        Returns (doc_ids, scores) for every verse matching at least one term.
+        """
+        docs, weights = [], []
+        for term, qw in zip(term_ids, query_weights):
+            start, end = self.indptr[term], self.indptr[term + 1]
+            if start == end:
+                continue
+            docs.append(self.doc_ids[start:end])
+            weights.append(self.weights[start:end] * qw)
+
+        if not docs:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        docs = np.concatenate(docs)
+        weights = np.concatenate(weights)
+        matched, slots = np.unique(docs, return_inverse=True)
+        return matched, np.bincount(slots, weights=weights)
+
+    def top_k(self, term_ids, query_weights, k):
+        """The k best (doc_id, score) pairs for a weighted set of query terms."""
+        matched, scores = self.score(term_ids, query_weights)
+        return [(int(matched[i]), float(scores[i])) for i in top_k_indices(scores, k)]
+
+
+class TfidfKeywordIndex:
+    """
+    TF-IDF cosine search over posting lists.
+    Rows of the fitted TF-IDF matrix (and transformed queries) are L2-normalized,
+    so cosine similarity reduces to a sparse dot product over shared terms.
+
+    On disk the index is a directory of plain .npy arrays (memory-mapped on load,
+    so workers share the pages) plus the vocabulary, idf vector and metadata:
+        meta.json, vocab.json, idf.npy, indptr.npy, doc_ids.npy, weights.npy
+    The three posting arrays are the CSR form of the (terms x verses) matrix.
+    """
+
+    VERSION = 1
+
+    def __init__(self, vectorizer, postings, meta=None):
+        self.vectorizer = vectorizer
+        self.postings = postings
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, texts, params, key=""):
+        """Fits a TfidfVectorizer(**params) on 'texts'."""
+        vectorizer = TfidfVectorizer(**params)
+        tfidf_matrix = vectorizer.fit_transform(texts)
+        meta = {"version": cls.VERSION, "key": key, "params": params}
+        return cls(vectorizer, InvertedIndex.from_matrix(tfidf_matrix), meta)
+
+    def save(self, index_dir):
+        tmp_dir = make_scratch_dir(index_dir)
+        np.save(os.path.join(tmp_dir, "idf.npy"), self.vectorizer.idf_)
+        np.save(os.path.join(tmp_dir, "indptr.npy"), self.postings.indptr)
+        np.save(os.path.join(tmp_dir, "doc_ids.npy"), self.postings.doc_ids)
+        np.save(os.path.join(tmp_dir, "weights.npy"), self.postings.weights)
+        vocabulary = {term: int(i) for term, i in self.vectorizer.vocabulary_.items()}
+        with open(os.path.join(tmp_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(self.meta, n_docs=self.postings.n_docs), f)
+        replace_dir(tmp_dir, index_dir)
+
+    @classmethod
+    def load(cls, index_dir, mmap_mode="r"):
+        """Restores a fitted vectorizer and the posting lists without refitting anything."""
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported TF-IDF index version in '{index_dir}'")
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+
+        def array(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode=mmap_mode)
+
+        vectorizer = TfidfVectorizer(**meta["params"])
+        vectorizer.vocabulary_ = vocabulary
+        vectorizer.idf_ = np.asarray(array("idf.npy"))
+        postings = InvertedIndex(array("indptr.npy"), array("doc_ids.npy"), array("weights.npy"), meta["n_docs"])
+        return cls(vectorizer, postings, meta)
+
+    def search(self, query, top_k=5):
+        """Returns up to top_k (verse_index, score) pairs, best first."""
+        query_vec = self.vectorizer.transform([query])
+        return self.postings.top_k(query_vec.indices, query_vec.data, top_k)
+
+
+# --- BM25F Search ---
+# Okapi BM25 over several weighted fields (English translation + tafsir).
+# A term's BM25 contribution to a verse does not depend on the rest of the query,
+# so the final per-posting impact is computed once at build time and the same
+# InvertedIndex scorer is reused. The whole index is saved as a single .npz file.
+
+BM25_VERSION = 1
+TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")  # Same token pattern as TfidfVectorizer
+
+
+def tokenize(text):
+    """Lowercased word tokens with English stop words removed."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in ENGLISH_STOP_WORDS]
+
+
+# Analyzer used for both indexing and queries, recorded in the index metadata
+ANALYZERS = {
+    "english": tokenize,
+    "arabic": arabic_tokenize,  # Arabic text and Urdu translation (see arabic_text.py)
+}
+
+
+class BM25Index:
+    """
+    BM25F index. 'fields' maps a field name to (weight, b); term frequencies are
+    length-normalized per field, weighted, summed, then saturated with k1.
+    """
+
+    DEFAULT_FIELDS = {"english": (1.0, 0.75), "tafsir_en": (0.3, 0.75)}
+
+    def __init__(self, vocabulary, postings, meta):
+        self.vocabulary = vocabulary
+        self.postings = postings
+        self.meta = meta
+
+    @classmethod
+    def build(cls, field_texts, fields=None, k1=1.2, key="", analyzer="english"):
+        """
+        field_texts: {field_name: [text of verse 0, text of verse 1, ...]}
+        fields:      {field_name: (weight, b)} (defaults to DEFAULT_FIELDS)
+        analyzer:    key of ANALYZERS
+        """
+        fields = fields or cls.DEFAULT_FIELDS
+        analyze = ANALYZERS[analyzer]
+        n_docs = len(next(iter(field_texts.values())))
+        vocabulary = {}
+        pseudo_tf = [Counter() for _ in range(n_docs)]
+
+        for field, (weight, b) in fields.items():
+            tokens = [analyze(text or "") for text in field_texts[field]]
+            avg_len = max(sum(len(t) for t in tokens) / max(n_docs, 1), 1e-9)
+            for doc, doc_tokens in enumerate(tokens):
+                norm = 1.0 - b + b * len(doc_tokens) / avg_len
+                for term, tf in Counter(doc_tokens).items():
+                    term_id = vocabulary.setdefault(term, len(vocabulary))
+                    pseudo_tf[doc][term_id] += weight * tf / norm
+
+        # Flatten to (term, doc, tf) triples sorted by term -> CSC posting lists
+        terms = np.fromiter((t for c in pseudo_tf for t in c), dtype=np.int64)
+        docs = np.fromiter((d for d, c in enumerate(pseudo_tf) for _ in c), dtype=np.int32)
+        tf = np.fromiter((v for c in pseudo_tf for v in c.values()), dtype=np.float64)
+        order = np.lexsort((docs, terms))
+        terms, docs, tf = terms[order], docs[order], tf[order]
+
+        df = np.bincount(terms, minlength=len(vocabulary))
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        impact = (idf[terms] * tf / (k1 + tf)).astype(np.float32)
+        indptr = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+
+        meta = {
+            "version": BM25_VERSION,
+            "key": key,
+            "k1": k1,
+            "analyzer": analyzer,
+            "fields": {f: list(p) for f, p in fields.items()},
+        }
+        return cls(vocabulary, InvertedIndex(indptr, docs, impact, n_docs), meta)
+
+    def save(self, path):
+        """Writes the index to 'path' (.npz) atomically."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(
+            tmp_path,
+            vocab=np.array(terms),
+            indptr=self.postings.indptr,
+            doc_ids=self.postings.doc_ids,
+            weights=self.postings.weights,
+            n_docs=np.array(self.postings.n_docs),
+            meta=np.array(json.dumps(self.meta)),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            vocabulary = {term: i for i, term in enumerate(data["vocab"].tolist())}
+            postings = InvertedIndex(data["indptr"], data["doc_ids"], data["weights"], int(data["n_docs"]))
+        return cls(vocabulary, postings, meta)
+
+    def search(self, query, top_k=5):
+        """Returns up to top_k (verse_index, score) pairs, best first."""
+        analyze = ANALYZERS[self.meta.get("analyzer", "english")]
+        counts = Counter(t for t in analyze(query) if t in self.vocabulary)
+        term_ids = [self.vocabulary[t] for t in counts]
+        return self.postings.top_k(term_ids, list(counts.values()), top_k)
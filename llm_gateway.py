@@ -0,0 +1,353 @@
+import asyncio
+import hashlib
+import random
+import re
+import time
+
+# --- LLM Gateway ---
+# One global genai.Client with no timeout, retries or concurrency cap meant
+# that a slow provider stalled every worker, and identical questions asked at
+# the same moment each paid for their own generation. Every answer now goes
+# through LLMGateway, which runs on the shared event loop (see llm_stream.py)
+# and applies, in order:
+#   1. single-flight: an identical prompt already in flight is joined, not re-sent
+#   2. circuit breaker: after repeated failures, fail fast for a cool-down period
+#   3. token bucket: at most 'rate' upstream calls per second (bursts of 'burst')
+#   4. concurrency cap: at most 'max_concurrency' upstream streams at once
+#   5. deadlines: first-token and overall time limits per call
+#   6. retries with exponential backoff, only before the first chunk is sent
+# Providers hide the actual API: GeminiProvider (pooled connections, optional
+# base_url for the local stub server) or FakeProvider (in-process, for load tests).
+
+CANNED_ANSWER = (
+    "**Direct Answer:** This is a canned answer from the stub LLM server.\n\n"
+    "**Key Insights:**\n"
+    "- The retrieval context was received and the answer is streamed token by token.\n"
+    "- Citations look like *2:152* in real answers.\n\n"
+    "**Conclusion:** Replace `LLM_BASE_URL` with the real endpoint to get genuine answers."
+)
+
+# HTTP statuses worth retrying: rate limited, or a transient server-side failure
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """The gateway refused or abandoned the call (see subclasses)."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+class RateLimitedError(LLMUnavailable):
+    pass
+
+
+class DeadlineExceeded(LLMUnavailable, TimeoutError):
+    pass
+
+
+class UpstreamError(Exception):
+    """A provider failure with an HTTP-like status code."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+def is_retryable(exc):
+    if isinstance(exc, LLMUnavailable):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    # httpx transport errors (connect / read failures) are transient too
+    return type(exc).__module__.startswith("httpx") and type(exc).__name__.endswith(("ConnectError", "ReadError",
+                                                                                      "RemoteProtocolError"))
+
+
+# --- Providers ---
+
+class LLMProvider:
+    """An LLM API: stream(prompt, config) is an async iterator of text chunks."""
+
+    name = "provider"
+
+    def stream(self, prompt, config=None):
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    def __init__(self, api_key, model, base_url=None, temperature=0.7, max_output_tokens=800,
+                 max_connections=32, timeout_seconds=120):
+        from google import genai
+        import httpx
+
+        self.name = f"gemini:{model}"
+        self.model = model
+        self.config = genai.types.GenerateContentConfig(temperature=temperature, max_output_tokens=max_output_tokens)
+        # One client, one pooled HTTP connection set, kept alive between calls
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = genai.Client(api_key=api_key, http_options=genai.types.HttpOptions(
+            base_url=base_url,
+            timeout=int(timeout_seconds * 1000),
+            async_client_args={"limits": limits},
+        ))
+
+    async def stream(self, prompt, config=None):
+        response = await self.client.aio.models.generate_content_stream(
+            model=self.model, contents=prompt, config=config or self.config)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeProvider(LLMProvider):
+    """In-process stand-in: canned words after 'latency_ms', failing with 'fail_rate'."""
+
+    name = "fake"
+
+    def __init__(self, answer=CANNED_ANSWER, latency_ms=200, token_delay_ms=10, fail_rate=0.0, seed=None):
+        self.tokens = re.findall(r"\S+\s*", answer)
+        self.latency = latency_ms / 1000
+        self.token_delay = token_delay_ms / 1000
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    async def stream(self, prompt, config=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.fail_rate:
+            raise UpstreamError("fake provider: 503 Service Unavailable", code=503)
+        for token in self.tokens:
+            yield token
+            await asyncio.sleep(self.token_delay)
+
+
+# --- Policies ---
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self, deadline):
+        """Takes one token, waiting for a refill if needed; False if none arrives before 'deadline'."""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """closed -> (failure_threshold consecutive failures) -> open -> (reset_seconds) -> half-open -> closed/open."""
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+
+    def allow(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.state = "half-open"
+        if self.state == "half-open":
+            if self._probing:
+                return False  # one probe call at a time
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def release_probe(self):
+        """The probe call was abandoned without an outcome."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class _Flight:
+    """One upstream call and everything it has produced so far, shared by its subscribers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.changed = asyncio.Event()
+
+    def publish(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class LLMGateway:
+    def __init__(self, provider, max_concurrency=8, rate=5.0, burst=10, deadline_seconds=60.0,
+                 first_token_seconds=20.0, retries=2, backoff_seconds=0.5, breaker=None):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.deadline_seconds = deadline_seconds
+        self.first_token_seconds = first_token_seconds
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker or CircuitBreaker()
+        self._loop = None
+        self._semaphore = None
+        self._flights = {}
+        self.counters = {"calls": 0, "coalesced": 0, "upstream": 0, "retries": 0, "failures": 0,
+                         "timeouts": 0, "rate_limited": 0, "circuit_rejected": 0}
+
+    def _bind(self):
+        # asyncio primitives belong to one event loop; the shared loop is replaced after a fork
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._flights = {}
+
+    def _key(self, prompt, config):
+        return hashlib.sha256(f"{self.provider.name}\x1f{config!r}\x1f{prompt}".encode("utf-8")).hexdigest()
+
+    async def stream(self, prompt, config=None):
+        """
+        Async iterator of the answer's text chunks. Identical concurrent prompts
+        share one upstream call; raises LLMUnavailable subclasses (or the
+        provider's error) when the call is refused or fails.
+        """
+        self._bind()
+        self.counters["calls"] += 1
+        key = self._key(prompt, config)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._run(key, flight, prompt, config))
+        else:
+            self.counters["coalesced"] += 1
+
+        flight.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                changed = flight.changed
+                while sent < len(flight.chunks):
+                    sent += 1
+                    yield flight.chunks[sent - 1]
+                if flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.finished:
+                flight.task.cancel()  # nobody is listening any more
+
+    async def _run(self, key, flight, prompt, config):
+        deadline = time.monotonic() + self.deadline_seconds
+        probe = False
+        try:
+            if not self.breaker.allow():
+                self.counters["circuit_rejected"] += 1
+                raise CircuitOpenError("LLM circuit breaker is open")
+            probe = self.breaker.state == "half-open"  # this call is the one probe
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                # Local congestion, not an upstream failure: the breaker only counts call outcomes
+                self.counters["timeouts"] += 1
+                raise DeadlineExceeded("Timed out waiting for a free LLM slot")
+            try:
+                await self._call(flight, prompt, config, deadline)
+            finally:
+                self._semaphore.release()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            if probe:
+                # A probe that ended without an outcome (rate limited, cancelled...) must not
+                # leave the breaker waiting for it forever; after an outcome this is a no-op
+                self.breaker.release_probe()
+            flight.finished = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.publish()
+
+    async def _call(self, flight, prompt, config, deadline):
+        attempt = 0
+        while True:
+            if not await self.bucket.acquire(deadline):
+                self.counters["rate_limited"] += 1
+                raise RateLimitedError("LLM rate limit reached")
+            self.counters["upstream"] += 1
+            try:
+                await self._relay(flight, prompt, config, deadline)
+                self.breaker.record_success()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, DeadlineExceeded):
+                    self.counters["timeouts"] += 1
+                # A partly streamed answer cannot be retried: subscribers already have its start
+                backoff = self.backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+                if flight.chunks or attempt >= self.retries or not is_retryable(e) \
+                        or time.monotonic() + backoff >= deadline:
+                    self.counters["failures"] += 1
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                self.counters["retries"] += 1
+                await asyncio.sleep(backoff)
+
+    async def _relay(self, flight, prompt, config, deadline):
+        chunks = self.provider.stream(prompt, config).__aiter__()
+        first_token_by = min(deadline, time.monotonic() + self.first_token_seconds)
+        try:
+            while True:
+                limit = deadline if flight.chunks else first_token_by
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(limit - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("LLM call exceeded its deadline") from None
+                flight.chunks.append(chunk)
+                flight.publish()
+        finally:
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    def stats(self):
+        return dict(self.counters, provider=self.provider.name, in_flight=len(self._flights),
+                    circuit=self.breaker.state, circuit_opened=self.breaker.times_opened)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+
+# --- Streaming LLM Answers ---
+# generate_content blocked a Flask worker for the whole multi-second answer, and
+# the browser saw nothing until the last token. Answers are now generated by
+# async code (see llm_gateway.py) on one background event loop shared by every
+# request: the loop keeps any number of slow LLM streams in flight at once, and
+# a request thread only relays finished text chunks from a queue to the browser.
+
+# Longest wait for the next chunk before the answer is abandoned
+LLM_STREAM_TIMEOUT = float(os.environ.get("LLM_STREAM_TIMEOUT", "60"))
+
+_DONE = object()
+
+
+class AsyncLLMRunner:
+    def __init__(self, timeout=LLM_STREAM_TIMEOUT):
+        self.timeout = timeout
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.active = 0
+        self.streams = 0
+        self.chunks = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    def _event_loop(self):
+        # Started lazily (and again after a fork: threads do not survive it)
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-stream", daemon=True).start()
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    def stream(self, make_stream):
+        """
+        Runs 'make_stream()' (an async iterator of text chunks, e.g.
+        LLMGateway.stream) on the background loop and yields its chunks in the
+        calling thread as they arrive. Upstream errors are re-raised here; if
+        the caller stops early (client disconnected), the LLM call is cancelled.
+        """
+        chunks = queue.Queue()
+
+        async def pump():
+            try:
+                async for text in make_stream():
+                    chunks.put(text)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(_DONE)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._event_loop())
+        finished = False
+        with self._lock:
+            self.active += 1
+            self.streams += 1
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No answer chunk within {self.timeout:.0f}s")
+                if item is _DONE:
+                    finished = True
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                with self._lock:
+                    self.chunks += 1
+                yield item
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.active -= 1
+                if not finished and not future.done():
+                    self.cancelled += 1
+            future.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "streams": self.streams,
+                "chunks": self.chunks,
+                "errors": self.errors,
+                "cancelled": self.cancelled,
+            }
+
+
+def sse_event(event, data):
+    """One server-sent event with a JSON payload (JSON keeps newlines in tokens intact)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -1,65 +1,220 @@
-import json
-
-class Verse:
-    def __init__(self, surah, ayah_number, english, urdu, text="", tafsir_en="", tafsir_ur=""):
-        self.surah = surah
-        self.ayah_number = ayah_number
-        self.english = english
-        self.urdu = urdu
-        self.text = text  # Arabic verse
-        self.tafsir_en = tafsir_en  # English Tafsir (HTML)
-        self.tafsir_ur = tafsir_ur  # Urdu Tafsir (HTML/Text)
-
-    def to_dict(self):
-        """Converts the Verse object to a dictionary (useful for API responses)."""
-        return {
-            "surah": self.surah,
-            "ayah_number": self.ayah_number,
-            "text": self.text,
-            "english": self.english,
-            "urdu": self.urdu,
-            "tafsir_en": self.tafsir_en,
-            "tafsir_ur": self.tafsir_ur
-        }
-
-def load_quran_data(filepath):
-    """
-    Loads Quranic verses from the new 'quran_complete.json' format.
-    Expects structure: { "surahs": [ { "name_en": "...", "verses": [...] } ] }
-    """
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        print(f"❌ File not found: {filepath}")
-        return []
-
-    verses = []
-    
-    # Access the list of Surahs from the new structure
-    surah_list = data.get("surahs", [])
-
-    for surah in surah_list:
-        surah_name = surah.get("name_en", "Unknown")
-        
-        for verse in surah.get("verses", []):
-            # Extract translations safely
-            translations = verse.get("translations", {})
-            
-            # Extract tafsir safely
-            tafsir = verse.get("tafsir", {})
-
-            # Create Verse object
-            verses.append(
-                Verse(
-                    surah=surah_name,
-                    ayah_number=verse.get("ayah", 0),
-                    text=verse.get("arabic", {}).get("text", ""),
-                    english=translations.get("en", ""),
-                    urdu=translations.get("ur", ""),
-                    tafsir_en=tafsir.get("en", ""),
-                    tafsir_ur=tafsir.get("ur", "")
-                )
-            )
-            
-    return verses
\ No newline at end of file
+import array
+import operator
+import sys
+
+from corpus_store import load_corpus, TafsirCache
+
+class Verse:
+    __slots__ = ("surah", "ayah_number", "english", "urdu", "text", "tafsir_en", "tafsir_ur")
+
+    def __init__(self, surah, ayah_number, english, urdu, text="", tafsir_en="", tafsir_ur=""):
+        self.surah = surah
+        self.ayah_number = ayah_number
+        self.english = english
+        self.urdu = urdu
+        self.text = text  # Arabic verse
+        self.tafsir_en = tafsir_en  # English Tafsir (HTML)
+        self.tafsir_ur = tafsir_ur  # Urdu Tafsir (HTML/Text)
+
+    def to_dict(self):
+        """Converts the Verse object to a dictionary (useful for API responses)."""
+        return {
+            "surah": self.surah,
+            "ayah_number": self.ayah_number,
+            "text": self.text,
+            "english": self.english,
+            "urdu": self.urdu,
+            "tafsir_en": self.tafsir_en,
+            "tafsir_ur": self.tafsir_ur
+        }
+
+
+# --- Columnar Verse Table ---
+
+class VerseRow:
+    """
+    Lightweight view of one row of a VerseTable.
+    Holds nothing but the table and the row index; every field is read from the
+    table's columns on access. Supports both attribute access (templates) and the
+    dict-style access ('v["english"]', 'v.get(...)') used throughout the app.
+    """
+    __slots__ = ("table", "index")
+
+    KEYS = ("surah", "surah_ar", "surah_type", "surah_id", "ayah_number",
+            "text", "english", "urdu", "tafsir_en", "tafsir_ur", "tafsir_en_text")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def surah_id(self):
+        return self.table.surah_ids[self.index]
+
+    @property
+    def ayah_number(self):
+        return self.table.ayah_numbers[self.index]
+
+    @property
+    def surah(self):
+        return self.table.surah_meta(self.surah_id)[0]
+
+    @property
+    def surah_ar(self):
+        return self.table.surah_meta(self.surah_id)[1]
+
+    @property
+    def surah_type(self):
+        return self.table.surah_meta(self.surah_id)[2]
+
+    @property
+    def text(self):
+        return self.table.corpus.get("text", self.index)
+
+    @property
+    def english(self):
+        return self.table.corpus.get("english", self.index)
+
+    @property
+    def urdu(self):
+        return self.table.corpus.get("urdu", self.index)
+
+    @property
+    def tafsir_en(self):
+        return self.table.tafsir.get_row(self.index, "tafsir_en")
+
+    @property
+    def tafsir_ur(self):
+        return self.table.tafsir.get_row(self.index, "tafsir_ur")
+
+    @property
+    def tafsir_en_text(self):
+        # English tafsir as plain text (HTML stripped when the store was compiled)
+        return self.table.tafsir.get_row(self.index, "tafsir_en_text")
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.KEYS:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return self.KEYS
+
+    def to_dict(self, include_tafsir=False):
+        """Copies the row into a plain dictionary (useful for API responses)."""
+        keys = self.KEYS if include_tafsir else self.KEYS[:-3]
+        return {key: getattr(self, key) for key in keys}
+
+    def __eq__(self, other):
+        return isinstance(other, VerseRow) and self.table is other.table and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+    def __repr__(self):
+        return f"<VerseRow {self.surah_id}:{self.ayah_number}>"
+
+
+class VerseTable:
+    """
+    Columnar, read-only table of every verse, backed by the corpus store.
+    - surah_id / ayah_number are compact integer arrays
+    - surah names are interned once per surah, not once per verse
+    - text columns stay in the store as offsets into memory-mapped blobs
+    Indexing returns VerseRow views, so no per-verse dicts are ever built.
+    """
+
+    def __init__(self, corpus, tafsir_cache_bytes=16 * 1024 * 1024):
+        self.corpus = corpus
+        self.tafsir = TafsirCache(corpus, max_bytes=tafsir_cache_bytes)
+
+        # rows.bin interleaves (surah_id, ayah_number)
+        self.surah_ids = array.array("H", corpus.rows[0::2])
+        self.ayah_numbers = array.array("H", corpus.rows[1::2])
+
+        self._surahs = {}
+        for s in corpus.manifest["surahs"]:
+            self._surahs[s["id"]] = (
+                sys.intern(s.get("name_en", "Unknown")),
+                sys.intern(s.get("name_ar", "")),
+                sys.intern(s.get("type", "Meccan")),
+            )
+
+    def __len__(self):
+        return len(self.surah_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [VerseRow(self, i) for i in range(*index.indices(len(self)))]
+        index = operator.index(index)  # Also accepts NumPy integers
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("verse index out of range")
+        return VerseRow(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield VerseRow(self, i)
+
+    def surah_meta(self, surah_id):
+        """(name_en, name_ar, type) of a surah."""
+        return self._surahs.get(surah_id, ("Unknown", "", "Meccan"))
+
+    def row(self, surah_id, ayah_number):
+        """O(1) lookup by (surah, ayah). Returns None if there is no such verse."""
+        index = self.corpus.row_index(surah_id, ayah_number)
+        return None if index is None else VerseRow(self, index)
+
+    def surah_rows(self, surah_id):
+        """All verses of a surah in ayah order (empty if the surah does not exist)."""
+        span = self.corpus.surah_range(surah_id)
+        if span is None:
+            return []
+        return [VerseRow(self, i) for i in range(*span)]
+
+    def column(self, field):
+        """Decodes one text column for every verse (used when building search indices)."""
+        return [self.corpus.get(field, i) for i in range(len(self))]
+
+
+def load_verse_table(filepath="quran_complete.json", tafsir_cache_bytes=16 * 1024 * 1024):
+    """Opens the corpus store and wraps it in a VerseTable (None if no data is available)."""
+    corpus = load_corpus(filepath)
+    if corpus is None:
+        return None
+    return VerseTable(corpus, tafsir_cache_bytes=tafsir_cache_bytes)
+
+
+def load_quran_data(filepath):
+    """
+    Loads Quranic verses from the new 'quran_complete.json' format.
+    Expects structure: { "surahs": [ { "name_en": "...", "verses": [...] } ] }
+    Reads through the compiled corpus store, so the JSON is only parsed when
+    the store needs (re)building.
+    """
+    table = load_verse_table(filepath)
+    if table is None:
+        return []
+
+    verses = []
+    for row in table:
+        verses.append(
+            Verse(
+                surah=row.surah,
+                ayah_number=row.ayah_number,
+                text=row.text,
+                english=row.english,
+                urdu=row.urdu,
+                # Read straight from the store: every entry is needed once, caching would only churn
+                tafsir_en=table.corpus.get("tafsir_en", row.index),
+                tafsir_ur=table.corpus.get("tafsir_ur", row.index)
+            )
+        )
+
+    return verses
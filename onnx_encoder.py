@@ -0,0 +1,282 @@
+import importlib.util
+import json
+import os
+import unicodedata
+
+import numpy as np
+
+from corpus_store import INDEX_DIR, make_scratch_dir, replace_dir
+
+# --- ONNX Runtime Query Encoder ---
+# Serving queries through full PyTorch makes worker start-up slow and every
+# query expensive on CPU-only nodes. The MiniLM transformer is exported once to
+# ONNX (optionally dynamic-quantized to int8) together with its WordPiece
+# vocabulary; at serve time queries are tokenized and mean-pooled in NumPy and
+# run through onnxruntime, so workers never import torch.
+#
+# An export is a directory:
+#   config.json      -> model name, max sequence length, lowercasing, pooling
+#   vocab.txt        -> WordPiece vocabulary
+#   model.onnx       -> fp32 transformer (input ids -> last hidden state)
+#   model_int8.onnx  -> int8 weights (only with quantize=True)
+
+DEFAULT_ONNX_DIR = os.path.join(INDEX_DIR, "onnx")
+
+
+def require_onnx(*modules):
+    """Raises ImportError with the install command if any of 'modules' is missing."""
+    missing = [name for name in modules if importlib.util.find_spec(name) is None]
+    if missing:
+        raise ImportError(f"{', '.join(missing)} not installed; run 'pip install onnx onnxruntime' "
+                          f"(see requirements.txt) to use the ONNX backend")
+
+
+def onnx_dir(model_name, root=DEFAULT_ONNX_DIR):
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def _is_punctuation(ch):
+    # Same rule as BERT: all non-alphanumeric ASCII counts, plus Unicode 'P*'
+    cp = ord(ch)
+    if 33 <= cp <= 47 or 58 <= cp <= 64 or 91 <= cp <= 96 or 123 <= cp <= 126:
+        return True
+    return unicodedata.category(ch).startswith("P")
+
+
+def _is_cjk(cp):
+    return (0x4E00 <= cp <= 0x9FFF or 0x3400 <= cp <= 0x4DBF or 0x20000 <= cp <= 0x2A6DF
+            or 0x2A700 <= cp <= 0x2B81F or 0xF900 <= cp <= 0xFAFF or 0x2F800 <= cp <= 0x2FA1F)
+
+
+class WordPieceTokenizer:
+    """
+    Pure-Python port of BERT's uncased tokenizer (basic split + greedy WordPiece).
+    Produces the same ids as the Hugging Face tokenizer the model was trained with.
+    """
+
+    def __init__(self, vocab_file, do_lower_case=True, max_length=256):
+        with open(vocab_file, "r", encoding="utf-8") as f:
+            self.vocab = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        self.do_lower_case = do_lower_case
+        self.max_length = max_length
+        self.cls_id = self.vocab["[CLS]"]
+        self.sep_id = self.vocab["[SEP]"]
+        self.unk_id = self.vocab["[UNK]"]
+        self.pad_id = self.vocab.get("[PAD]", 0)
+        self._cache = {}
+
+    def _basic_tokens(self, text):
+        chars = []
+        for ch in text:
+            cp = ord(ch)
+            if cp == 0 or cp == 0xFFFD or (unicodedata.category(ch).startswith("C") and ch not in "\t\n\r"):
+                continue
+            if _is_cjk(cp):
+                chars.append(f" {ch} ")
+            elif ch.isspace():
+                chars.append(" ")
+            else:
+                chars.append(ch)
+
+        tokens = []
+        for word in "".join(chars).split():
+            if self.do_lower_case:
+                word = unicodedata.normalize("NFD", word.lower())
+                word = "".join(ch for ch in word if unicodedata.category(ch) != "Mn")
+            current = ""
+            for ch in word:
+                if _is_punctuation(ch):
+                    if current:
+                        tokens.append(current)
+                        current = ""
+                    tokens.append(ch)
+                else:
+                    current += ch
+            if current:
+                tokens.append(current)
+        return tokens
+
+    def _wordpiece(self, word):
+        ids = self._cache.get(word)
+        if ids is not None:
+            return ids
+        if len(word) > 100:
+            return [self.unk_id]
+
+        ids, start = [], 0
+        while start < len(word):
+            end = len(word)
+            while end > start:
+                piece = word[start:end] if start == 0 else "##" + word[start:end]
+                if piece in self.vocab:
+                    ids.append(self.vocab[piece])
+                    break
+                end -= 1
+            if end == start:
+                ids = [self.unk_id]
+                break
+            start = end
+
+        if len(self._cache) < 50000:
+            self._cache[word] = ids
+        return ids
+
+    def encode(self, text):
+        ids = [self.cls_id]
+        for word in self._basic_tokens(text):
+            ids.extend(self._wordpiece(word))
+        ids = ids[:self.max_length - 1]
+        ids.append(self.sep_id)
+        return ids
+
+    def count(self, text):
+        """Number of word pieces in 'text' (no special tokens, no truncation)."""
+        return sum(len(self._wordpiece(word)) for word in self._basic_tokens(text))
+
+    def batch(self, texts):
+        """(input_ids, attention_mask, token_type_ids) int64 arrays, right-padded."""
+        encoded = [self.encode(t) for t in texts]
+        width = max(len(ids) for ids in encoded)
+        input_ids = np.full((len(encoded), width), self.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encoded), width), dtype=np.int64)
+        for row, ids in enumerate(encoded):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+        return input_ids, attention_mask, np.zeros_like(input_ids)
+
+
+class OnnxEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by onnxruntime.
+    Only NumPy arrays are returned (convert_to_tensor is not supported).
+    """
+
+    def __init__(self, export_dir, quantized=False, threads=None):
+        require_onnx("onnxruntime")
+        import onnxruntime as ort
+
+        with open(os.path.join(export_dir, "config.json"), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        model_file = os.path.join(export_dir, "model_int8.onnx" if quantized else "model.onnx")
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(model_file)
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = WordPieceTokenizer(os.path.join(export_dir, "vocab.txt"),
+                                            do_lower_case=self.config.get("do_lower_case", True),
+                                            max_length=self.config.get("max_seq_length", 256))
+        self.backend_name = f"{self.config['model']}:onnx{'-int8' if quantized else ''}"
+
+    def _forward(self, texts):
+        input_ids, attention_mask, token_type_ids = self.tokenizer.batch(texts)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        # Mean pooling over real (non-padding) tokens
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config.get("normalize", True):
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, self.config.get("dim", 0)), dtype=np.float32)
+
+        # Length-sorted batches waste little work on padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = None
+        for start in range(0, len(order), batch_size):
+            members = order[start:start + batch_size]
+            vectors = self._forward([texts[i] for i in members])
+            if out is None:
+                out = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[members] = vectors
+        return out[0] if single else out
+
+
+def export_onnx(model_name, export_dir=None, quantize=False, opset=17):
+    """
+    Exports a SentenceTransformer (Transformer + mean Pooling [+ Normalize]) to
+    'export_dir'. Needs torch, sentence-transformers and onnx; run offline only.
+    """
+    # torch.onnx.export needs the 'onnx' package; quantization needs onnxruntime
+    require_onnx("onnx", *(["onnxruntime"] if quantize else []))
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    export_dir = export_dir or onnx_dir(model_name)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer, pooling = st_model[0], st_model[1]
+    mean_pooling = getattr(pooling, "pooling_mode_mean_tokens", None) or getattr(pooling, "pooling_mode", None) == "mean"
+    if not mean_pooling:
+        raise ValueError(f"'{model_name}' does not use mean pooling; only mean pooling is supported.")
+
+    tmp_dir = make_scratch_dir(export_dir)
+    tokenizer = transformer.tokenizer
+    vocab = tokenizer.get_vocab()
+    with open(os.path.join(tmp_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.writelines(f"{token}\n" for token in sorted(vocab, key=vocab.get))
+
+    class HiddenStates(torch.nn.Module):
+        # Keyword call: the positional order of forward() differs between transformers versions
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.auto_model(input_ids=input_ids, attention_mask=attention_mask,
+                                   token_type_ids=token_type_ids)[0]
+
+    wrapped = HiddenStates(transformer.auto_model).eval()
+    sample = tokenizer(["In the name of Allah, the Most Gracious"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapped,
+            tuple(sample[n] for n in names),
+            os.path.join(tmp_dir, "model.onnx"),
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={n: {0: "batch", 1: "sequence"} for n in names + ["last_hidden_state"]},
+            opset_version=opset,
+            dynamo=False,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(tmp_dir, "model.onnx"), os.path.join(tmp_dir, "model_int8.onnx"),
+                         weight_type=QuantType.QInt8)
+
+    config = {
+        "model": model_name,
+        "max_seq_length": int(st_model.max_seq_length),
+        "do_lower_case": bool(getattr(tokenizer, "do_lower_case", True)),
+        "normalize": any(type(m).__name__ == "Normalize" for m in st_model),
+        "dim": int(st_model.get_sentence_embedding_dimension()),
+        "quantized": quantize,
+    }
+    with open(os.path.join(tmp_dir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    replace_dir(tmp_dir, export_dir)
+    return export_dir
+
+
+def verify_encoder(encoder, texts, reference, tolerance=0.01):
+    """
+    Compares encoder.encode(texts) with reference vectors (e.g. rows of the
+    torch-built embedding store). Passes when every row's cosine similarity to
+    its reference is at least 1 - tolerance. Returns (ok, min_cos, mean_cos).
+    """
+    vectors = encoder.encode(texts, batch_size=64)
+    reference = np.asarray(reference, dtype=np.float32)
+    a = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    b = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    cos = (a * b).sum(axis=1)
+    return bool(cos.min() >= 1.0 - tolerance), float(cos.min()), float(cos.mean())
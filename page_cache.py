@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import make_response, render_template, request
+
+# --- Rendered Page Cache ---
+# Surah and browse pages only change when the data or the templates change, yet
+# Al-Baqarah alone renders to ~1.5 MB of HTML. Pages are rendered once, kept
+# gzip-compressed (all 114 Surahs fit in a few MB) and served with ETag /
+# Last-Modified so returning visitors get a 304 instead of a body.
+
+
+class CachedPage:
+    __slots__ = ("body_gz", "etag", "last_modified")
+
+    def __init__(self, body_gz, etag, last_modified):
+        self.body_gz = body_gz
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class PageCache:
+    """
+    Cache of rendered templates keyed by (template, key, template mtime).
+    The templates' mtime is read once at startup (templates only change with a
+    deploy); with Flask's template auto-reload (debug mode) it is re-read on
+    every request, so an edited template invalidates its pages.
+    'data_mtime' is folded into Last-Modified so a data rebuild is never
+    answered with a stale 304.
+    """
+
+    def __init__(self, app, data_mtime=0.0):
+        self.app = app
+        self.data_mtime = data_mtime
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._mtime = self._scan_templates()
+
+    def _templates_mtime(self):
+        # No filesystem access on the hot path unless templates are being edited
+        if self.app.jinja_env.auto_reload:
+            self._mtime = self._scan_templates()
+        return self._mtime
+
+    def _scan_templates(self):
+        # Pages also embed the shared partials (navbar, footer), so take the newest template
+        folder = os.path.join(self.app.root_path, self.app.template_folder)
+        try:
+            return max(e.stat().st_mtime for e in os.scandir(folder) if e.name.endswith(".html"))
+        except (OSError, ValueError):
+            return 0.0
+
+    def get(self, template_name, key, build_context):
+        """
+        Returns the CachedPage for (template_name, key), rendering it on a miss.
+        'build_context' is only called on a miss, so hits skip gathering the data too.
+        """
+        mtime = self._templates_mtime()
+        cache_key = (template_name, key, mtime)
+        page = self._pages.get(cache_key)
+        if page is not None:
+            return page
+
+        body = render_template(template_name, **build_context()).encode("utf-8")
+        etag = hashlib.sha1(body).hexdigest()
+        last_modified = datetime.fromtimestamp(max(mtime, self.data_mtime), tz=timezone.utc)
+        page = CachedPage(gzip.compress(body, 6), etag, last_modified)
+
+        with self._lock:
+            # Drop pages rendered from an older version of this template
+            for stale in [k for k in self._pages if k[0] == template_name and k[1] == key]:
+                del self._pages[stale]
+            self._pages[cache_key] = page
+        return page
+
+    def response(self, template_name, key, build_context):
+        """Serves a cached page, answering conditional requests with 304 Not Modified."""
+        page = self.get(template_name, key, build_context)
+
+        if "gzip" in request.accept_encodings:
+            resp = make_response(page.body_gz)
+            resp.headers["Content-Encoding"] = "gzip"
+        else:
+            resp = make_response(gzip.decompress(page.body_gz))
+        resp.headers["Content-Type"] = "text/html; charset=utf-8"
+        resp.vary.add("Accept-Encoding")
+        # Weak ETag: the gzip and identity bodies are the same page
+        resp.set_etag(page.etag, weak=True)
+        resp.last_modified = page.last_modified
+        resp.cache_control.no_cache = True  # Always revalidate, which is cheap thanks to the ETag
+        return resp.make_conditional(request)
+
+    def warm(self, pages):
+        """
+        Pre-renders pages at startup.
+        'pages' is an iterable of (template_name, key, build_context) tuples.
+        """
+        with self.app.test_request_context():
+            for template_name, key, build_context in pages:
+                self.get(template_name, key, build_context)
+        return len(self._pages)
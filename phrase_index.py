@@ -0,0 +1,356 @@
+import bisect
+import json
+import mmap
+import os
+import re
+
+import numpy as np
+
+from arabic_text import arabic_tokenize
+from corpus_store import make_scratch_dir, replace_dir
+
+# --- Phrase and Proximity Search ---
+# TF-IDF and BM25 treat a verse as a bag of words: "the Most Merciful" also
+# matches every verse that merely contains 'most' and 'merciful' somewhere.
+# The positional index keeps, for every term, the verses it occurs in *and*
+# the word positions inside each verse, so quoted phrases and NEAR/k queries
+# can be checked exactly.
+#
+# Postings are delta-encoded varints in one flat byte file. For each term:
+#   varint(doc gap) varint(byte length of positions) varint(position gaps)...
+# and every SKIP_INTERVAL docs a skip pointer (previous doc, byte offset) lets
+# an intersection jump over whole blocks of a frequent term ('the', 'allah')
+# instead of decoding them.
+#
+# On disk (data/index/phrase/):
+#   meta.json, vocab.json           -> metadata, "field:term" -> term id
+#   term_ptr.npy                    -> postings of term 't' are postings.bin[term_ptr[t]:term_ptr[t + 1]]
+#   df.npy                          -> number of verses per term
+#   skip_ptr.npy, skip_docs.npy, skip_offsets.npy -> skip pointers of term 't' (CSR layout)
+#   postings.bin                    -> the varint postings (memory-mapped)
+
+PHRASE_VERSION = 1
+SKIP_INTERVAL = 16
+DEFAULT_NEAR = 5  # bare 'NEAR' means NEAR/5
+
+_WORD_RE = re.compile(r"\w+")
+_QUERY_RE = re.compile(r'"([^"]*)"|\bNEAR(?:/(\d+))?\b|(\S+)')
+_SYNTAX_RE = re.compile(r'"[^"]*\w[^"]*"|\bNEAR(?:/\d+)?\b')
+
+
+def english_words(text):
+    """Lowercased words, stop words kept: 'the' and 'of' matter inside a phrase."""
+    return _WORD_RE.findall(text.lower())
+
+
+# Positional analyzers per indexed field
+PHRASE_FIELDS = {
+    "english": english_words,
+    "urdu": arabic_tokenize,  # diacritic-insensitive, light-stemmed (see arabic_text.py)
+}
+
+
+def is_phrase_query(query):
+    """True if the query uses phrase syntax: a quoted phrase or a NEAR operator."""
+    return bool(_SYNTAX_RE.search(query))
+
+
+def parse_query(query):
+    """
+    Parses '"straight path" guide', 'mercy NEAR/3 forgiveness' or a plain phrase
+    into clauses that must all match:
+        ("phrase", text)                   -> the words of 'text', contiguous
+        ("near", left_clause, text, k)     -> 'text' within k words of left_clause
+    Words outside quotes are one-word phrases.
+    """
+    clauses, near = [], None
+    for phrase, distance, word in _QUERY_RE.findall(query):
+        if not phrase and not word:  # a NEAR operator
+            near = int(distance) if distance else DEFAULT_NEAR
+            continue
+        text = phrase or word
+        if near is not None and clauses:
+            clauses[-1] = ("near", clauses[-1], text, near)
+        else:
+            clauses.append(("phrase", text))
+        near = None
+    return clauses
+
+
+def _encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varint(data, pos):
+    """Returns (value, next position)."""
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    value, shift = byte & 0x7F, 7
+    while True:
+        pos += 1
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos + 1
+        shift += 7
+
+
+class PostingCursor:
+    """Forward-only cursor over the postings of one term."""
+
+    __slots__ = ("data", "pos", "end", "doc", "skip_docs", "skip_offsets", "_positions_at", "_positions_end")
+
+    def __init__(self, data, start, end, skip_docs, skip_offsets):
+        self.data = data
+        self.pos = start
+        self.end = end
+        self.doc = -1
+        self.skip_docs = skip_docs  # last doc before each skippable block
+        self.skip_offsets = skip_offsets
+
+    def next(self):
+        """Moves to the next verse; returns its doc id, or None when exhausted."""
+        if self.pos >= self.end:
+            self.doc = None
+            return None
+        gap, pos = _decode_varint(self.data, self.pos)
+        length, pos = _decode_varint(self.data, pos)
+        self.doc += gap
+        self._positions_at, self._positions_end = pos, pos + length
+        self.pos = pos + length
+        return self.doc
+
+    def advance(self, target):
+        """Moves to the first verse >= target (skipping whole blocks where possible)."""
+        if self.doc is None or self.doc >= target:
+            return self.doc
+        block = bisect.bisect_left(self.skip_docs, target) - 1
+        if block >= 0 and self.skip_docs[block] > self.doc:
+            self.doc = self.skip_docs[block]
+            self.pos = self.skip_offsets[block]
+        while self.doc is not None and self.doc < target:
+            self.next()
+        return self.doc
+
+    def positions(self):
+        """Word positions of the term in the current verse."""
+        data, pos, end = self.data, self._positions_at, self._positions_end
+        out, current = [], 0
+        while pos < end:
+            gap, pos = _decode_varint(data, pos)
+            current += gap
+            out.append(current)
+        return out
+
+
+def _phrase_spans(terms, positions):
+    """(start, end) word spans where 'terms' occur contiguously."""
+    follow = [set(positions[t]) for t in terms[1:]]
+    return [(p, p + len(terms) - 1) for p in positions[terms[0]]
+            if all(p + i in s for i, s in enumerate(follow, 1))]
+
+
+def _near_spans(left, right, k):
+    """Spans covering a left and a right span at most k words apart, and the smallest distance."""
+    spans, best = [], None
+    for a_start, a_end in left:
+        for b_start, b_end in right:
+            distance = max(b_start - a_end, a_start - b_end, 0)
+            if distance <= k:
+                spans.append((min(a_start, b_start), max(a_end, b_end)))
+                best = distance if best is None else min(best, distance)
+    return spans, best
+
+
+class PositionalIndex:
+    def __init__(self, vocabulary, term_ptr, df, skip_ptr, skip_docs, skip_offsets, postings, meta):
+        self.vocabulary = vocabulary
+        self.term_ptr = term_ptr
+        self.df = df
+        self.skip_ptr = skip_ptr
+        self.skip_docs = skip_docs
+        self.skip_offsets = skip_offsets
+        self.postings = postings
+        self.meta = meta
+
+    @classmethod
+    def build(cls, field_texts, key=""):
+        """field_texts: {field_name: [text of verse 0, text of verse 1, ...]} for fields of PHRASE_FIELDS."""
+        vocabulary, term_docs = {}, []
+        for field, texts in field_texts.items():
+            analyze = PHRASE_FIELDS[field]
+            for doc, text in enumerate(texts):
+                doc_positions = {}
+                for position, token in enumerate(analyze(text or "")):
+                    doc_positions.setdefault(token, []).append(position)
+                for token, positions in doc_positions.items():
+                    term_id = vocabulary.setdefault(f"{field}:{token}", len(vocabulary))
+                    if term_id == len(term_docs):
+                        term_docs.append([])
+                    term_docs[term_id].append((doc, positions))
+
+        out = bytearray()
+        term_ptr, df, skip_ptr, skip_docs, skip_offsets = [0], [], [0], [], []
+        for docs in term_docs:
+            previous = -1
+            for i, (doc, positions) in enumerate(docs):
+                if i and i % SKIP_INTERVAL == 0:
+                    skip_docs.append(previous)
+                    skip_offsets.append(len(out))
+                _encode_varint(doc - previous, out)
+                encoded, last = bytearray(), 0
+                for position in positions:
+                    _encode_varint(position - last, encoded)
+                    last = position
+                _encode_varint(len(encoded), out)
+                out += encoded
+                previous = doc
+            term_ptr.append(len(out))
+            df.append(len(docs))
+            skip_ptr.append(len(skip_docs))
+
+        meta = {
+            "version": PHRASE_VERSION,
+            "key": key,
+            "fields": list(field_texts),
+            "n_docs": len(next(iter(field_texts.values()))),
+            "skip_interval": SKIP_INTERVAL,
+        }
+        return cls(vocabulary, np.array(term_ptr, dtype=np.int64), np.array(df, dtype=np.int32),
+                   np.array(skip_ptr, dtype=np.int64), np.array(skip_docs, dtype=np.int32),
+                   np.array(skip_offsets, dtype=np.int64), bytes(out), meta)
+
+    def save(self, index_dir):
+        tmp_dir = make_scratch_dir(index_dir)
+        for name in ("term_ptr", "df", "skip_ptr", "skip_docs", "skip_offsets"):
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_dir, "postings.bin"), "wb") as f:
+            f.write(self.postings)
+        with open(os.path.join(tmp_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        replace_dir(tmp_dir, index_dir)
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != PHRASE_VERSION:
+            raise ValueError(f"Unsupported phrase index version in '{index_dir}'")
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        arrays = [np.load(os.path.join(index_dir, f"{name}.npy"))
+                  for name in ("term_ptr", "df", "skip_ptr", "skip_docs", "skip_offsets")]
+
+        postings = b""
+        path = os.path.join(index_dir, "postings.bin")
+        if os.path.getsize(path):  # mmap refuses empty files
+            with open(path, "rb") as f:
+                postings = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(vocabulary, *arrays, postings, meta)
+
+    def cursor(self, term_id):
+        skips = slice(self.skip_ptr[term_id], self.skip_ptr[term_id + 1])
+        return PostingCursor(self.postings, int(self.term_ptr[term_id]), int(self.term_ptr[term_id + 1]),
+                             self.skip_docs[skips].tolist(), self.skip_offsets[skips].tolist())
+
+    def _match_field(self, field, clauses, limit=None):
+        """
+        {doc: score} of verses where every clause matches within 'field'. Pure
+        phrase queries score 1.0 for every match, so they stop after 'limit' verses.
+        """
+        analyze = PHRASE_FIELDS[field]
+        term_ids = {}
+
+        def terms(text):
+            tokens = [f"{field}:{t}" for t in analyze(text)]
+            for token in tokens:
+                term_ids[token] = self.vocabulary.get(token)
+            return tokens
+
+        compiled = []
+        for clause in clauses:
+            if clause[0] == "phrase":
+                tokens = terms(clause[1])
+                if tokens:  # punctuation-only words analyze to nothing
+                    compiled.append(("phrase", tokens))
+            else:
+                compiled.append(self._compile_near(clause, terms))
+        if not term_ids or any(t is None for t in term_ids.values()) or any(c is None for c in compiled):
+            return {}
+
+        if any(clause[0] == "near" for clause in compiled):
+            limit = None  # NEAR scores depend on distance: every match must be ranked
+        # Intersect rarest first; the frequent terms mostly skip
+        cursors = {t: self.cursor(i) for t, i in sorted(term_ids.items(), key=lambda kv: self.df[kv[1]])}
+        lead, *rest = cursors.values()
+        matches = {}
+        doc = lead.next()
+        while doc is not None:
+            for cursor in rest:
+                found = cursor.advance(doc)
+                if found is None:
+                    return matches
+                if found != doc:
+                    doc = lead.advance(found)
+                    break
+            else:
+                positions = {t: c.positions() for t, c in cursors.items()}
+                score = self._score(compiled, positions)
+                if score:
+                    matches[doc] = score
+                    if len(matches) == limit:
+                        return matches
+                doc = lead.next()
+        return matches
+
+    def _compile_near(self, clause, terms):
+        _, left, text, k = clause
+        left = ("phrase", terms(left[1])) if left[0] == "phrase" else self._compile_near(left, terms)
+        right = terms(text)
+        if left is None or not left[1] or not right:
+            return None
+        return ("near", left, right, k)
+
+    def _evaluate(self, clause, positions):
+        """(spans, score) of one clause in one verse."""
+        if clause[0] == "phrase":
+            return _phrase_spans(clause[1], positions), 1.0
+        _, left, right, k = clause
+        left_spans, left_score = self._evaluate(left, positions)
+        if not left_spans:
+            return [], 0.0
+        spans, distance = _near_spans(left_spans, _phrase_spans(right, positions), k)
+        # Closer is better: adjacent words keep the full score
+        return spans, (left_score / max(distance, 1) if spans else 0.0)
+
+    def _score(self, compiled, positions):
+        """Mean clause score, or 0 if any clause fails."""
+        scores = []
+        for clause in compiled:
+            spans, score = self._evaluate(clause, positions)
+            if not spans:
+                return 0.0
+            scores.append(score)
+        return sum(scores) / len(scores)
+
+    def search(self, query, top_k=5):
+        """
+        Verses matching every phrase / NEAR clause of 'query' in any field.
+        Returns up to top_k (verse_index, score) pairs, best first: exact
+        phrase matches score 1.0 and come in Quran order, NEAR matches score
+        lower the further apart the words are.
+        """
+        clauses = parse_query(query)
+        if not clauses:
+            return []
+        scores = {}
+        for field in self.meta["fields"]:
+            for doc, score in self._match_field(field, clauses, limit=top_k).items():
+                scores[doc] = max(score, scores.get(doc, 0.0))
+        return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:top_k]
@@ -0,0 +1,136 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Query Embedding Cache ---
+# Encoding the query is the dominant per-request cost of semantic search, and
+# traffic is highly repetitive ("patience", "mercy", "prayer"...). Queries are
+# keyed by a normalized form so trivial variations ("Patience?", "  patience ")
+# share one entry. Entries live in an in-process LRU with a TTL and can
+# optionally be shared by all workers through a small SQLite file.
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Casefolds, drops punctuation and collapses whitespace (works for Arabic/Urdu too)."""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in query)
+    return _SPACE_RE.sub(" ", query).strip()
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries=1024, ttl_seconds=3600, shared_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_path = shared_path
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (created_at, vector)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+        if shared_path:
+            os.makedirs(os.path.dirname(shared_path) or ".", exist_ok=True)
+            with self._db() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS query_embeddings "
+                           "(key TEXT PRIMARY KEY, created REAL, vector BLOB)")
+
+    def _db(self):
+        # sqlite3 connections may not be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.shared_path, timeout=1.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def _expired(self, created_at):
+        return self.ttl_seconds and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.shared_path:
+            try:
+                row = self._db().execute(
+                    "SELECT created, vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None and not self._expired(row[0]):
+                vector = np.frombuffer(row[1], dtype=np.float32).copy()
+                self._remember(key, row[0], vector)
+                with self._lock:
+                    self.shared_hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key, created_at, vector):
+        with self._lock:
+            self._entries[key] = (created_at, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, vector):
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        now = time.time()
+        self._remember(key, now, vector)
+
+        if self.shared_path:
+            try:
+                with self._db() as db:
+                    db.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                               (key, now, vector.tobytes()))
+                    self._writes += 1
+                    if self._writes % 100 == 0:
+                        # Occasionally prune expired rows and keep the file bounded
+                        if self.ttl_seconds:
+                            db.execute("DELETE FROM query_embeddings WHERE created < ?", (now - self.ttl_seconds,))
+                        db.execute("DELETE FROM query_embeddings WHERE key NOT IN "
+                                   "(SELECT key FROM query_embeddings ORDER BY created DESC LIMIT ?)",
+                                   (self.max_entries * 10,))
+            except sqlite3.Error as e:
+                print(f"⚠️ Query cache write failed: {e}")
+
+    def key(self, query, namespace=""):
+        """Cache key of a query; 'namespace' separates entries of different models."""
+        return f"{namespace}\x1f{normalize_query(query)}"
+
+    def get_or_encode(self, query, encode, namespace=""):
+        """Returns the cached embedding of 'query', calling encode(query) on a miss."""
+        key = self.key(query, namespace)
+        vector = self.get(key)
+        if vector is None:
+            vector = np.asarray(encode(query), dtype=np.float32)
+            self.put(key, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
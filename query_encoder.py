@@ -0,0 +1,92 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# --- Query Encoding Service ---
+# Every Flask request thread used to call model.encode(query) on its own: N tiny
+# forward passes fighting over the same cores and the same model instance.
+# BatchingQueryEncoder funnels them through one background thread that waits a
+# few milliseconds for concurrent queries to arrive, encodes them in a single
+# batched forward pass and hands each caller its vector through a Future.
+
+
+class BatchingQueryEncoder:
+    def __init__(self, encode_batch, max_batch_size=32, max_wait_ms=3.0):
+        """
+        encode_batch:   callable, list of str -> (n x dim) float32 matrix
+        max_batch_size: a batch is sent as soon as it holds this many queries
+        max_wait_ms:    ...or once its first query has waited this long
+        """
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(): each (gunicorn) worker process starts its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,), name="query-encoder", daemon=True).start()
+            return self._queue
+
+    def submit(self, text):
+        """Queues 'text' for the next batch; returns a Future of its float32 vector."""
+        future = Future()
+        self._ensure_worker().put((text, future))
+        return future
+
+    def encode(self, text):
+        return self.submit(text).result()
+
+    def _collect(self, pending):
+        """Blocks for the first query, then gathers more until the batch is full or the window closes."""
+        batch = [pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, pending):
+        while True:
+            batch = self._collect(pending)
+
+            # Identical concurrent queries are encoded once
+            slots = {}
+            for text, _ in batch:
+                slots.setdefault(text, len(slots))
+
+            try:
+                vectors = np.asarray(self.encode_batch(list(slots)), dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for text, future in batch:
+                future.set_result(vectors[slots[text]])
+            with self._lock:
+                self.batches += 1
+                self.queries += len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            }
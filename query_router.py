@@ -0,0 +1,105 @@
+import os
+import threading
+
+from corpus_store import INDEX_DIR
+from embedding_store import DEFAULT_EMBEDDING_DIR, load_embeddings, recipe_texts
+from search_engine import (
+    MULTILINGUAL_MODEL_NAME,
+    SEMANTIC_MODEL_NAME,
+    get_model,
+    semantic_search,
+)
+from vector_index import VectorIndex
+
+# --- Multilingual Query Routing ---
+# English MiniLM only understands English: Urdu or Arabic queries encoded with
+# it return noise that the score threshold silently drops. The router detects
+# the script of a query and sends it to a per-language vector index (English
+# MiniLM over 'english', a multilingual model over 'urdu' / 'text'). Non-English
+# indices are loaded on first use, so a worker only pays memory for languages
+# that actually receive traffic.
+
+# language -> (model, embedding recipe, embedding store directory)
+LANGUAGE_INDICES = {
+    "english": (SEMANTIC_MODEL_NAME, "english", DEFAULT_EMBEDDING_DIR),
+    "urdu": (MULTILINGUAL_MODEL_NAME, "urdu", os.path.join(INDEX_DIR, "embeddings-urdu")),
+    "arabic": (MULTILINGUAL_MODEL_NAME, "arabic", os.path.join(INDEX_DIR, "embeddings-arabic")),
+}
+
+# Letters used in Urdu (and Persian) but not in Arabic:
+# ٹ ڈ ڑ ں ھ ہ ۃ ی ے ۓ پ چ ژ ک گ
+_URDU_LETTERS = frozenset("\u0679\u0688\u0691\u06ba\u06be\u06c1\u06c3\u06cc\u06d2\u06d3"
+                          "\u067e\u0686\u0698\u06a9\u06af")
+
+
+def _is_arabic_script(ch):
+    cp = ord(ch)
+    return 0x0600 <= cp <= 0x06FF or 0x0750 <= cp <= 0x077F or 0xFB50 <= cp <= 0xFDFF or 0xFE70 <= cp <= 0xFEFF
+
+
+def detect_language(query):
+    """'english', 'urdu' or 'arabic', by majority script and Urdu-only letters."""
+    arabic = latin = 0
+    urdu = False
+    for ch in query:
+        if _is_arabic_script(ch):
+            arabic += 1
+            urdu = urdu or ch in _URDU_LETTERS
+        elif ch.isascii() and ch.isalpha():
+            latin += 1
+    if arabic <= latin:
+        return "english"
+    return "urdu" if urdu else "arabic"
+
+
+class SemanticRouter:
+    def __init__(self, verses, preloaded=None):
+        """'preloaded': {language: (model, vector_index)} already built by the app."""
+        self.verses = verses
+        self._indices = dict(preloaded or {})
+        # One lock per language: loading the multilingual model takes seconds and
+        # must not hold up queries in languages that are already loaded
+        self._load_locks = {language: threading.Lock() for language in LANGUAGE_INDICES}
+        self._lock = threading.Lock()  # routing counters only
+        self.routed = {language: 0 for language in LANGUAGE_INDICES}
+
+    def index_for(self, language):
+        """(model, vector_index) of a language, loaded on first use; None if it is not built."""
+        if language in self._indices:
+            return self._indices[language]
+
+        with self._load_locks[language]:
+            if language not in self._indices:
+                model_name, recipe, store_dir = LANGUAGE_INDICES[language]
+                print(f"⏳ Loading {language} semantic index...")
+                store = load_embeddings(recipe_texts(self.verses, recipe), model_name,
+                                        recipe=recipe, store_dir=store_dir)
+                if store is None and language != "english":
+                    print(f"⚠️ {language} queries fall back to keyword search until 'python build_index.py --only multilingual' is run.")
+                # Published only once complete; failures are remembered too, so a
+                # missing index is not retried on every query
+                self._indices[language] = None if store is None else \
+                    (get_model(model_name), VectorIndex.from_vectors(store.to_float32()))
+        return self._indices[language]
+
+    def search(self, query, top_k=5):
+        """
+        Semantic search in the query's own language. Returns None when that
+        language has no vector index, so the caller can fall back to keywords.
+        """
+        language = detect_language(query)
+        with self._lock:
+            self.routed[language] += 1
+        loaded = self.index_for(language)
+        if loaded is None:
+            return None
+        model, vector_index = loaded
+        return semantic_search(query, self.verses, model, vector_index, top_k=top_k)
+
+    def stats(self):
+        with self._lock:
+            routed = dict(self.routed)
+        return {
+            "routed": routed,
+            "loaded": sorted(lang for lang, loaded in list(self._indices.items()) if loaded is not None),
+        }
@@ -0,0 +1,174 @@
+import re
+import threading
+
+from arabic_text import normalize_arabic
+
+# --- Verse Reference Fast Path ---
+# Many queries are really references: "2:255", "2:255-257", "Al-Baqarah 255",
+# "surah yasin", "سورة البقرة ٢٥٥", "Ayat al-Kursi". Running those through
+# MiniLM or TF-IDF wastes CPU and usually misses the verse. The resolver
+# recognizes them and answers straight from the (surah, ayah) index in O(1).
+
+MAX_RANGE = 50  # longest ayah range returned for a single reference
+
+# Well-known verses by name: alias -> (surah, first ayah, last ayah)
+VERSE_ALIASES = {
+    "ayat al-kursi": (2, 255, 255),
+    "ayatul kursi": (2, 255, 255),
+    "ayat ul kursi": (2, 255, 255),
+    "throne verse": (2, 255, 255),
+    "verse of the throne": (2, 255, 255),
+    "آية الكرسي": (2, 255, 255),
+    "آیت الکرسی": (2, 255, 255),
+    "ayat an-nur": (24, 35, 35),
+    "light verse": (24, 35, 35),
+    "verse of light": (24, 35, 35),
+    "ayat al-dayn": (2, 282, 282),
+    "verse of debt": (2, 282, 282),
+    "amana rasul": (2, 285, 286),
+    "last two verses of al-baqarah": (2, 285, 286),
+    "bismillah": (1, 1, 1),
+    "basmala": (1, 1, 1),
+    "بسم الله الرحمن الرحيم": (1, 1, 1),
+}
+
+# Common alternative / older surah names not derivable from SURAHS_LIST spellings
+SURAH_ALIASES = {
+    "al-imran": 3, "aal-e-imran": 3, "aal imran": 3,
+    "bani israil": 17, "bani isra'il": 17,
+    "ha-mim sajdah": 41, "tabarak": 67, "amma": 78,
+    "\u06cc\u0670\u0633\u06cc\u0646": 36,  # یٰسین (Urdu spelling)
+}
+
+_SURAH_WORDS = ("surah", "surat", "sura", "soorah", "\u0633\u0648\u0631\u0647")  # ... سوره (normalized سورة / سورہ)
+_ARTICLE_RE = re.compile(r"^(?:al|an|ash|at|ad|adh|ar|az|as|ath)[\s\-]+")
+# Arabic-Indic and Urdu (extended) digits -> ASCII
+_DIGITS = str.maketrans({chr(base + d): str(d) for base in (0x0660, 0x06F0) for d in range(10)})
+_NUMERIC_RE = re.compile(r"^(\d{1,3})\s*[:.]\s*(\d{1,3})(?:\s*[-–]\s*(\d{1,3}))?$")
+_NAMED_RE = re.compile(r"^(.*?)[\s:]*(\d{1,3})?(?:\s*[-–]\s*(\d{1,3}))?$")
+
+
+def name_key(name):
+    """Spelling-tolerant key for a surah name: 'Al-Baqarah', 'baqara', 'Ya-Sin'/'yaseen', 'البقرة'."""
+    name = normalize_arabic(name.strip().lower())
+    if name.startswith("\u0627\u0644"):  # ال
+        name = name[2:]
+    name = _ARTICLE_RE.sub("", name)
+    key = re.sub(r"[\W_]+", "", name)
+    for long_vowel, short in (("ee", "i"), ("oo", "u"), ("aa", "a")):
+        key = key.replace(long_vowel, short)
+    return key[:-1] if key.endswith("h") and len(key) > 3 else key
+
+
+class Reference:
+    __slots__ = ("surah_id", "start", "end")
+
+    def __init__(self, surah_id, start=None, end=None):
+        self.surah_id = surah_id
+        self.start = start  # None: the whole surah
+        self.end = end
+
+    @property
+    def whole_surah(self):
+        return self.start is None
+
+    def __repr__(self):
+        if self.whole_surah:
+            return f"<Reference {self.surah_id}>"
+        return f"<Reference {self.surah_id}:{self.start}-{self.end}>"
+
+
+class ReferenceResolver:
+    def __init__(self, verses, surahs):
+        """'surahs' is SURAHS_LIST (CorpusStore.surah_list())."""
+        self.verses = verses
+        self.verse_counts = {s["id"]: s["verses"] for s in surahs}
+        self.names = {}
+        for s in surahs:
+            for name in (s.get("name"), s.get("ar"), s.get("translation")):
+                if name and name != "The Chapter":  # surah_list()'s placeholder translation
+                    self.names.setdefault(name_key(name), s["id"])
+        for alias, surah_id in SURAH_ALIASES.items():
+            self.names.setdefault(name_key(alias), surah_id)
+        self.aliases = {self._alias_key(alias): ref for alias, ref in VERSE_ALIASES.items()}
+
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.resolved = 0
+        self.avoided = {}  # search mode -> queries answered without any search engine
+
+    @staticmethod
+    def _alias_key(text):
+        return re.sub(r"[\W_]+", "", normalize_arabic(text.lower()))
+
+    def parse(self, query):
+        """Returns a Reference if the whole query is a verse/surah reference, else None."""
+        # Multi-line queries (Shift+Enter in the chat box) are matched as one line
+        text = " ".join(query.split()).translate(_DIGITS)
+        if not text or len(text) > 60:
+            return None
+
+        alias = self.aliases.get(self._alias_key(text))
+        if alias:
+            return Reference(*alias)
+
+        match = _NUMERIC_RE.match(text)
+        if match:
+            surah_id, start, end = (int(g) if g else None for g in match.groups())
+            return self._reference(surah_id, start, end or start)
+
+        # "<surah word>? <name or number> <ayah>?(-<ayah>)?"
+        words = normalize_arabic(text.lower()).split()
+        has_surah_word = bool(words) and words[0] in _SURAH_WORDS
+        if has_surah_word:
+            text = text.split(None, 1)[1] if len(words) > 1 else ""
+        match = _NAMED_RE.match(text)
+        if match is None:
+            return None
+        name, start, end = match.group(1), match.group(2), match.group(3)
+        if not name and start and has_surah_word and not end:
+            name, start = start, None  # "surah 36"
+        if name.isdigit() and has_surah_word:
+            surah_id = int(name)
+        else:
+            surah_id = self.names.get(name_key(name)) if name else None
+        if surah_id is None:
+            return None
+        if start is None:
+            # A bare name ("Yusuf") is also a keyword query; only "surah Yusuf" means the surah
+            return Reference(surah_id) if has_surah_word and surah_id in self.verse_counts else None
+        return self._reference(surah_id, int(start), int(end) if end else int(start))
+
+    def _reference(self, surah_id, start, end):
+        if surah_id not in self.verse_counts:
+            return None
+        end = max(start, min(end, start + MAX_RANGE - 1, self.verse_counts[surah_id]))
+        return Reference(surah_id, start, end)
+
+    def resolve(self, query, mode="semantic"):
+        """
+        Parses 'query'. Returns None if it is not a reference; otherwise the
+        Reference and its verses as (verse, 1.0) pairs (empty for a missing ayah).
+        Whole-surah references come back with no verses (callers show the surah page).
+        """
+        reference = self.parse(query)
+        with self._lock:
+            self.lookups += 1
+            if reference is not None:
+                self.resolved += 1
+                self.avoided[mode] = self.avoided.get(mode, 0) + 1
+        if reference is None:
+            return None
+        if reference.whole_surah:
+            return reference, []
+
+        results = []
+        for ayah in range(reference.start, reference.end + 1):
+            verse = self.verses.row(reference.surah_id, ayah)  # O(1)
+            if verse is not None:
+                results.append((verse, 1.0))
+        return reference, results
+
+    def stats(self):
+        with self._lock:
+            return {"lookups": self.lookups, "resolved": self.resolved, "avoided_searches": dict(self.avoided)}
@@ -1,121 +1,425 @@
+import json
 import numpy as np
 import os
-import torch
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+from keyword_index import TfidfKeywordIndex, BM25Index
+from phrase_index import PHRASE_FIELDS, PositionalIndex, is_phrase_query
+from arabic_text import ANALYZER_VERSION
+from corpus_store import INDEX_DIR
+from utils import strip_html
+from embedding_store import DEFAULT_EMBEDDING_DIR, recipe_texts, load_embeddings
+from query_cache import QueryEmbeddingCache
+from query_encoder import BatchingQueryEncoder
+from vector_index import IVFIndex, VectorIndex
+
+SEMANTIC_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Query encoder backend: "torch" (SentenceTransformer), "onnx" or "onnx-int8".
+# The ONNX backends need an export made by 'python build_index.py --only onnx'.
+SEMANTIC_BACKEND = os.environ.get("SEMANTIC_BACKEND", "torch").strip().lower()
+if SEMANTIC_BACKEND in ("onnx", "onnx-int8"):
+    from onnx_encoder import require_onnx
+    try:
+        require_onnx("onnxruntime")
+    except ImportError as e:
+        print(f"⚠️ SEMANTIC_BACKEND={SEMANTIC_BACKEND}: {e}. Queries will be encoded with torch.")
+
+# Multilingual model for the Urdu / Arabic indices (see query_router.py)
+MULTILINGUAL_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
 
 # Global variables for caching
-_semantic_model = None
+_models = {}
+
+def get_model(model_name=SEMANTIC_MODEL_NAME):
+    """Loads each sentence-embedding model once; 'backend_name' keys its query cache entries."""
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    # Only the main model is exported (the ONNX tokenizer is WordPiece-only)
+    if SEMANTIC_BACKEND in ("onnx", "onnx-int8") and model_name == SEMANTIC_MODEL_NAME:
+        from onnx_encoder import OnnxEncoder, onnx_dir
+        try:
+            print(f"⏳ Loading Semantic Model ({model_name}, {SEMANTIC_BACKEND})...")
+            model = OnnxEncoder(onnx_dir(model_name), quantized=SEMANTIC_BACKEND == "onnx-int8")
+        except Exception as e:
+            print(f"⚠️ ONNX encoder unavailable ({e}). Run 'python build_index.py --only onnx'. Falling back to torch.")
+
+    if model is None:
+        from sentence_transformers import SentenceTransformer
+        print(f"⏳ Loading Semantic Model ({model_name})...")
+        model = SentenceTransformer(model_name)
+        model.backend_name = model_name
+
+    return _models.setdefault(model_name, model)
 
 def get_semantic_model():
     """Singleton to load the model only once."""
-    global _semantic_model
-    if _semantic_model is None:
-        print("⏳ Loading Semantic Model (all-MiniLM-L6-v2)...")
-        _semantic_model = SentenceTransformer('all-MiniLM-L6-v2')
-    return _semantic_model
+    return get_model(SEMANTIC_MODEL_NAME)
+
+# Query -> embedding cache shared by semantic_search and /ask_ai retrieval.
+# QUERY_CACHE_PATH (optional) points to a SQLite file shared by all workers.
+query_cache = QueryEmbeddingCache(
+    max_entries=int(os.environ.get("QUERY_CACHE_SIZE", "2048")),
+    ttl_seconds=float(os.environ.get("QUERY_CACHE_TTL", "86400")),
+    shared_path=os.environ.get("QUERY_CACHE_PATH") or None,
+)
+
+# Concurrent cache misses are micro-batched into one forward pass per window.
+# QUERY_BATCH_WINDOW_MS=0 encodes every query on its own request thread.
+QUERY_BATCH_WINDOW_MS = float(os.environ.get("QUERY_BATCH_WINDOW_MS", "3"))
+QUERY_BATCH_SIZE = int(os.environ.get("QUERY_BATCH_SIZE", "32"))
+_query_encoders = {}
+
+def get_query_encoder(model, model_name):
+    """One BatchingQueryEncoder per model, created on first use."""
+    encoder = _query_encoders.get(model_name)
+    if encoder is None:
+        encoder = _query_encoders.setdefault(model_name, BatchingQueryEncoder(
+            lambda texts: model.encode(texts, batch_size=len(texts), convert_to_numpy=True),
+            max_batch_size=QUERY_BATCH_SIZE,
+            max_wait_ms=QUERY_BATCH_WINDOW_MS,
+        ))
+    return encoder
+
+def encode_query(query, model, model_name=None):
+    """Embeds a query through the query cache (float32 NumPy vector)."""
+    # Each backend gets its own cache namespace (int8 vectors differ slightly)
+    model_name = model_name or getattr(model, "backend_name", SEMANTIC_MODEL_NAME)
+    if QUERY_BATCH_WINDOW_MS > 0:
+        encode = get_query_encoder(model, model_name).encode
+    else:
+        encode = lambda q: model.encode(q, convert_to_numpy=True)
+    return query_cache.get_or_encode(query, encode, namespace=model_name)
+
+def encode_queries(queries, model, model_name=None):
+    """Embeds several queries as an (n x dim) matrix; cache misses are encoded in one call."""
+    model_name = model_name or getattr(model, "backend_name", SEMANTIC_MODEL_NAME)
+    keys = [query_cache.key(q, model_name) for q in queries]
+    vectors = [query_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        fresh = model.encode([queries[i] for i in missing], convert_to_numpy=True)
+        for i, vector in zip(missing, fresh):
+            vectors[i] = np.asarray(vector, dtype=np.float32)
+            query_cache.put(keys[i], vectors[i])
+    return np.stack(vectors)
+
+def query_encoder_stats():
+    return {name: encoder.stats() for name, encoder in _query_encoders.items()}
 
 # --- TF-IDF Search ---
 
-def build_tfidf_index(verses):
+# Changing these (or the English text) invalidates the saved index
+TFIDF_PARAMS = {"stop_words": "english"}
+
+def build_tfidf_index(verses, cache_dir=os.path.join(INDEX_DIR, "tfidf")):
     """
-    Builds the TF-IDF matrix for the English translations.
-    Expects 'verses' to be a list of dictionaries.
+    Loads the TF-IDF index for the English translations from disk (memory-mapped),
+    or fits it and saves it if it is missing or was built from different
+    text/parameters. Returns a TfidfKeywordIndex (see keyword_index.py) for
+    sparse top-k scoring. Expects 'verses' to be a VerseTable.
     """
-    # Extract English text from the dictionary
-    corpus = [v.get('english', '') for v in verses]
-    
-    vectorizer = TfidfVectorizer(stop_words='english')
-    tfidf_matrix = vectorizer.fit_transform(corpus)
-    
-    return vectorizer, tfidf_matrix
+    key = verses.corpus.content_hash("english") + "|" + json.dumps(TFIDF_PARAMS, sort_keys=True)
+
+    if os.path.exists(os.path.join(cache_dir, "meta.json")):
+        try:
+            index = TfidfKeywordIndex.load(cache_dir)
+            if index.meta.get("key") == key:
+                print(f"✅ Loaded TF-IDF index from '{cache_dir}'.")
+                return index
+            print("⚠️ TF-IDF index is out of date. Rebuilding...")
+        except Exception as e:
+            print(f"⚠️ Error loading TF-IDF index: {e}. Rebuilding...")
+
+    # Extract English text from the verse table
+    corpus = verses.column('english')
+    index = TfidfKeywordIndex.build(corpus, TFIDF_PARAMS, key=key)
+
+    try:
+        index.save(cache_dir)
+        print(f"💾 TF-IDF index saved to '{cache_dir}'.")
+    except Exception as e:
+        print(f"⚠️ Could not save TF-IDF index: {e}")
+    return index
 
-def search_verses(query, verses, vectorizer, tfidf_matrix, top_k=5):
+def search_verses(query, verses, tfidf_index, top_k=5):
     """
     Performs Keyword Search (TF-IDF).
+    Only the posting lists of the query's terms are scored, so the cost grows
+    with the number of matching verses rather than with the corpus size.
     """
-    query_vec = vectorizer.transform([query])
-    cosine_similarities = cosine_similarity(query_vec, tfidf_matrix).flatten()
-    
-    # Get top_k indices sorted by score descending
-    related_docs_indices = cosine_similarities.argsort()[:-top_k:-1]
-    
     results = []
-    for i in related_docs_indices:
-        score = cosine_similarities[i]
+    for i, score in tfidf_index.search(query, top_k=top_k):
         if score > 0.0:  # Filter out irrelevant results
             results.append((verses[i], score))
             
     return results
 
-# --- Semantic Search ---
+# --- BM25 Search ---
 
-def build_semantic_index(verses, cache_file="quran_embeddings.pt"):
+def build_bm25_index(verses, cache_file=os.path.join(INDEX_DIR, "bm25.npz"), fields=None, analyzer="english"):
     """
-    Encodes all verses into embeddings using SentenceTransformer.
-    Checks for a local cache file first to speed up startup.
-    Expects 'verses' to be a list of dictionaries.
+    Loads the BM25F index (English translation + tafsir) from disk, or builds and
+    saves it if it is missing or was built from different text/parameters.
+    Expects 'verses' to be a VerseTable.
     """
-    model = get_semantic_model()
-    
-    # 1. Check if cache exists
+    fields = fields or BM25Index.DEFAULT_FIELDS
+    key = verses.corpus.content_hash(*fields) + "|" + repr(sorted(fields.items()))
+    if analyzer != "english":
+        key += f"|{analyzer}-v{ANALYZER_VERSION}"
+
     if os.path.exists(cache_file):
-        print(f"✅ Found cached embeddings in '{cache_file}'. Loading...")
         try:
-            embeddings = torch.load(cache_file)
-            
-            # Validation: Ensure embedding count matches verse count
-            if len(embeddings) == len(verses):
-                print("✅ Embeddings loaded successfully (Cache Hit).")
-                return model, embeddings
-            else:
-                print(f"⚠️ Cache mismatch: {len(embeddings)} embeddings vs {len(verses)} verses. Rebuilding...")
+            index = BM25Index.load(cache_file)
+            if index.meta.get("key") == key:
+                print(f"✅ Loaded BM25 index from '{cache_file}'.")
+                return index
+            print("⚠️ BM25 index is out of date. Rebuilding...")
+        except Exception as e:
+            print(f"⚠️ Error loading BM25 index: {e}. Rebuilding...")
+
+    print("⏳ Building BM25 index (First Run Only)...")
+    field_texts = {}
+    for field in fields:
+        texts = verses.column(field)
+        # Tafsir is HTML; index the words, not the markup
+        field_texts[field] = [strip_html(t) for t in texts] if field.startswith("tafsir") else texts
+    index = BM25Index.build(field_texts, fields=fields, key=key, analyzer=analyzer)
+
+    try:
+        index.save(cache_file)
+        print(f"💾 BM25 index saved to '{cache_file}'.")
+    except Exception as e:
+        print(f"⚠️ Could not save BM25 index: {e}")
+    return index
+
+def bm25_search(query, verses, bm25_index, top_k=5):
+    """
+    Performs Keyword Search (BM25F over translation + tafsir).
+    Raw BM25 scores are unbounded, so they are divided by the top hit's score:
+    like the other modes, results score in (0, 1] and the best match is 1.0.
+    """
+    hits = bm25_index.search(query, top_k=top_k)
+    top = hits[0][1] if hits and hits[0][1] > 0 else 1.0
+    return [(verses[i], score / top) for i, score in hits]
+
+# --- Arabic / Urdu Keyword Search ---
+
+# Arabic verse text and Urdu translation, diacritic-insensitive (see arabic_text.py)
+ARABIC_FIELDS = {"text": (1.0, 0.75), "urdu": (1.0, 0.75)}
+
+def build_arabic_index(verses, cache_file=os.path.join(INDEX_DIR, "bm25_arabic.npz")):
+    """BM25F index over the Arabic text and Urdu translation, persisted like the English one."""
+    return build_bm25_index(verses, cache_file=cache_file, fields=ARABIC_FIELDS, analyzer="arabic")
+
+def arabic_search(query, verses, arabic_index, top_k=5):
+    """
+    Performs Arabic / Urdu Keyword Search. Scores are relative to the top hit
+    (see bm25_search), so they can stand in for semantic cosine scores.
+    """
+    return bm25_search(query, verses, arabic_index, top_k=top_k)
+
+# --- Phrase / Proximity Search ---
+
+DEFAULT_PHRASE_DIR = os.path.join(INDEX_DIR, "phrase")
+
+def build_phrase_index(verses, index_dir=DEFAULT_PHRASE_DIR):
+    """
+    Loads the positional index (English + Urdu translations) from disk, or
+    builds and saves it if it is missing or was built from different text.
+    """
+    key = f"{verses.corpus.content_hash(*PHRASE_FIELDS)}|arabic-v{ANALYZER_VERSION}"
+    if os.path.exists(os.path.join(index_dir, "meta.json")):
+        try:
+            index = PositionalIndex.load(index_dir)
+            if index.meta.get("key") == key:
+                print(f"✅ Loaded phrase index from '{index_dir}'.")
+                return index
+            print("⚠️ Phrase index is out of date. Rebuilding...")
         except Exception as e:
-            print(f"⚠️ Error loading cache: {e}. Rebuilding index...")
-
-    # 2. If no cache or mismatch, rebuild index
-    # Extract English text
-    texts = [v.get('english', '') for v in verses]
-    
-    print(f"⏳ Encoding {len(texts)} verses for semantic search (First Run Only)...")
-    embeddings = model.encode(texts, convert_to_tensor=True)
-    
-    # 3. Save to file for next time
+            print(f"⚠️ Error loading phrase index: {e}. Rebuilding...")
+
+    print("⏳ Building phrase index (First Run Only)...")
+    index = PositionalIndex.build({field: verses.column(field) for field in PHRASE_FIELDS}, key=key)
     try:
-        print(f"💾 Saving embeddings to '{cache_file}'...")
-        torch.save(embeddings, cache_file)
-        print("✅ Semantic Index Built and Cached.")
+        index.save(index_dir)
+        print(f"💾 Phrase index saved to '{index_dir}' ({len(index.postings) // 1024} KB of postings).")
+        return PositionalIndex.load(index_dir)
     except Exception as e:
-        print(f"⚠️ Could not save cache: {e}")
-    
-    return model, embeddings
+        print(f"⚠️ Could not save phrase index: {e}")
+    return index
+
+def phrase_search(query, verses, phrase_index, top_k=5):
+    """
+    Performs Exact Phrase Search. Quoted phrases and NEAR/k operators are
+    honored; a query without either is matched as one phrase.
+    """
+    if not is_phrase_query(query):
+        query = f'"{query}"'
+    return [(verses[i], score) for i, score in phrase_index.search(query, top_k=top_k)]
+
+# --- Semantic Search ---
+
+# float16 halves the resident matrix at some scoring cost (see vector_index.py)
+SEMANTIC_VECTOR_DTYPE = os.environ.get("SEMANTIC_VECTOR_DTYPE", "float32")
+SEMANTIC_THRESHOLD = 0.15
+
+# "exact" scans every vector; "ivf" uses the approximate index built by
+# 'python build_index.py --only ann', probing SEMANTIC_NPROBE clusters per query
+SEMANTIC_INDEX = os.environ.get("SEMANTIC_INDEX", "exact").strip().lower()
+SEMANTIC_NPROBE = int(os.environ.get("SEMANTIC_NPROBE", "8"))
+DEFAULT_ANN_DIR = os.path.join(INDEX_DIR, "embeddings-ivf")
+
+def build_ann_index(store, index_dir=DEFAULT_ANN_DIR, n_lists=None):
+    """
+    Loads the IVF index for an EmbeddingStore, or clusters and saves it if it is
+    missing or was built from different embeddings.
+    """
+    key = store.fingerprint()
+    if os.path.exists(os.path.join(index_dir, "header.json")):
+        try:
+            index = IVFIndex.load(index_dir, nprobe=SEMANTIC_NPROBE)
+            if index.header.get("key") == key and (n_lists is None or index.n_lists == n_lists):
+                print(f"✅ Loaded IVF index from '{index_dir}' ({index.n_lists} lists).")
+                return index
+            print("⚠️ IVF index is out of date. Rebuilding...")
+        except Exception as e:
+            print(f"⚠️ Error loading IVF index: {e}. Rebuilding...")
+
+    print(f"⏳ Clustering {len(store)} vectors for the IVF index...")
+    index = IVFIndex.build(store.to_float32(), n_lists=n_lists, key=key)
+    index.save(index_dir)
+    print(f"💾 IVF index saved to '{index_dir}' ({index.n_lists} lists).")
+    return IVFIndex.load(index_dir, nprobe=SEMANTIC_NPROBE)
+
+def load_ann_index(store, index_dir=DEFAULT_ANN_DIR):
+    """Serve-time counterpart of build_ann_index: never clusters, returns None if unusable."""
+    try:
+        index = IVFIndex.load(index_dir, nprobe=SEMANTIC_NPROBE)
+    except Exception as e:
+        print(f"⚠️ No usable IVF index in '{index_dir}' ({e}). Run 'python build_index.py --only ann'.")
+        return None
+    if index.header.get("key") != store.fingerprint():
+        print(f"⚠️ IVF index in '{index_dir}' is out of date. Run 'python build_index.py --only ann'.")
+        return None
+    return index
+
+def build_semantic_index(verses, store_dir=DEFAULT_EMBEDDING_DIR, recipe="english"):
+    """
+    Returns (model, vector_index) for semantic search.
+    Embeddings come from the shared on-disk embedding store (see embedding_store.py),
+    built offline by 'build_index.py'. The web app never encodes the corpus itself:
+    if the store is missing or out of date, the index is None.
+    Expects 'verses' to be a VerseTable.
+    """
+    model = get_semantic_model()
+    texts = recipe_texts(verses, recipe)
 
-def semantic_search(query, verses, model, embeddings, top_k=5):
+    store = load_embeddings(texts, SEMANTIC_MODEL_NAME, recipe=recipe, store_dir=store_dir)
+    if store is None:
+        return model, None
+
+    if SEMANTIC_INDEX == "ivf":
+        ann_index = load_ann_index(store)
+        if ann_index is not None:
+            print(f"✅ Semantic search uses the IVF index (nprobe={ann_index.nprobe}).")
+            return model, ann_index
+        print("⚠️ Falling back to exact semantic search.")
+
+    # Normalized once here, so every query is a single matrix-vector product
+    return model, VectorIndex.from_vectors(store.to_float32(), dtype=SEMANTIC_VECTOR_DTYPE)
+
+def semantic_search(query, verses, model, vector_index, top_k=5):
     """
     Performs Semantic Search using vector embeddings.
     """
-    from sentence_transformers import util
-    
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    
-    # Compute cosine similarities
-    cosine_scores = util.cos_sim(query_embedding, embeddings)[0]
-    
-    # Get top_k results
-    # We use argpartition to find the top k indices efficiently
-    top_results_indices = np.argpartition(-cosine_scores.cpu(), range(top_k))[0:top_k]
-    
+    query_embedding = encode_query(query, model)
+
+    # If the score is too low (e.g. < 0.15), it's likely noise or a default sort order
+    return [(verses[i], score) for i, score in vector_index.search(query_embedding, top_k)
+            if score > SEMANTIC_THRESHOLD]
+
+def semantic_search_batch(queries, verses, model, vector_index, top_k=5):
+    """Semantic search for many queries at once: one encode call and one GEMM."""
+    hits = vector_index.search_batch(encode_queries(queries, model), top_k)
+    return [[(verses[i], score) for i, score in row if score > SEMANTIC_THRESHOLD] for row in hits]
+
+# --- Hybrid Search ---
+# Lexical engines are good at names and exact terms, the vector engine at
+# concepts. Hybrid mode runs both at once (NumPy releases the GIL during
+# scoring), so its latency is that of the slower engine, then fuses the rankings.
+
+HYBRID_FUSION = os.environ.get("HYBRID_FUSION", "rrf").strip().lower()  # "rrf" or "weighted"
+HYBRID_ALPHA = float(os.environ.get("HYBRID_ALPHA", "0.5"))  # semantic weight for "weighted"
+RRF_K = 60
+_search_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("HYBRID_THREADS", "4")),
+                                  thread_name_prefix="hybrid")
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses ranked [(doc, score), ...] lists by sum of 1 / (k + rank). Scores are
+    scaled so a document ranked first by every engine gets 1.0.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, 1):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (k + rank)
+    best = len(rankings) / (k + 1)
+    return {doc: score / best for doc, score in fused.items()}
+
+def weighted_fusion(rankings, weights):
+    """Min-max normalizes each ranking's scores to [0, 1] and sums them with 'weights'."""
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        scores = [score for _, score in ranking]
+        low, span = min(scores), max(scores) - min(scores)
+        for doc, score in ranking:
+            normalized = (score - low) / span if span > 0 else 1.0
+            fused[doc] = fused.get(doc, 0.0) + weight * normalized
+    return fused
+
+def hybrid_search(query, verses, lexical_index, model, vector_index, top_k=5,
+                  fusion=None, alpha=None, candidates=50):
+    """
+    Performs Hybrid Search: lexical (BM25 or TF-IDF) and semantic rankings of
+    the top 'candidates' verses each, fused with RRF or weighted scores.
+    """
+    fusion = fusion or HYBRID_FUSION
+    alpha = HYBRID_ALPHA if alpha is None else alpha
+
+    # Lexical side on the pool, semantic side (query encode + GEMV) on this thread
+    lexical = _search_pool.submit(lexical_index.search, query, candidates)
+    semantic = [(i, score) for i, score in vector_index.search(encode_query(query, model), candidates)
+                if score > SEMANTIC_THRESHOLD]
+    lexical = [(i, score) for i, score in lexical.result() if score > 0.0]
+
+    if fusion == "weighted":
+        fused = weighted_fusion([semantic, lexical], [alpha, 1.0 - alpha])
+    else:
+        fused = reciprocal_rank_fusion([semantic, lexical])
+
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [(verses[i], score) for i, score in best]
+
+# --- Tafsir Passage Retrieval ---
+
+def load_tafsir_index(verses):
+    """Opens the offline-built tafsir passage index (see tafsir_index.py), or None."""
+    from tafsir_index import TafsirChunkIndex
+    return TafsirChunkIndex.load(verses, SEMANTIC_MODEL_NAME)
+
+def retrieve_tafsir(query, verses, model, tafsir_index, top_k=4):
+    """
+    Returns the tafsir passages most relevant to 'query' as
+    [(verse, passage_text, score), ...], at most one passage per verse.
+    """
+    query_embedding = encode_query(query, model)
     results = []
-    for idx in top_results_indices:
-        score = cosine_scores[idx].item()
-        
-        # --- FIX: Add a threshold to filter out irrelevant results ---
-        # If the score is too low (e.g. < 0.15), it's likely noise or a default sort order
-        if score > 0.15: 
-            results.append((verses[idx], score))
-    
-    # Sort the final filtered results by score descending
-    results = sorted(results, key=lambda x: x[1], reverse=True)
-        
-    return results
\ No newline at end of file
+    for chunk, score in tafsir_index.search(query_embedding, top_k=top_k):
+        if score > SEMANTIC_THRESHOLD:
+            verse, text = tafsir_index.passage(verses, chunk)
+            results.append((verse, text, score))
+    return results
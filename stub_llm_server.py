@@ -0,0 +1,111 @@
+import argparse
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_gateway import CANNED_ANSWER
+
+# --- Stub LLM Server ---
+# A local stand-in for the Gemini API, for development and tests without an API
+# key: it answers generateContent and streamGenerateContent (SSE) requests with a
+# canned Markdown answer, streamed word by word with a configurable delay. For
+# load tests it can also add latency before the first word and fail a fraction
+# of requests with 503 (to exercise the gateway's retries and circuit breaker).
+#
+#   python stub_llm_server.py --port 8765 --delay-ms 40 [--latency-ms 500 --fail-rate 0.1]
+#   LLM_BASE_URL=http://127.0.0.1:8765 python app.py
+
+_PATH_RE = re.compile(r"^/[^/]+/models/([^:/]+):(generateContent|streamGenerateContent)")
+
+
+def response_chunk(text, model, last=False, prompt_chars=0):
+    """One GenerateContentResponse as the Gemini REST API returns it."""
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    chunk = {"candidates": [candidate], "modelVersion": model}
+    if last:
+        candidate["finishReason"] = "STOP"
+        chunk["usageMetadata"] = {"promptTokenCount": prompt_chars // 4,
+                                  "candidatesTokenCount": len(CANNED_ANSWER) // 4}
+    return chunk
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.04
+    latency = 0.0
+    fail_rate = 0.0
+    answer = CANNED_ANSWER
+
+    def do_POST(self):
+        match = _PATH_RE.match(self.path)
+        if not match:
+            self.send_error(404, "Unknown endpoint")
+            return
+        model, method = match.groups()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt_chars = sum(len(part.get("text", "")) for content in body.get("contents", [])
+                           for part in content.get("parts", []))
+
+        time.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            payload = json.dumps({"error": {"code": 503, "message": "Stub overloaded", "status": "UNAVAILABLE"}}).encode()
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        if method == "generateContent":
+            payload = json.dumps(response_chunk(self.answer, model, last=True, prompt_chars=prompt_chars)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        # Streaming: one SSE event per word, then the connection is closed
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        tokens = re.findall(r"\S+\s*", self.answer)
+        try:
+            for i, token in enumerate(tokens):
+                chunk = response_chunk(token, model, last=i == len(tokens) - 1, prompt_chars=prompt_chars)
+                self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+                self.wfile.flush()
+                time.sleep(self.delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client cancelled the answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve canned, streamed LLM answers on localhost.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay-ms", type=float, default=40, help="Delay between streamed words (default: 40)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before the first word (default: 0)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503 (default: 0)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    StubHandler.delay = args.delay_ms / 1000
+    StubHandler.latency = args.latency_ms / 1000
+    StubHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    print(f"✅ Stub LLM server on http://127.0.0.1:{args.port} (set LLM_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nExiting...")
+
+
+if __name__ == "__main__":
+    main()
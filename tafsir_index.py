@@ -0,0 +1,180 @@
+import json
+import os
+import re
+
+import numpy as np
+
+from corpus_store import INDEX_DIR
+from embedding_builder import ParallelEncoder
+from embedding_store import EmbeddingStore, sync_embeddings
+from utils import strip_html
+from vector_index import VectorIndex
+
+# --- Tafsir Passage Index ---
+# Only the translation line used to be embedded, and /ask_ai pasted the first
+# 200 characters of each tafsir entry into the prompt. Here every tafsir entry
+# is stripped of HTML and cut into overlapping word windows ("passages"); each
+# passage is embedded and mapped back to (verse row, character offset, length)
+# in the stripped text. Passage text itself is not stored: it is sliced back out
+# of the corpus store for the few passages a query returns.
+#
+# On disk (built offline by 'python build_index.py --only tafsir'):
+#   data/index/tafsir/chunks.npz    -> rows, offsets, lengths + metadata
+#   data/index/tafsir/embeddings/   -> EmbeddingStore of the passages (memory-mapped)
+
+DEFAULT_TAFSIR_DIR = os.path.join(INDEX_DIR, "tafsir")
+CHUNK_WORDS = 120     # ~170 word pieces: well inside MiniLM's 256-token window
+CHUNK_OVERLAP = 30
+CHUNK_VERSION = 1
+
+_WORD_RE = re.compile(r"\S+")
+
+# Tafsir fields the corpus store also keeps as plain text (stripped at compile time)
+PLAIN_FIELDS = {"tafsir_en": "tafsir_en_text"}
+
+
+def chunk_passages(text, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Splits plain text into overlapping word windows: [(char_offset, passage), ...]."""
+    words = [(m.start(), m.end()) for m in _WORD_RE.finditer(text)]
+    if not words:
+        return []
+    passages = []
+    step = max(1, size - overlap)
+    for first in range(0, len(words), step):
+        last = min(first + size, len(words)) - 1
+        start, end = words[first][0], words[last][1]
+        passages.append((start, text[start:end]))
+        if last == len(words) - 1:
+            break
+    return passages
+
+
+def chunk_tafsir(verses, field="tafsir_en", size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Chunks the tafsir of every verse. Ibn Kathir often repeats one commentary
+    across a run of verses; identical texts are chunked (and embedded) once and
+    attributed to the first verse carrying them.
+    Returns (rows, offsets, lengths, passages).
+    """
+    rows, offsets, lengths, passages = [], [], [], []
+    seen = set()
+    plain = PLAIN_FIELDS.get(field)
+    texts = verses.column(plain) if plain else (strip_html(html) for html in verses.column(field))
+    for row, text in enumerate(texts):
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        for offset, passage in chunk_passages(text, size, overlap):
+            rows.append(row)
+            offsets.append(offset)
+            lengths.append(len(passage))
+            passages.append(passage)
+    return (np.array(rows, dtype=np.int32), np.array(offsets, dtype=np.int32),
+            np.array(lengths, dtype=np.int32), passages)
+
+
+def _chunk_key(verses, field, size, overlap):
+    return f"{verses.corpus.content_hash(field)}|{field}|{size}|{overlap}|v{CHUNK_VERSION}"
+
+
+class TafsirChunkIndex:
+    def __init__(self, rows, offsets, lengths, vector_index, meta):
+        self.rows = rows
+        self.offsets = offsets
+        self.lengths = lengths
+        self.vector_index = vector_index
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def load(cls, verses, model_name, index_dir=DEFAULT_TAFSIR_DIR):
+        """
+        Opens the passage index for serving (vectors memory-mapped). Never
+        chunks or encodes: returns None, with a hint, if it is missing or stale.
+        """
+        chunk_file = os.path.join(index_dir, "chunks.npz")
+        if not os.path.exists(chunk_file):
+            print(f"⚠️ No tafsir passage index in '{index_dir}'. Run 'python build_index.py --only tafsir'.")
+            return None
+        try:
+            with np.load(chunk_file) as data:
+                meta = json.loads(str(data["meta"]))
+                rows, offsets, lengths = data["rows"], data["offsets"], data["lengths"]
+            store = EmbeddingStore.load(os.path.join(index_dir, "embeddings"))
+        except Exception as e:
+            print(f"⚠️ Error loading tafsir passage index: {e}. Run 'python build_index.py --only tafsir'.")
+            return None
+
+        current = _chunk_key(verses, meta["field"], meta["size"], meta["overlap"])
+        if meta.get("key") != current or meta.get("model") != model_name or meta.get("vectors") != store.fingerprint():
+            print(f"⚠️ Tafsir passage index in '{index_dir}' is out of date. Run 'python build_index.py --only tafsir'.")
+            return None
+
+        print(f"✅ Tafsir passage index loaded ({len(rows)} passages).")
+        return cls(rows, offsets, lengths, VectorIndex.from_vectors(store.to_float32()), meta)
+
+    def search(self, query_vector, top_k=4, per_verse=1):
+        """
+        Best passages for a query embedding: [(chunk_id, score), ...], with at
+        most 'per_verse' passages from any one verse.
+        """
+        results, taken = [], {}
+        for chunk, score in self.vector_index.search(query_vector, top_k * 4):
+            row = int(self.rows[chunk])
+            if taken.get(row, 0) >= per_verse:
+                continue
+            taken[row] = taken.get(row, 0) + 1
+            results.append((chunk, score))
+            if len(results) == top_k:
+                break
+        return results
+
+    def passage(self, verses, chunk):
+        """(verse row, passage text) of a chunk, sliced from the stripped tafsir."""
+        row = int(self.rows[chunk])
+        start = int(self.offsets[chunk])
+        plain = PLAIN_FIELDS.get(self.meta["field"])
+        text = verses[row][plain] if plain else strip_html(verses[row][self.meta["field"]])
+        return verses[row], text[start:start + int(self.lengths[chunk])]
+
+
+def build_tafsir_index(verses, model_name, index_dir=DEFAULT_TAFSIR_DIR, field="tafsir_en",
+                       size=CHUNK_WORDS, overlap=CHUNK_OVERLAP, dtype="float32", workers=None, batch_size=64):
+    """
+    Offline: chunks the tafsir and brings the passage embeddings up to date.
+    Unchanged passages are never re-encoded (the EmbeddingStore is keyed by
+    passage hash). Returns the number of passages, or None on failure.
+    """
+    print(f"⏳ Chunking {field} into {size}-word passages (overlap {overlap})...")
+    rows, offsets, lengths, passages = chunk_tafsir(verses, field, size, overlap)
+    if not passages:
+        print(f"⚠️ No {field} text to index.")
+        return None
+    print(f"✅ {len(passages)} passages from {len(np.unique(rows))} distinct tafsir entries.")
+
+    store_dir = os.path.join(index_dir, "embeddings")
+    encoder = ParallelEncoder(model_name, f"{store_dir}.checkpoints", workers=workers, batch_size=batch_size)
+    store, saved = sync_embeddings(passages, model_name, encoder, recipe=f"{field}-passages",
+                                   dtype=dtype, store_dir=store_dir)
+    if not saved:
+        # The checkpoints are the only copy of the new vectors: keep them for the next run
+        return None
+    encoder.cleanup()
+
+    meta = {
+        "version": CHUNK_VERSION,
+        "key": _chunk_key(verses, field, size, overlap),
+        "field": field,
+        "size": size,
+        "overlap": overlap,
+        "model": model_name,
+        "vectors": store.fingerprint(),
+    }
+    chunk_file = os.path.join(index_dir, "chunks.npz")
+    tmp_file = f"{chunk_file}.tmp-{os.getpid()}.npz"
+    np.savez(tmp_file, rows=rows, offsets=offsets, lengths=lengths, meta=np.array(json.dumps(meta)))
+    os.replace(tmp_file, chunk_file)
+    print(f"💾 Tafsir passage index saved to '{index_dir}'.")
+    return len(passages)
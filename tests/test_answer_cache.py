@@ -0,0 +1,113 @@
+import math
+import types
+
+import numpy as np
+import pytest
+
+import answer_cache
+from answer_cache import SemanticAnswerCache, verse_overlap
+
+# Same defaults as app.py (ANSWER_CACHE_THRESHOLD / ANSWER_CACHE_MIN_OVERLAP)
+THRESHOLD, MIN_OVERLAP = 0.85, 0.5
+VERSES = ["2:153", "2:155", "3:200", "39:10"]
+
+
+def at_cosine(cos, dim=8):
+    """A vector with exactly 'cos' similarity to the first axis."""
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[0], vector[1] = cos, math.sqrt(1.0 - cos * cos)
+    return vector
+
+
+BASE = at_cosine(1.0)
+
+
+def make_cache(**kwargs):
+    return SemanticAnswerCache(threshold=THRESHOLD, min_overlap=MIN_OVERLAP, **kwargs)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = types.SimpleNamespace(now=1_000_000.0)
+    fake.time = lambda: fake.now
+    monkeypatch.setattr(answer_cache, "time", fake)
+    return fake
+
+
+def test_paraphrase_hits_above_the_threshold():
+    cache = make_cache()
+    cache.put("minilm", "what does the quran say about patience", BASE, VERSES, "Be patient.")
+    assert cache.get("minilm", at_cosine(0.95), VERSES) == "Be patient."
+    assert cache.get("minilm", at_cosine(0.86), VERSES) == "Be patient."
+    assert cache.get("minilm", at_cosine(0.84), VERSES) is None
+    # Only the direction matters
+    assert cache.get("minilm", 3.0 * at_cosine(0.9), VERSES) == "Be patient."
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+
+def test_similar_question_from_other_verses_is_rejected():
+    cache = make_cache()
+    cache.put("minilm", "patience", BASE, VERSES, "Be patient.")
+    # Half the verses shared is enough; a quarter is not
+    assert cache.get("minilm", BASE, VERSES[:2]) == "Be patient."
+    assert cache.get("minilm", BASE, VERSES[:1] + ["112:1", "112:2", "112:3"]) is None
+    assert cache.stats()["rejected_overlap"] == 1
+
+
+def test_verse_overlap():
+    assert verse_overlap(frozenset(), frozenset()) == 1.0
+    assert verse_overlap(frozenset(VERSES), frozenset(VERSES[:2])) == 0.5
+    assert verse_overlap(frozenset(VERSES[:1]), frozenset(["1:1"])) == 0.0
+
+
+def test_namespaces_are_separate():
+    cache = make_cache()
+    cache.put("minilm", "patience", BASE, VERSES, "English answer.")
+    assert cache.get("multilingual", BASE, VERSES) is None
+    cache.put("multilingual", "صبر", BASE, VERSES, "Urdu answer.")
+    assert cache.get("minilm", BASE, VERSES) == "English answer."
+    assert cache.get("multilingual", BASE, VERSES) == "Urdu answer."
+
+
+def test_workers_share_answers_through_sqlite(tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    writer = make_cache(path=path)
+    reader = make_cache(path=path, sync_seconds=0)
+    lagging = make_cache(path=path, sync_seconds=3600)
+
+    writer.put("minilm", "patience", BASE, VERSES, "Be patient.")
+    assert reader.get("minilm", at_cosine(0.9), VERSES) == "Be patient."
+    # Rows written by others are only pulled every 'sync_seconds'
+    assert lagging.get("minilm", BASE, VERSES) is None
+
+    # A restarted worker loads the file
+    restarted = make_cache(path=path)
+    assert restarted.stats()["entries"] == 1
+    assert restarted.get("minilm", BASE, VERSES) == "Be patient."
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = make_cache(max_entries=2)
+    first, second, third = BASE, np.eye(8, dtype=np.float32)[2], np.eye(8, dtype=np.float32)[3]
+    cache.put("minilm", "first", first, VERSES, "1")
+    cache.put("minilm", "second", second, VERSES, "2")
+    assert cache.get("minilm", first, VERSES) == "1"  # now the most recently used
+    cache.put("minilm", "third", third, VERSES, "3")
+
+    assert cache.stats()["entries"] == 2
+    assert cache.get("minilm", second, VERSES) is None
+    assert cache.get("minilm", first, VERSES) == "1"
+    assert cache.get("minilm", third, VERSES) == "3"
+
+
+def test_entries_expire(clock, tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    cache = make_cache(ttl_seconds=60, path=path, sync_seconds=0)
+    cache.put("minilm", "patience", BASE, VERSES, "Be patient.")
+
+    clock.now += 59
+    assert cache.get("minilm", BASE, VERSES) == "Be patient."
+    clock.now += 2
+    assert cache.get("minilm", BASE, VERSES) is None
+    # Expired rows are not loaded from the file either
+    assert make_cache(ttl_seconds=60, path=path).stats()["entries"] == 0
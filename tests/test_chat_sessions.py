@@ -0,0 +1,70 @@
+import threading
+
+from chat_sessions import ChatSessionStore
+
+
+def test_ids_are_issued_by_the_store():
+    store = ChatSessionStore()
+    for guess in (None, "", "1700000000000", "../etc/passwd", "0" * 32):
+        session = store.get(guess)
+        assert session.id != guess and len(session.id) == 32
+    session = store.get(None)
+    assert store.get(session.id) is session
+
+
+def test_spilled_sessions_come_back(tmp_path):
+    store = ChatSessionStore(max_sessions=1, spill_dir=str(tmp_path))
+    first = store.get(None)
+    with store.turn(first.id) as session:
+        store.record_turn(session, "What is patience?", "Sabr.", ["2:153"])
+    second = store.get(None)
+    assert first.id not in store._sessions and second.id in store._sessions
+
+    restored = store.get(first.id)
+    assert restored.id == first.id
+    assert restored.turns == [["What is patience?", "Sabr."]] and restored.is_cited("2:153")
+    assert store.stats()["spilled"] >= 1 and store.stats()["restored"] == 1
+
+
+def test_session_with_a_turn_in_flight_is_not_evicted(tmp_path):
+    store = ChatSessionStore(max_sessions=1, spill_dir=str(tmp_path))
+    started, finish = threading.Event(), threading.Event()
+    busy = store.get(None)
+
+    def answer():
+        with store.turn(busy.id) as session:
+            started.set()
+            finish.wait(5)
+            store.record_turn(session, "q", "a", [])
+
+    worker = threading.Thread(target=answer)
+    worker.start()
+    started.wait(5)
+    other = store.get(None)
+    # Over the limit, but the busy session stays: the idle one is spilled instead
+    assert list(store._sessions) == [busy.id]
+    assert store.get(other.id).id == other.id
+
+    finish.set()
+    worker.join(5)
+    store.get(None)
+    # Once the turn is done the old session is spilled, with its finished turn
+    assert busy.id not in store._sessions
+    assert store.get(busy.id).turns == [["q", "a"]]
+
+
+def test_turns_of_one_session_run_in_order(tmp_path):
+    store = ChatSessionStore(max_sessions=2, spill_dir=str(tmp_path))
+    session_id = store.get(None).id
+
+    def ask(n):
+        with store.turn(session_id) as session:
+            store.record_turn(session, f"q{n}", "a", [])
+        store.get(None)  # churn: pushes sessions out to the spill directory
+
+    threads = [threading.Thread(target=ask, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert store.get(session_id).turn_count == 20
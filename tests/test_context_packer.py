@@ -0,0 +1,30 @@
+from context_packer import ContextItem, ContextPacker, TokenCounter
+
+
+def verse(n):
+    return {"surah_id": 2, "ayah_number": n}
+
+
+def words(count, start=0):
+    return " ".join(f"w{i}" for i in range(start, start + count)) + "."
+
+
+def test_pack_leaves_candidates_untouched():
+    counter = TokenCounter(tokenize=lambda text: len(text.split()))
+    packer = ContextPacker(counter, budget=60, item_overhead=0, min_tokens=5)
+    long_tafsir = " ".join(words(10, 100 + 10 * k) for k in range(8))
+    candidates = [
+        ContextItem("verse", verse(1), words(20), 3.0),
+        ContextItem("tafsir", verse(1), long_tafsir, 2.0),
+    ]
+    before = [(c.kind, c.text, c.score, c.tokens) for c in candidates]
+
+    packed, used = packer.pack(candidates)
+    assert [(c.kind, c.text, c.score, c.tokens) for c in candidates] == before
+    assert all(p is not c for p in packed for c in candidates)
+    assert [p.tokens for p in packed] == [20, 40] and used == 60
+    assert packed[1].text == " ".join(words(10, 100 + 10 * k) for k in range(4))
+
+    # The same candidates pack the same way again
+    again, _ = packer.pack(candidates)
+    assert [(p.text, p.tokens) for p in again] == [(p.text, p.tokens) for p in packed]
@@ -0,0 +1,58 @@
+import numpy as np
+
+from embedding_store import sync_embeddings
+
+TEXTS = ["In the name of Allah", "All praise is due to Allah", "The Most Merciful"]
+
+
+class FakeEncoder:
+    """Deterministic 'encode' callable that records which texts it was given."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        rng = [np.random.default_rng(sum(map(ord, t))) for t in texts]
+        return np.array([r.standard_normal(self.dim) for r in rng], dtype=np.float32)
+
+
+def test_sync_saves_and_reuses(tmp_path):
+    store_dir = str(tmp_path / "emb")
+    encode = FakeEncoder()
+    store, saved = sync_embeddings(TEXTS, "m", encode, store_dir=store_dir)
+    assert saved and len(store) == 3
+
+    store, saved = sync_embeddings(TEXTS + ["Master of the Day"], "m", encode, store_dir=store_dir)
+    assert saved and len(store) == 4
+    assert encode.calls[-1] == ["Master of the Day"]
+
+
+def test_failed_save_is_reported(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("not a directory")
+    store, saved = sync_embeddings(TEXTS, "m", FakeEncoder(), store_dir=str(blocker / "emb"))
+    assert store is not None and not saved
+
+
+def test_changing_dtype_reencodes_everything(tmp_path):
+    store_dir = str(tmp_path / "emb")
+    encode = FakeEncoder()
+    sync_embeddings(TEXTS, "m", encode, dtype="int8", store_dir=store_dir)
+
+    store, saved = sync_embeddings(TEXTS, "m", encode, dtype="float32", store_dir=store_dir)
+    assert saved and store.dtype == "float32"
+    assert encode.calls[-1] == TEXTS
+    np.testing.assert_array_equal(store.to_float32(), encode(TEXTS))
+
+
+def test_partial_resync_keeps_int8_rows_exact(tmp_path):
+    store_dir = str(tmp_path / "emb")
+    encode = FakeEncoder()
+    before, _ = sync_embeddings(TEXTS, "m", encode, dtype="int8", store_dir=store_dir)
+    old = np.array(before.vectors)
+
+    after, _ = sync_embeddings(TEXTS + ["Master of the Day"], "m", encode, dtype="int8", store_dir=store_dir)
+    assert encode.calls[-1] == ["Master of the Day"]
+    np.testing.assert_array_equal(np.asarray(after.vectors)[:3], old)
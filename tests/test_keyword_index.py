@@ -0,0 +1,89 @@
+import math
+from collections import Counter
+
+import numpy as np
+
+from keyword_index import BM25Index, TfidfKeywordIndex, top_k_indices, tokenize
+
+TEXTS = [
+    "patience and prayer are a help",
+    "be patient, for Allah is with the patient",
+    "mercy and forgiveness from your Lord",
+    "patience and prayer are a help",  # duplicate of verse 0: an exact tie
+    "establish prayer and give charity",
+    "the day of judgement",
+    "and seek help through patience and prayer",
+    "forgiveness and mercy, mercy and patience",
+]
+
+
+def brute_force(scores, k):
+    """Every matching doc (score > 0), best first, ties by index, cut to k."""
+    ranked = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: (-scores[i], i))
+    return ranked[:k]
+
+
+def test_top_k_indices_order_and_ties():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        scores = rng.integers(0, 5, size=rng.integers(1, 40)).astype(np.float64)  # many ties
+        for k in (1, 3, 10, 100):
+            expected = sorted(range(len(scores)), key=lambda i: (-scores[i], i))[:k]
+            assert top_k_indices(scores, k).tolist() == expected
+
+
+def test_top_k_indices_edge_cases():
+    assert top_k_indices(np.array([]), 5).tolist() == []
+    assert top_k_indices(np.array([1.0, 2.0]), 0).tolist() == []
+    assert top_k_indices(np.array([1.0, 2.0]), 5).tolist() == [1, 0]
+
+
+def test_tfidf_search_matches_brute_force():
+    index = TfidfKeywordIndex.build(TEXTS, {"stop_words": "english"})
+    matrix = index.vectorizer.transform(TEXTS)
+    for query in ["patience prayer", "mercy", "help", "charity judgement", "patience"]:
+        scores = (matrix @ index.vectorizer.transform([query]).T).toarray().ravel()
+        for k in (1, 2, 5, 50):
+            results = index.search(query, top_k=k)
+            assert [doc for doc, _ in results] == brute_force(scores, k)
+            assert np.allclose([score for _, score in results], scores[brute_force(scores, k)])
+
+
+def test_tfidf_exact_tie_is_ordered_by_verse():
+    index = TfidfKeywordIndex.build(TEXTS, {"stop_words": "english"})
+    docs = [doc for doc, _ in index.search("patience prayer help", top_k=2)]
+    assert docs == [0, 3]
+
+
+def test_tfidf_top_k_larger_than_matches():
+    index = TfidfKeywordIndex.build(TEXTS, {"stop_words": "english"})
+    assert [doc for doc, _ in index.search("judgement", top_k=10)] == [5]
+    assert index.search("nonexistentword", top_k=10) == []
+
+
+def bm25_brute_force(texts, query, k1=1.2, b=0.75):
+    docs = [tokenize(t) for t in texts]
+    avg_len = sum(len(d) for d in docs) / len(docs)
+    df = Counter(term for d in docs for term in set(d))
+    scores = []
+    for d in docs:
+        tf = Counter(d)
+        norm = 1.0 - b + b * len(d) / avg_len
+        score = 0.0
+        for term, qtf in Counter(t for t in tokenize(query) if t in df).items():
+            pseudo = tf[term] / norm
+            idf = math.log(1.0 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+            score += qtf * idf * pseudo / (k1 + pseudo)
+        scores.append(score)
+    return scores
+
+
+def test_bm25_search_matches_brute_force():
+    index = BM25Index.build({"english": TEXTS}, fields={"english": (1.0, 0.75)})
+    for query in ["patience prayer", "mercy mercy", "help", "charity judgement"]:
+        scores = bm25_brute_force(TEXTS, query)
+        for k in (1, 3, 50):
+            results = index.search(query, top_k=k)
+            assert [doc for doc, _ in results] == brute_force(scores, k)
+            assert np.allclose([score for _, score in results], [scores[i] for i in brute_force(scores, k)],
+                               rtol=1e-5)
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from llm_gateway import CircuitBreaker, DeadlineExceeded, FakeProvider, LLMGateway
+
+
+async def collect(gateway, prompt):
+    return "".join([chunk async for chunk in gateway.stream(prompt)])
+
+
+def test_waiting_for_a_slot_is_not_a_breaker_failure():
+    async def main():
+        gateway = LLMGateway(FakeProvider(latency_ms=200, token_delay_ms=0), max_concurrency=1,
+                             rate=1000, burst=10, deadline_seconds=2.0, retries=0,
+                             breaker=CircuitBreaker(failure_threshold=1, reset_seconds=60))
+        busy = asyncio.create_task(collect(gateway, "first"))
+        await asyncio.sleep(0.01)
+        gateway.deadline_seconds = 0.05  # the second call gives up while the slot is taken
+        with pytest.raises(DeadlineExceeded):
+            await collect(gateway, "second")
+        # Checked before the first call's success would reset the breaker anyway
+        assert gateway.breaker.state == "closed" and gateway.breaker.failures == 0
+        assert gateway.counters["timeouts"] == 1
+        assert await busy
+
+    asyncio.run(main())
+
+
+def test_upstream_deadline_opens_the_breaker():
+    async def main():
+        gateway = LLMGateway(FakeProvider(latency_ms=200, token_delay_ms=0), rate=1000, burst=10,
+                             deadline_seconds=0.05, first_token_seconds=1.0, retries=0,
+                             breaker=CircuitBreaker(failure_threshold=1, reset_seconds=60))
+        with pytest.raises(DeadlineExceeded):
+            await collect(gateway, "slow")
+        return gateway
+
+    assert asyncio.run(main()).breaker.state == "open"
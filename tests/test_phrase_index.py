@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from phrase_index import SKIP_INTERVAL, PositionalIndex, english_words
+
+WORDS = ["the", "of", "lord", "mercy", "day", "path", "guide", "straight"]
+
+
+def build(texts):
+    return PositionalIndex.build({"english": texts})
+
+
+def brute_phrase(texts, phrase):
+    """Docs (ascending) whose words contain 'phrase' contiguously."""
+    target = english_words(phrase)
+    hits = []
+    for doc, text in enumerate(texts):
+        words = english_words(text)
+        if any(words[i:i + len(target)] == target for i in range(len(words) - len(target) + 1)):
+            hits.append(doc)
+    return hits
+
+
+def brute_near(texts, left, right, k):
+    """{doc: score} for single words 'left' NEAR/k 'right' (score 1 / closest distance, at least 1)."""
+    out = {}
+    for doc, text in enumerate(texts):
+        words = english_words(text)
+        distances = [abs(i - j) for i, a in enumerate(words) if a == left
+                     for j, b in enumerate(words) if b == right]
+        distances = [d for d in distances if d <= k]
+        if distances:
+            out[doc] = 1.0 / max(min(distances), 1)
+    return out
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = random.Random(7)
+    texts = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))) for _ in range(400)]
+    return texts, build(texts)
+
+
+def test_phrases_match_brute_force(corpus):
+    texts, index = corpus
+    rng = random.Random(11)
+    for _ in range(600):
+        if rng.random() < 0.5:
+            # A phrase taken from a verse: always has at least one hit
+            words = english_words(rng.choice(texts))
+            start = rng.randrange(len(words))
+            phrase = " ".join(words[start:start + rng.randint(1, 4)])
+        else:
+            phrase = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        expected = brute_phrase(texts, phrase)
+        results = index.search(f'"{phrase}"', top_k=len(texts))
+        assert [doc for doc, _ in results] == expected, phrase
+        assert all(score == 1.0 for _, score in results)
+
+
+def test_near_matches_brute_force(corpus):
+    texts, index = corpus
+    rng = random.Random(13)
+    for _ in range(200):
+        left, right, k = rng.choice(WORDS), rng.choice(WORDS), rng.randint(0, 6)
+        expected = brute_near(texts, left, right, k)
+        results = dict(index.search(f"{left} NEAR/{k} {right}", top_k=len(texts)))
+        assert results == pytest.approx(expected), (left, right, k)
+
+
+@pytest.mark.parametrize("df", [SKIP_INTERVAL - 1, SKIP_INTERVAL, SKIP_INTERVAL + 1,
+                                2 * SKIP_INTERVAL, 2 * SKIP_INTERVAL + 1])
+def test_cursor_advance_around_block_boundaries(df):
+    # 'lord' in every other verse, so its postings end exactly on a block boundary for 16 and 32
+    texts = ["lord mercy" if doc % 2 == 0 else "mercy" for doc in range(2 * df)]
+    index = build(texts)
+    term = index.vocabulary["english:lord"]
+    docs = list(range(0, 2 * df, 2))
+    assert index.df[term] == df
+
+    for target in range(0, 2 * df + 2):
+        expected = next((d for d in docs if d >= target), None)
+        assert index.cursor(term).advance(target) == expected, target
+
+    # One cursor through increasing targets, as an intersection uses it
+    cursor = index.cursor(term)
+    for target in range(0, 2 * df + 2, 3):
+        assert cursor.advance(target) == next((d for d in docs if d >= target), None)
+
+    # A rare term at the very end: the frequent one skips every block to reach it
+    texts[-2] += " path"
+    assert [doc for doc, _ in build(texts).search('"lord mercy path"')] == [2 * df - 2]
+
+
+def test_near_zero_needs_overlapping_spans():
+    index = build(["mercy lord", "lord mercy", "mercy of the lord", "the lord of mercy"])
+    # Adjacent words are one position apart: NEAR/1, not NEAR/0
+    assert index.search("mercy NEAR/0 lord") == []
+    assert [doc for doc, _ in index.search("mercy NEAR/1 lord")] == [0, 1]
+    # NEAR/0 still matches a span that overlaps the other clause
+    assert [doc for doc, _ in index.search('"the lord" NEAR/0 lord')] == [2, 3]
+    assert [doc for doc, _ in index.search("mercy NEAR/0 mercy", top_k=10)] == [0, 1, 2, 3]
+
+
+def test_phrase_with_a_repeated_stop_word():
+    texts = ["on the day of the resurrection", "the day of resurrection",
+             "of the day the resurrection", "the the day"]
+    index = build(texts)
+    assert [doc for doc, _ in index.search('"the day of the resurrection"')] == [0]
+    assert [doc for doc, _ in index.search('"the the"')] == [3]
+    assert [doc for doc, _ in index.search('"of the" NEAR/3 resurrection')] == [0, 2]
@@ -0,0 +1,32 @@
+from reference_parser import ReferenceResolver
+
+SURAHS = [
+    {"id": 1, "name": "Al-Fatihah", "ar": "الفاتحة", "translation": "The Opening", "verses": 7},
+    {"id": 2, "name": "Al-Baqarah", "ar": "البقرة", "translation": "The Cow", "verses": 286},
+]
+
+
+class FakeVerses:
+    def row(self, surah_id, ayah_number):
+        return (surah_id, ayah_number)
+
+
+def make_resolver():
+    return ReferenceResolver(FakeVerses(), SURAHS)
+
+
+def test_multiline_query_is_not_a_reference():
+    resolver = make_resolver()
+    assert resolver.parse("a\nb") is None
+    assert resolver.resolve("what is\npatience") is None
+
+
+def test_multiline_reference_is_matched_as_one_line():
+    reference = make_resolver().parse("Al-Baqarah\n255")
+    assert (reference.surah_id, reference.start, reference.end) == (2, 255, 255)
+
+
+def test_numeric_reference():
+    reference, results = make_resolver().resolve("2:255-257")
+    assert (reference.surah_id, reference.start, reference.end) == (2, 255, 257)
+    assert results == [((2, 255), 1.0), ((2, 256), 1.0), ((2, 257), 1.0)]
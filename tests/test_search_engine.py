@@ -0,0 +1,30 @@
+from search_engine import arabic_search, bm25_search
+
+
+class FakeIndex:
+    """Returns fixed (verse index, raw BM25 score) hits, best first."""
+
+    def __init__(self, hits):
+        self.hits = hits
+
+    def search(self, query, top_k=5):
+        return self.hits[:top_k]
+
+
+VERSES = [{"surah_id": 1, "ayah_number": n} for n in range(1, 8)]
+
+
+def test_bm25_scores_are_relative_to_the_top_hit():
+    results = bm25_search("mercy", VERSES, FakeIndex([(2, 10.55), (0, 5.275), (4, 1.0)]))
+    assert [verse["ayah_number"] for verse, _ in results] == [3, 1, 5]
+    assert [score for _, score in results] == [1.0, 0.5, 1.0 / 10.55]
+
+
+def test_arabic_scores_fit_the_match_display():
+    results = arabic_search("رحمة", VERSES, FakeIndex([(6, 3.94), (1, 2.0)]))
+    assert results[0][1] == 1.0
+    assert all(0.0 <= score <= 1.0 for _, score in results)
+
+
+def test_no_hits():
+    assert bm25_search("zzz", VERSES, FakeIndex([])) == []
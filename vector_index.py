@@ -0,0 +1,200 @@
+import json
+import os
+
+import numpy as np
+
+from corpus_store import make_scratch_dir, replace_dir
+from keyword_index import top_k_indices
+
+# --- Exact Vector Search ---
+# util.cos_sim re-normalized the whole (verses x dim) matrix on every query.
+# Here the corpus is normalized once at load time and kept as one contiguous
+# matrix, so cosine similarity is a single matrix-vector product followed by
+# argpartition and a small sort. Everything is plain NumPy: no torch tensors.
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    # float16 rows are upcast in blocks of this many rows (NumPy has no fp16 BLAS)
+    BLOCK_ROWS = 2048
+
+    def __init__(self, matrix):
+        """'matrix' must already hold unit-length rows (see from_vectors)."""
+        self.matrix = matrix
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    @classmethod
+    def from_vectors(cls, vectors, dtype="float32"):
+        """
+        Normalizes 'vectors' once. Rows that are already unit length (the MiniLM
+        pipeline normalizes its output) are used as they are, so a float32
+        memory map stays shared instead of being copied into every worker.
+        """
+        norms = np.linalg.norm(np.asarray(vectors, dtype=np.float32), axis=1)
+        if vectors.dtype == np.float32 and np.allclose(norms, 1.0, atol=1e-3):
+            matrix = vectors
+        else:
+            matrix = normalize_rows(vectors)
+        if dtype == "float16":
+            matrix = matrix.astype(np.float16)
+        return cls(np.ascontiguousarray(matrix))
+
+    def scores(self, queries):
+        """Cosine similarity of (n x dim) unit queries with every row -> (n x rows)."""
+        if self.matrix.dtype == np.float32:
+            return queries @ self.matrix.T
+        out = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.BLOCK_ROWS):
+            block = self.matrix[start:start + self.BLOCK_ROWS].astype(np.float32)
+            out[:, start:start + len(block)] = queries @ block.T
+        return out
+
+    def search(self, query, top_k=5):
+        """Returns up to top_k (row, cosine) pairs for one query vector, best first."""
+        return self.search_batch(np.asarray(query)[None, :], top_k)[0]
+
+    def search_batch(self, queries, top_k=5):
+        """Scores many queries with one GEMM. Returns one (row, cosine) list per query."""
+        scores = self.scores(normalize_rows(np.atleast_2d(queries)))
+        results = []
+        for row in scores:
+            results.append([(int(i), float(row[i])) for i in top_k_indices(row, top_k)])
+        return results
+
+
+# --- Approximate Search (IVF-flat) ---
+# Once tafsir chunks, Urdu/Arabic vectors and extra translations are embedded,
+# a full scan per query no longer scales. An inverted-file index clusters the
+# vectors with spherical k-means; a query scores only the vectors of its
+# 'nprobe' closest clusters. Rows are stored grouped by cluster, so each probed
+# list is one contiguous slice of the (memory-mapped) matrix.
+#
+# On disk (next to the embedding store):
+#   header.json    -> version, key of the embeddings it was built from, sizes
+#   centroids.npy  -> (n_lists x dim) unit centroids
+#   list_ptr.npy   -> rows of list 'l' are list_ptr[l]:list_ptr[l + 1]
+#   ids.npy        -> original row id of every stored row
+#   vectors.npy    -> (rows x dim) unit vectors, grouped by list
+
+IVF_VERSION = 1
+
+
+def _assign(vectors, centroids, block=8192):
+    """Index of the most similar centroid for every row (blocked to bound memory)."""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block):
+        out[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(vectors, n_lists, iterations=20, sample=64, seed=0):
+    """Cosine k-means on (a sample of) unit vectors; returns unit centroids."""
+    rng = np.random.default_rng(seed)
+    train = vectors
+    if len(vectors) > n_lists * sample:
+        train = vectors[np.sort(rng.choice(len(vectors), n_lists * sample, replace=False))]
+    train = np.asarray(train, dtype=np.float32)
+    centroids = train[rng.choice(len(train), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(train, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        empty = counts == 0
+        # Per-cluster sums via one sort + reduceat (np.add.at is very slow)
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(train[order], starts[~empty], axis=0)
+        # Re-seed empty clusters with random training points
+        sums[empty] = train[rng.choice(len(train), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids, list_ptr, ids, vectors, header=None, nprobe=8):
+        self.centroids = centroids
+        self.list_ptr = list_ptr
+        self.ids = ids
+        self.vectors = vectors
+        self.header = header or {}
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, key="", iterations=20, seed=0):
+        """Clusters unit-normalized copies of 'vectors'. n_lists defaults to ~4*sqrt(rows)."""
+        vectors = normalize_rows(vectors)
+        n_lists = min(len(vectors), n_lists or max(1, int(4 * np.sqrt(len(vectors)))))
+        centroids = spherical_kmeans(vectors, n_lists, iterations=iterations, seed=seed)
+
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        list_ptr = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_lists)))).astype(np.int64)
+        header = {"version": IVF_VERSION, "key": key, "n_lists": n_lists, "rows": len(vectors),
+                  "dim": int(vectors.shape[1])}
+        return cls(centroids, list_ptr, order.astype(np.int32), np.ascontiguousarray(vectors[order]), header)
+
+    def save(self, index_dir):
+        tmp_dir = make_scratch_dir(index_dir)
+        np.save(os.path.join(tmp_dir, "centroids.npy"), self.centroids)
+        np.save(os.path.join(tmp_dir, "list_ptr.npy"), self.list_ptr)
+        np.save(os.path.join(tmp_dir, "ids.npy"), self.ids)
+        np.save(os.path.join(tmp_dir, "vectors.npy"), self.vectors)
+        with open(os.path.join(tmp_dir, "header.json"), "w", encoding="utf-8") as f:
+            json.dump(self.header, f, indent=2)
+        replace_dir(tmp_dir, index_dir)
+
+    @classmethod
+    def load(cls, index_dir, nprobe=8, mmap_mode="r"):
+        with open(os.path.join(index_dir, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("version") != IVF_VERSION:
+            raise ValueError(f"Unsupported IVF index version in '{index_dir}'")
+
+        def array(name, mmap=None):
+            return np.load(os.path.join(index_dir, name), mmap_mode=mmap)
+
+        return cls(array("centroids.npy"), array("list_ptr.npy"), array("ids.npy", mmap_mode),
+                   array("vectors.npy", mmap_mode), header, nprobe=nprobe)
+
+    def search(self, query, top_k=5, nprobe=None):
+        return self.search_batch(np.asarray(query)[None, :], top_k, nprobe)[0]
+
+    def search_batch(self, queries, top_k=5, nprobe=None):
+        """Same contract as VectorIndex.search_batch; scans only the 'nprobe' closest lists."""
+        queries = normalize_rows(np.atleast_2d(queries))
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+
+        results = []
+        for query, lists in zip(queries, probes):
+            spans = [(self.list_ptr[l], self.list_ptr[l + 1]) for l in lists]
+            # Each list is a contiguous slice: no gather copy, one small GEMV per list
+            scores = np.concatenate([self.vectors[a:b] @ query for a, b in spans])
+            ids = np.concatenate([self.ids[a:b] for a, b in spans])
+            results.append([(int(ids[i]), float(scores[i])) for i in top_k_indices(scores, top_k)])
+        return results
+
+
+def recall_at_k(truth, found):
+    """Mean fraction of the exact results ('truth') present in the approximate ones ('found')."""
+    hits = [len({i for i, _ in t} & {i for i, _ in f}) / max(len(t), 1) for t, f in zip(truth, found)]
+    return float(np.mean(hits)) if hits else 0.0